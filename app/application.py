@@ -1,11 +1,46 @@
 import os
-from flask import Flask, render_template, request, jsonify
+import hmac
+import atexit
+import json
+import math
+import time
+import functools
+from contextlib import contextmanager
+from datetime import datetime
+from flask import Flask, Response, g, render_template, request, jsonify
+from werkzeug.exceptions import HTTPException
 from PIL import Image
 
 try:
-    from yolomodel import yolo  
+    from yolomodel import yolo, create_model
+    from uploads import SpooledRequest, open_upload, max_upload_bytes
+    from imageprobe import decode_image, ImageTooLarge, tile_threshold, TooManyFrames, frame_indices, \
+        read_frame
+    from pipeline import Failed
+    from livestream import boundary as stream_boundary
+    import render
+    from jobs import JobQueue
+    from counts import CountStore, counts_enabled, resolutions
+    from sources import SourceManager, SourceLimit, check_url
+    from memprof import MemoryTracker
+    from boxes import select, count_classes, clip_rois
+    from rawframes import parse_frame_spec, decode_frame, parse_letterbox
+    from qos import QosScheduler, QueueTimeout, load_api_keys, resolve_class
 except:
-    from .yolomodel import yolo  
+    from .yolomodel import yolo, create_model
+    from .uploads import SpooledRequest, open_upload, max_upload_bytes
+    from .imageprobe import decode_image, ImageTooLarge, tile_threshold, TooManyFrames, frame_indices, \
+        read_frame
+    from .pipeline import Failed
+    from .livestream import boundary as stream_boundary
+    from . import render
+    from .jobs import JobQueue
+    from .counts import CountStore, counts_enabled, resolutions
+    from .sources import SourceManager, SourceLimit, check_url
+    from .memprof import MemoryTracker
+    from .boxes import select, count_classes, clip_rois
+    from .rawframes import parse_frame_spec, decode_frame, parse_letterbox
+    from .qos import QosScheduler, QueueTimeout, load_api_keys, resolve_class
 
 # Configuración de rutas
 base_dir = os.path.abspath(os.path.dirname(__file__))
@@ -13,65 +48,742 @@ template_dir = os.path.join(base_dir, 'templates')
 static_dir = os.path.join(base_dir, 'static')
 
 application = Flask(__name__, template_folder=template_dir, static_folder=static_dir)
+# Las subidas se escriben por bloques a un archivo temporal con tope de tamaño;
+# werkzeug rechaza con 413 antes de leer el cuerpo si Content-Length supera el límite
+application.request_class = SpooledRequest
+application.config['MAX_CONTENT_LENGTH'] = max_upload_bytes + 64 * 1024
+
+allowed_extensions = {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp', 'tif', 'tiff'}
+
+# Cola de trabajos asíncronos; los workers arrancan con la primera petición a /jobs
+# o al importar la aplicación si YOLO_JOBS_AUTOSTART=1
+job_queue = JobQueue(model_factory=create_model)
+if os.getenv('YOLO_JOBS_AUTOSTART') == '1':
+    job_queue.start()
+
+# Conteos guardados como serie temporal; la escritura es por lotes en segundo plano.
+# Lo que quede en el búfer se vuelca al salir (gunicorn además llama a stop() en worker_exit)
+count_store = CountStore() if counts_enabled else None
+
+
+def flush_counts():
+    if count_store is not None:
+        count_store.stop()
+
+atexit.register(flush_counts)
+
+# Fuentes en vivo (cámaras, streams); YOLO_SOURCES apunta a un JSON con
+# [{"id": ..., "url": ..., "weight": ...}] que se abre al iniciar. El registro es de cada
+# proceso: con varios workers de gunicorn, GET/DELETE/stream de una fuente pueden caer en
+# otro worker y dar 404. Use un solo worker (WEB_CONCURRENCY=1) para las fuentes o ponga
+# app/router.py delante, que envía todas las peticiones de una fuente al mismo worker
+def record_source_counts(source_id, countings, ts):
+    if count_store is not None:
+        count_store.record(source_id, countings, ts)
+
+
+def new_source_manager():
+    return SourceManager(model_factory=create_model, on_result=record_source_counts)
+
+
+def start_configured_sources():
+    manager = new_source_manager()
+    if os.getenv('YOLO_SOURCES'):
+        with open(os.getenv('YOLO_SOURCES')) as f:
+            for item in json.load(f):
+                manager.add(item['id'], item['url'], float(item.get('weight', 1.0)), rois=item.get('rois'),
+                            motion_threshold=item.get('motion_threshold'),
+                            motion_max_interval=item.get('motion_max_interval'))
+    return manager
+
+
+# Con --preload gunicorn.conf.py pone YOLO_DEFER_START=1: el maestro no abre las fuentes
+# (sus hilos no pasarían al fork) y cada worker las abre en restart_after_fork
+defer_start = os.getenv('YOLO_DEFER_START') == '1'
+stream_any_worker = os.getenv('YOLO_STREAM_ANY_WORKER') == '1'
+source_manager = new_source_manager() if defer_start else start_configured_sources()
+
+
+def restart_after_fork():
+    # Con --preload la app se importa en el maestro; los hilos no sobreviven al fork,
+    # así que cada worker vuelve a arrancar los que estaban activos
+    global source_manager
+    if job_queue.threads:
+        job_queue.threads = []
+        job_queue.start()
+    # El escritor de conteos del padre no existe en el hijo y sus locks pudieron quedar tomados
+    if count_store is not None:
+        count_store.after_fork()
+    # El registro de fuentes heredado tiene hilos muertos: el hijo empieza con uno nuevo y,
+    # si el arranque se difirió, abre aquí las fuentes configuradas
+    if defer_start:
+        source_manager = start_configured_sources()
+    elif source_manager.sources:
+        source_manager = new_source_manager()
+
+os.register_at_fork(after_in_child=restart_after_fork)
+
+# Memoria por petición (RSS y pico) y, con YOLO_TRACEMALLOC=N, asignaciones Python
+memory = MemoryTracker()
+admin_token = os.getenv('YOLO_ADMIN_TOKEN')
+
+# Cola con prioridades para el modelo compartido: interactive > standard > bulk.
+# La clase sale de la API key (X-API-Key); X-Priority-Class (o priority_class) solo
+# puede bajarla y sin una clave válida se ignora
+scheduler = QosScheduler()
+api_keys = load_api_keys()
+
+def flag_param(name):
+    # Parámetro booleano opcional en el formulario o en la query string
+    value = request.form.get(name, request.args.get(name))
+    if value is None:
+        return None
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+@application.errorhandler(QueueTimeout)
+def queue_timeout(e):
+    print(f"Petición rechazada: {str(e)}")
+    response = jsonify({'error': 'Servicio saturado, reintente más tarde', 'class': e.qos_class})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+@application.after_request
+def queue_wait_header(response):
+    if 'qos' in g:
+        response.headers['X-Queue-Wait-Ms'] = str(g.qos['wait_ms'])
+        response.headers['X-Priority-Class'] = g.qos['class']
+    return response
+
+@application.errorhandler(413)
+def upload_too_large(e):
+    print("Subida rechazada por exceder el tamaño máximo")
+    return jsonify({'error': 'El archivo excede el tamaño máximo permitido',
+                    'max_bytes': max_upload_bytes}), 413
 
 @application.route('/')
 def index():
-    return render_template('index.html')
+    # El navegador reduce la imagen al tamaño de entrada del modelo antes de subirla
+    return render_template('index.html', input_size=yolo.input_shape[1])
 
-@application.route('/detect-count', methods=['POST'])
-def predict():
+@application.route('/healthz')
+def healthz():
+    # Chequeo barato para el router y los balanceadores: el proceso responde y el modelo está cargado
+    return jsonify({'status': 'ok', 'pid': os.getpid(), 'input_shape': list(yolo.input_shape)})
+
+def allowed_file(filename):
+    return '.' in filename and filename.split('.')[-1].lower() in allowed_extensions
+
+def validate_upload():
+    # Devuelve (archivo, None) o (None, respuesta de error)
     # 1. Verificar que se haya subido un archivo
     if 'image' not in request.files:
         print("No se proporcionó archivo en la solicitud")
-        return jsonify({'error': 'No se proporcionó imagen'}), 400
+        return None, (jsonify({'error': 'No se proporcionó imagen'}), 400)
     
     file = request.files['image']
     
     # 2. Verificar que el archivo tenga nombre
     if file.filename == '':
         print("Se envió un archivo sin nombre")
-        return jsonify({'error': 'No se seleccionó ningún archivo'}), 400
+        return None, (jsonify({'error': 'No se seleccionó ningún archivo'}), 400)
     
     # 3. Verificar extensión del archivo
-    allowed_extensions = {'jpg', 'jpeg', 'png', 'gif', 'bmp'}
-    if '.' not in file.filename or file.filename.split('.')[-1].lower() not in allowed_extensions:
+    if not allowed_file(file.filename):
         print(f"Extensión de archivo no permitida: {file.filename}")
-        return jsonify({'error': 'Tipo de archivo no soportado'}), 400
-    
+        return None, (jsonify({'error': 'Tipo de archivo no soportado'}), 400)
+
+    return file, None
+
+def parse_rois(value):
+    # Regiones de interés en píxeles de la imagen original: "x0,y0,x1,y1;x0,y0,x1,y1"
+    # o JSON [[x0, y0, x1, y1], ...]
+    if not value:
+        return None
+    value = value.strip()
+    items = json.loads(value) if value.startswith('[') else [v.split(',') for v in value.split(';') if v.strip()]
     try:
-        # 4. Verificar que sea una imagen válida
-        file.stream.seek(0)
-        image = Image.open(file.stream)
-        image.verify()
-        file.stream.seek(0)
-        image = Image.open(file.stream)
-        
-        # 5. Procesar la imagen con YOLO
+        rois = [tuple(float(c) for c in item) for item in items]
+    except TypeError:
+        raise ValueError('ROI inválida')
+    if not rois or any(len(roi) != 4 for roi in rois):
+        raise ValueError('ROI inválida')
+    # nan/inf llegarían a int(np.floor(...)) al recortar las ventanas
+    if not all(math.isfinite(c) for roi in rois for c in roi):
+        raise ValueError('ROI con coordenadas no finitas')
+    return rois
+
+response_fields = ('countings', 'detections')
+
+def parse_fields(value):
+    # fields=countings omite la conversión de cajas y la serialización de detecciones
+    if not value:
+        return response_fields
+    fields = tuple(f.strip() for f in value.split(',') if f.strip())
+    if not fields or any(f not in response_fields for f in fields):
+        raise ValueError('Campo de respuesta inválido')
+    return fields
+
+def parse_filters():
+    # min_score: umbral global "0.4", por clase "person:0.6,car:0.3" (un número suelto o
+    # '*:0.4' es el umbral de las demás clases) o JSON {"person": 0.6}.
+    # class: clases permitidas separadas por comas. Se aplican sobre el arreglo de salida
+    value = (request.values.get('min_score') or '').strip()
+    min_score = None
+    if value.startswith('{'):
+        items = json.loads(value)
+        if not isinstance(items, dict):
+            raise ValueError('Umbral inválido')
         try:
-            _, outputs, c_classes = yolo.inference(file)
-            detections = [
-                (yolo.convertbox([x0, y0, x1, y1]), int(cls_id), str(prob), yolo.class_names[int(cls_id)])
-                for (batch_id, x0, y0, x1, y1, cls_id, prob) in outputs
-            ]
-            
-            return jsonify(countings=c_classes, detections=detections)
+            min_score = {str(k): float(v) for k, v in items.items()}
+        except TypeError:
+            # null, listas u objetos como umbral
+            raise ValueError('Umbral inválido')
+    elif value:
+        min_score = {}
+        for item in value.split(','):
+            name, _, score = item.rpartition(':')
+            min_score[name.strip() or '*'] = float(score)
+    if min_score and not all(math.isfinite(score) for score in min_score.values()):
+        raise ValueError('Umbral no finito')
+    classes = [v.strip() for v in request.values.get('class', '').split(',') if v.strip()] or None
+    names = set(classes or []) | (set(min_score or {}) - {'*'})
+    if names and names - set(yolo.class_names):
+        raise ValueError('Clase desconocida')
+    return min_score, classes
+
+def parse_client_transform():
+    # Subidas reducidas en el navegador (static/js/script.js): client_scale es el ancho
+    # subido / ancho original y letterbox=ratio,dw,dh indica que la imagen ya viene
+    # letterboxeada al tamaño de entrada. Las cajas se devuelven en coordenadas originales
+    client_scale = float(request.values.get('client_scale') or 1.0)
+    if not 0 < client_scale <= 1:
+        raise ValueError('Escala del cliente inválida')
+    return client_scale, parse_letterbox(request.values.get('letterbox'))
+
+def request_class():
+    # Clase de prioridad de la petición; ValueError si la pedida no existe
+    return resolve_class(request.headers.get('X-Priority-Class') or request.values.get('priority_class'),
+                         request.headers.get('X-API-Key'), api_keys)
+
+@contextmanager
+def model_slot(qos_class):
+    # Turno en la cola del modelo (YOLO_INFER_SLOTS inferencias simultáneas). yolo.ratio
+    # y yolo.dwdh son del hilo de la petición: las inferencias concurrentes no los pisan
+    with scheduler.slot(qos_class) as ticket:
+        g.qos = ticket
+        yield ticket
+
+def parse_frames():
+    # frame_step=k procesa uno de cada k cuadros; aggregate=max|mean resume los conteos
+    step = int(request.values.get('frame_step', 1))
+    aggregate = request.values.get('aggregate', 'max').lower()
+    if step < 1 or aggregate not in ('max', 'mean'):
+        raise ValueError(step, aggregate)
+    return step, aggregate
+
+def decode_upload(file, rois=None, tiled=None):
+    # 4. Verificar que sea una imagen válida y decodificarla una sola vez,
+    # leyendo directamente de la subida en disco (sin copias en memoria).
+    # Las dimensiones se leen del encabezado antes de decodificar cualquier píxel
+    tiled = flag_param('tiled') if tiled is None else tiled
+    with open_upload(file) as data:
+        return decode_image(data, tiled=tiled, tile_threshold=tile_threshold, rois=rois)
+
+def merge_mode():
+    # merge=nms|wbf para unir los mosaicos; boxes.nms tomaría cualquier otro valor como nms
+    merge = request.values.get('merge', 'nms')
+    if merge not in ('nms', 'wbf'):
+        raise ValueError(f'merge debe ser nms o wbf: {merge}')
+    return merge
+
+def check_rois(rois, image, info, client_scale=1.0):
+    # Las ROIs se recortan contra la imagen decodificada antes de esperar turno, con la
+    # misma escala que run_model: ValueError si ninguna cae dentro (400, no 500)
+    if rois:
+        clip_rois(rois, image.size[0], image.size[1], image.size[0] / info.width * client_scale)
+
+def run_model(image, info, plan, rois=None, client_scale=1.0, letterbox=None):
+    # 5. Procesar la imagen con YOLO. scale lleva de la imagen original a la decodificada,
+    # pasando por la reducción hecha en el cliente
+    with memory.measure('inference'):
+        if letterbox:
+            return yolo.inference_letterboxed(yolo.load_image(image), *letterbox)
+        scale = image.size[0] / info.width * client_scale
+        if rois:
+            return yolo.inference_rois(image, rois, scale=scale)
+        if plan.strategy == 'tiled':
+            return yolo.inference_tiled(image, merge=merge_mode())
+        return yolo.inference(image, scale=scale)
+
+def frames_response(file, info, rois, fields, step, aggregate, min_score=None, classes=None, scale=1.0):
+    # GIF animado o TIFF multipágina: los cuadros se decodifican de a uno en la etapa de
+    # decodificación del pipeline (un solo hilo, seeks en orden) y se infieren por lotes;
+    # solo se conservan los conteos y las cajas de cada cuadro, nunca los píxeles.
+    # scale: tamaño de la subida / original (reducción hecha en el cliente)
+    indices = frame_indices(info, step)
+    rows, peaks, sums = [], {}, {}
+    with open_upload(file) as data, memory.measure('inference'):
+        image = Image.open(data)
+
+        def load(index):
+            return {'img': read_frame(image, index, info.orientation), 'frame': index, 'rois': rois, 'scale': scale}
+
+        pipeline = yolo.make_pipeline(loader=load, decode_workers=1, maxsize=yolo.batch_size)
+        for item in pipeline.map(indices):
+            if isinstance(item, Failed):
+                raise item.error
+            outputs, c_classes = item['outputs'], item['countings']
+            if min_score is not None or classes:
+                outputs = select(outputs, yolo.class_names, min_score, classes)
+                c_classes = count_classes(outputs, yolo.class_names)
+            row = {'frame': item['frame']}
+            if 'countings' in fields:
+                row['countings'] = c_classes
+            if 'detections' in fields:
+                row['detections'] = yolo.format_detections(outputs)
+            rows.append(row)
+            for name, n in c_classes.items():
+                peaks[name] = max(peaks.get(name, 0), n)
+                sums[name] = sums.get(name, 0) + n
+
+    # En la serie temporal la subida cuenta como una observación con el máximo por clase
+    record_counts(peaks)
+    if aggregate == 'mean':
+        totals = {name: round(n / len(rows), 2) for name, n in sums.items()}
+    else:
+        totals = peaks
+    totals = dict(sorted(totals.items(), key=lambda kv: -kv[1]))
+    result = {'frame_count': info.frames, 'frames_processed': len(rows), 'frame_step': step,
+              'aggregate': aggregate, 'frames': rows}
+    if 'countings' in fields:
+        result['countings'] = totals
+    return jsonify(result)
+
+def image_errors(view):
+    # Errores comunes al leer y decodificar la imagen subida
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            return view(*args, **kwargs)
+
+        except (HTTPException, QueueTimeout):
+            raise
+
+        except TooManyFrames as e:
+            print(f"Imagen rechazada por presupuesto de cuadros: {str(e)}")
+            return jsonify({'error': 'La imagen excede el número máximo de cuadros permitido',
+                            'details': str(e), 'frames': e.info.frames, 'max_frames': e.budget}), 413
+
+        except (ImageTooLarge, Image.DecompressionBombError) as e:
+            print(f"Imagen rechazada por presupuesto de píxeles: {str(e)}")
+            return jsonify({'error': 'La imagen excede el número máximo de píxeles permitido',
+                            'details': str(e)}), 413
+
+        except (IOError, OSError) as e:
+            print(f"Error al procesar imagen: {str(e)}")
+            return jsonify({'error': 'El archivo no es una imagen válida o está corrupto'}), 400
             
+        except Exception as e:
+            print(f"Error inesperado: {str(e)}")
+            return jsonify({'error': 'Error interno del servidor'}), 500
+    return wrapper
+
+def record_counts(c_classes):
+    # Fuente: parámetro source o encabezado X-Source. timestamp opcional (época o ISO 8601)
+    # para registrar la hora de captura en lugar de la de recepción
+    if count_store is None:
+        return
+    source = request.values.get('source') or request.headers.get('X-Source', 'default')
+    count_store.record(source, c_classes, request_timestamp())
+
+def request_timestamp():
+    # Se valida junto con los demás parámetros, antes de la inferencia (400 si es inválido)
+    value = request.values.get('timestamp')
+    return parse_time(value) if value else None
+
+def parse_time(value):
+    # Época o ISO 8601; inf/nan se rechazan (no tienen bucket en la serie temporal)
+    try:
+        ts = float(value)
+    except ValueError:
+        ts = datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    if not math.isfinite(ts):
+        raise ValueError(f'Marca de tiempo no finita: {value}')
+    return ts
+
+def model_error(yolo_error):
+    print(f"Error en el modelo YOLO: {str(yolo_error)}")
+    return jsonify({
+        'error': 'Error en el procesamiento del modelo',
+        'details': str(yolo_error)
+    }), 500
+
+def count_response(outputs, c_classes, fields, min_score=None, classes=None):
+    # Filtros por clase, registro de conteos y respuesta JSON de /detect-count
+    if min_score is not None or classes:
+        outputs = select(outputs, yolo.class_names, min_score, classes)
+        c_classes = count_classes(outputs, yolo.class_names)
+    record_counts(c_classes)
+
+    result = {}
+    if 'countings' in fields:
+        result['countings'] = c_classes
+    if 'detections' in fields:
+        result['detections'] = [
+            (yolo.convertbox([x0, y0, x1, y1]), int(cls_id), str(prob), yolo.class_names[int(cls_id)])
+            for (batch_id, x0, y0, x1, y1, cls_id, prob) in outputs
+        ]
+    return jsonify(result)
+
+def measured(label):
+    # Mide la memoria de toda la vista (decodificación, inferencia y respuesta)
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with memory.measure(label):
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@application.route('/detect-count', methods=['POST'])
+@measured('predict')
+@image_errors
+def predict():
+    file, error = validate_upload()
+    if error:
+        return error
+    try:
+        rois = parse_rois(request.values.get('roi'))
+    except ValueError:
+        return jsonify({'error': 'Región de interés inválida'}), 400
+    try:
+        fields = parse_fields(request.values.get('fields'))
+        min_score, classes = parse_filters()
+        client_scale, letterbox = parse_client_transform()
+        qos_class = request_class()
+        frame_step, aggregate = parse_frames()
+        merge_mode()
+        request_timestamp()
+    except ValueError:
+        return jsonify({'error': 'Campos, umbrales, clases, escala, cuadros, clase de prioridad, merge o '
+                                 'timestamp inválidos'}), 400
+    if letterbox and rois:
+        return jsonify({'error': 'letterbox no se combina con regiones de interés'}), 400
+
+    # Una imagen ya reducida por el cliente nunca va por mosaicos; las ROIs llegan en
+    # coordenadas originales y se llevan a las de la subida para planear la decodificación
+    client_resized = client_scale < 1 or letterbox is not None
+    image, info, plan = decode_upload(file, rois and [tuple(c * client_scale for c in roi) for roi in rois],
+                                      tiled=False if client_resized else None)
+    if letterbox and tuple(image.size[::-1]) != tuple(yolo.input_shape):
+        return jsonify({'error': 'La imagen letterboxeada no tiene el tamaño de entrada del modelo'}), 400
+    try:
+        check_rois(rois, image, info, client_scale)
+    except ValueError as e:
+        return jsonify({'error': 'Región de interés inválida', 'details': str(e)}), 400
+    if info.frames > 1 and not letterbox:
+        frame_indices(info, frame_step)  # presupuesto antes de esperar turno
+        with model_slot(qos_class):
+            try:
+                return frames_response(file, info, rois, fields, frame_step, aggregate, min_score, classes,
+                                       client_scale)
+            except Exception as yolo_error:
+                return model_error(yolo_error)
+    with model_slot(qos_class):
+        try:
+            _, outputs, c_classes = run_model(image, info, plan, rois, client_scale, letterbox)
+            return count_response(outputs, c_classes, fields, min_score, classes)
+
         except Exception as yolo_error:
-            print(f"Error en el modelo YOLO: {str(yolo_error)}")
-            return jsonify({
-                'error': 'Error en el procesamiento del modelo',
-                'details': str(yolo_error)
-            }), 500
-            
-    except (IOError, OSError) as e:
-        print(f"Error al procesar imagen: {str(e)}")
-        return jsonify({'error': 'El archivo no es una imagen válida o está corrupto'}), 400
-        
-    except Exception as e:
-        print(f"Error inesperado: {str(e)}")
-        return jsonify({'error': 'Error interno del servidor'}), 500
+            return model_error(yolo_error)
+
+@application.route('/detect-count/raw', methods=['POST'])
+@measured('predict_raw')
+@image_errors
+def predict_raw():
+    # Cuadro ya decodificado en el cuerpo (RGB/BGR/NV12) descrito por encabezados, ver
+    # rawframes.py: sin códec en el cliente ni decodificación y verify() en el servidor.
+    # Con X-Letterbox el cuadro ya viene al tamaño de entrada y solo se normaliza
+    try:
+        spec = parse_frame_spec(request.headers, request.args)
+        fields = parse_fields(request.values.get('fields'))
+        min_score, classes = parse_filters()
+        qos_class = request_class()
+        request_timestamp()
+        if spec.letterbox and (spec.height, spec.width) != tuple(yolo.input_shape):
+            raise ValueError(f'El cuadro letterboxeado debe medir {yolo.input_shape[0]}x{yolo.input_shape[1]}')
+        frame, bgr = decode_frame(request.get_data(cache=False), spec)
+    except ImageTooLarge:
+        raise
+    except ValueError as e:
+        print(f"Cuadro crudo rechazado: {str(e)}")
+        return jsonify({'error': 'Cuadro crudo inválido', 'details': str(e)}), 400
+
+    with model_slot(qos_class):
+        try:
+            with memory.measure('inference'):
+                if spec.letterbox:
+                    _, outputs, c_classes = yolo.inference_letterboxed(frame, *spec.letterbox, bgr=bgr)
+                else:
+                    _, outputs, c_classes = yolo.inference(frame, bgr=bgr)
+            return count_response(outputs, c_classes, fields, min_score, classes)
+
+        except Exception as yolo_error:
+            return model_error(yolo_error)
+
+@application.route('/detect-count/annotated', methods=['POST'])
+@measured('predict_annotated')
+@image_errors
+def predict_annotated():
+    # Devuelve la imagen anotada (JPEG/WebP); los conteos van en el encabezado X-Countings
+    fmt = request.values.get('format', 'jpeg').lower()
+    if fmt not in render.encoders:
+        return jsonify({'error': 'Formato de salida no soportado'}), 400
+    try:
+        quality = min(max(int(request.values.get('quality', 85)), 1), 100)
+        max_dim = int(request.values['max_dim']) if request.values.get('max_dim') else None
+        if max_dim is not None and max_dim <= 0:
+            raise ValueError(f'max_dim debe ser positivo: {max_dim}')
+        rois = parse_rois(request.values.get('roi'))
+        qos_class = request_class()
+        merge_mode()
+        request_timestamp()
+    except ValueError:
+        return jsonify({'error': 'Parámetros de salida inválidos'}), 400
+
+    file, error = validate_upload()
+    if error:
+        return error
+
+    image, info, plan = decode_upload(file, rois)
+    try:
+        check_rois(rois, image, info)
+    except ValueError as e:
+        return jsonify({'error': 'Región de interés inválida', 'details': str(e)}), 400
+    with model_slot(qos_class):
+        try:
+            start = time.perf_counter()
+            img, outputs, c_classes = run_model(image, info, plan, rois)
+            ratio, dwdh = yolo.ratio, yolo.dwdh
+            inference_ms = (time.perf_counter() - start) * 1000
+        except Exception as yolo_error:
+            return model_error(yolo_error)
+
+    # El dibujo y la codificación no ocupan el turno del modelo
+    try:
+        # Las cajas vuelven a coordenadas originales; box_scale las lleva a la imagen decodificada
+        start = time.perf_counter()
+        img = render.as_array(img)
+        canvas = render.annotate(img, outputs, ratio, dwdh, yolo.class_names, yolo.colors,
+                                 box_scale=img.shape[1] / info.width, max_dim=max_dim, bgr=True)
+        data, mimetype = render.encode(canvas, fmt, quality)
+        render_ms = (time.perf_counter() - start) * 1000
+
+    except Exception as yolo_error:
+        return model_error(yolo_error)
+
+    record_counts(c_classes)
+    response = Response(data, mimetype=mimetype)
+    response.headers['X-Countings'] = json.dumps(c_classes)
+    response.headers['X-Inference-Ms'] = f'{inference_ms:.1f}'
+    response.headers['X-Render-Ms'] = f'{render_ms:.1f}'
+    return response
+
+
+@application.route('/jobs', methods=['POST'])
+def create_job():
+    # Encola una o varias imágenes y devuelve el id del trabajo (202). Con la misma
+    # Idempotency-Key se devuelve el trabajo existente en lugar de crear otro
+    files = [f for f in request.files.getlist('image') if f.filename]
+    if not files:
+        print("No se proporcionó archivo en la solicitud")
+        return jsonify({'error': 'No se proporcionó imagen'}), 400
+    for f in files:
+        if not allowed_file(f.filename):
+            print(f"Extensión de archivo no permitida: {f.filename}")
+            return jsonify({'error': 'Tipo de archivo no soportado'}), 400
+    try:
+        priority = int(request.values.get('priority', 0))
+        rois = parse_rois(request.values.get('roi'))
+        # mosaic=2|3: las miniaturas del trabajo se empaquetan en un mismo lienzo de entrada
+        mosaic = int(request.values.get('mosaic') or 0)
+        if mosaic not in (0, 2, 3):
+            raise ValueError(mosaic)
+    except ValueError:
+        return jsonify({'error': 'Prioridad, región de interés o mosaic inválido'}), 400
+
+    params = {
+        'rois': rois,
+        'tiled': flag_param('tiled'),
+        'merge': request.values.get('merge', 'nms'),
+        'tile_threshold': tile_threshold,
+        'mosaic': mosaic,
+    }
+    key = request.headers.get('Idempotency-Key') or request.values.get('idempotency_key')
+    job_queue.start()
+    job, created = job_queue.submit([(f.filename, f) for f in files], params, priority, key)
+    response = jsonify(JobQueue.to_json(job))
+    response.status_code = 202 if created else 200
+    response.headers['Location'] = f"/jobs/{job['id']}"
+    return response
 
+@application.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    # ?wait=N espera hasta N segundos (máximo 60) a que el trabajo termine
+    try:
+        wait = float(request.args.get('wait', 0))
+        if not (math.isfinite(wait) and wait >= 0):
+            raise ValueError(wait)
+    except ValueError:
+        return jsonify({'error': 'Parámetro wait inválido'}), 400
+    job_queue.start()
+    job = job_queue.wait(job_id, timeout=wait)
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado o expirado'}), 404
+    return jsonify(JobQueue.to_json(job))
+
+@application.route('/counts', methods=['GET'])
+def get_counts():
+    # Conteos acumulados por rango de tiempo. Parámetros: start/end (época o ISO 8601;
+    # por defecto las últimas 24 h), resolution (minute/hour/day; automática según el
+    # rango), group_by (combinación de bucket, source y class) y filtros source/class
+    # separados por comas
+    if count_store is None:
+        return jsonify({'error': 'El almacenamiento de conteos está deshabilitado'}), 404
+    try:
+        end = parse_time(request.args['end']) if request.args.get('end') else time.time()
+        start = parse_time(request.args['start']) if request.args.get('start') else end - 86400
+    except ValueError:
+        return jsonify({'error': 'Rango de tiempo inválido'}), 400
+    resolution = request.args.get('resolution') or None
+    group_by = [g for g in request.args.get('group_by', 'bucket,class').split(',') if g]
+    if start >= end or (resolution and resolution not in resolutions) \
+            or any(g not in ('bucket', 'source', 'class') for g in group_by):
+        return jsonify({'error': 'Parámetros de consulta inválidos'}), 400
+
+    sources = [v for v in request.args.get('source', '').split(',') if v] or None
+    classes = [v for v in request.args.get('class', '').split(',') if v] or None
+    result = count_store.query(start, end, resolution, group_by, sources, classes)
+    result['images'] = count_store.images(start, end, result['resolution'], sources)
+    return jsonify(result)
+
+def admin_denied():
+    # Se exige el encabezado X-Admin-Token igual a YOLO_ADMIN_TOKEN; sin token configurado
+    # los endpoints de administración quedan cerrados. La dirección del par no sirve para
+    # decidir: detrás del nginx de Elastic Beanstalk todas las peticiones llegan de 127.0.0.1
+    if not admin_token:
+        return jsonify({'error': 'Administración deshabilitada: configure YOLO_ADMIN_TOKEN'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), admin_token.encode()):
+        return jsonify({'error': 'No autorizado'}), 403
+    return None
+
+@application.route('/sources', methods=['GET'])
+def list_sources():
+    # FPS logrado, retraso y cuadros descartados por fuente, más la ocupación del pipeline
+    return jsonify(source_manager.stats())
+
+@application.route('/sources', methods=['POST'])
+def add_source():
+    # Solo administradores: el servidor abre la URL y le dedica un hilo lector. Se aceptan
+    # URLs de red con los esquemas de YOLO_SOURCE_SCHEMES (archivos y cámaras locales solo
+    # desde YOLO_SOURCES)
+    denied = admin_denied()
+    if denied:
+        return denied
+    data = request.get_json(silent=True) or request.form
+    source_id, url = data.get('id'), data.get('url')
+    if not source_id or not url:
+        return jsonify({'error': 'Se requieren id y url'}), 400
+    try:
+        check_url(url)
+    except ValueError as e:
+        print(f"Fuente rechazada: {str(e)}")
+        return jsonify({'error': 'URL de fuente no permitida'}), 400
+    try:
+        weight = float(data.get('weight', 1.0))
+        # Salto por movimiento opcional por fuente (por defecto, YOLO_MOTION_*)
+        motion = {k: float(data[k]) for k in ('motion_threshold', 'motion_max_interval') if data.get(k) is not None}
+        rois = data.get('rois')
+        rois = parse_rois(rois if isinstance(rois, str) else json.dumps(rois)) if rois else None
+        source = source_manager.add(str(source_id), url, weight, rois=rois, **motion)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Peso, ROI o parámetros de movimiento inválidos'}), 400
+    except KeyError:
+        return jsonify({'error': 'La fuente ya existe'}), 409
+    except SourceLimit as e:
+        return jsonify({'error': 'Se alcanzó el máximo de fuentes', 'details': str(e)}), 409
+    response = jsonify(source.stats())
+    response.status_code = 201
+    response.headers['Location'] = f'/sources/{source.id}'
+    return response
+
+@application.route('/sources/<source_id>', methods=['GET'])
+def get_source(source_id):
+    # Estadísticas y último resultado (conteos y detecciones) de la fuente
+    source = source_manager.sources.get(source_id)
+    if source is None:
+        return jsonify({'error': 'Fuente no encontrada'}), 404
+    return jsonify(dict(source.stats(), result=source.result))
+
+@application.route('/sources/<source_id>/stream', methods=['GET'])
+def stream_source(source_id):
+    # MJPEG (multipart/x-mixed-replace) con el último cuadro anotado de la fuente; se
+    # puede abrir directo en un <img>. ?max_fps=N limita los cuadros por espectador.
+    # Cada espectador ocupa un hilo del servidor mientras mira: con workers sync de
+    # gunicorn ocuparía el worker entero y el timeout lo mataría, así que se responde 503
+    # (gunicorn.conf.py usa gthread cuando hay fuentes; YOLO_STREAM_ANY_WORKER=1 acepta
+    # otros servidores de un hilo, como los workers gevent)
+    source = source_manager.sources.get(source_id)
+    if source is None:
+        return jsonify({'error': 'Fuente no encontrada'}), 404
+    if not request.environ.get('wsgi.multithread') and not stream_any_worker:
+        return jsonify({'error': 'El stream necesita un servidor con hilos (gunicorn --threads > 1)'}), 503
+    try:
+        max_fps = float(request.args['max_fps']) if request.args.get('max_fps') else None
+        if max_fps is not None and max_fps <= 0:
+            raise ValueError(max_fps)
+    except ValueError:
+        return jsonify({'error': 'Parámetro max_fps inválido'}), 400
+    response = Response(source.live.frames(max_fps),
+                        mimetype=f'multipart/x-mixed-replace; boundary={stream_boundary}')
+    response.headers['Cache-Control'] = 'no-cache, no-store'
+    # nginx no debe acumular la respuesta: cada cuadro sale en cuanto se escribe
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@application.route('/sources/<source_id>', methods=['DELETE'])
+def remove_source(source_id):
+    denied = admin_denied()
+    if denied:
+        return denied
+    try:
+        source_manager.remove(source_id)
+    except KeyError:
+        return jsonify({'error': 'Fuente no encontrada'}), 404
+    return '', 204
+
+@application.route('/admin/memory', methods=['GET'])
+def admin_memory():
+    # RSS actual y pico, estadísticas por sección y sitios con más asignaciones Python
+    # (?limit=N, ?diff=0 para totales en lugar del crecimiento desde el arranque)
+    denied = admin_denied()
+    if denied:
+        return denied
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 200)
+    except ValueError:
+        return jsonify({'error': 'Parámetro limit inválido'}), 400
+    diff = request.args.get('diff', '1') != '0'
+    return jsonify(dict(memory.summary(), top_allocations=memory.top_allocations(limit, diff=diff)))
 
+@application.route('/admin/qos', methods=['GET'])
+def admin_qos():
+    # Slots, límites y, por clase, peticiones en curso, en espera y espera en cola (p50/p99)
+    denied = admin_denied()
+    if denied:
+        return denied
+    return jsonify(scheduler.stats())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+"""
+Ajuste automático de la configuración de inferencia para el host actual.
+
+Mide con imágenes sintéticas una grilla de configuraciones (hilos ORT por sesión,
+workers, lote de inferencia y resolución de entrada) y elige la de mayor throughput
+cuyo p99 cumple el objetivo. El resultado se guarda en un perfil JSON que
+app/yolomodel.py y gunicorn.conf.py leen al arrancar; después de un cambio de tipo
+de instancia basta con volver a ejecutar:
+
+    python -m app.autotune --target-p99-ms 250
+    python -m app.autotune --threads 1,2 --workers 2,4 --batch 1,4 --sizes 640,512 --duration 5
+
+Cada worker es un proceso (fork) con su propia sesión, como los workers de gunicorn,
+y procesa lotes completos (preprocess + session.run) en lazo cerrado. La latencia
+medida es la de cada lote: la que ve una petición que espera a que su lote se ejecute.
+Las variables de entorno (YOLO_ORT_THREADS, YOLO_INPUT_SIZE, YOLO_INFER_BATCH,
+WEB_CONCURRENCY) siguen teniendo prioridad sobre el perfil.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+from datetime import datetime
+
+import numpy as np
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+profile_path = os.getenv('YOLO_PROFILE', os.path.join(root_dir, 'yolo_profile.json'))
+
+
+def load_profile(path=None):
+    # Configuración elegida por el último ajuste, o {} si no hay perfil
+    path = path or profile_path
+    try:
+        with open(path) as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    cpus = profile.get('host', {}).get('cpus')
+    if cpus and cpus != os.cpu_count():
+        print(f'Aviso: el perfil {path} se ajustó para {cpus} CPUs y este host tiene {os.cpu_count()}; '
+              'conviene volver a ejecutar python -m app.autotune')
+    return profile
+
+
+def host_info():
+    info = {'cpus': os.cpu_count(), 'machine': platform.machine(), 'processor': platform.processor()}
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    info['processor'] = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    try:
+        import onnxruntime as ort
+        info['onnxruntime'] = ort.__version__
+    except ImportError:
+        pass
+    return info
+
+
+def build_grid(threads, workers, batches, sizes, cpus=None, oversubscribe=False):
+    # Combinaciones a medir; sin oversubscribe se descartan las que piden más hilos
+    # (workers * hilos ORT) que CPUs tiene el host
+    cpus = cpus or os.cpu_count() or 1
+    grid = []
+    for size in sizes:
+        for w in workers:
+            for t in threads:
+                if not oversubscribe and w * t > cpus:
+                    continue
+                for b in batches:
+                    grid.append({'workers': w, 'intra_op_threads': t, 'batch_size': b, 'input_size': size})
+    return grid
+
+
+def default_counts(cpus):
+    return sorted({1, 2, max(cpus // 2, 1), cpus})
+
+
+def synthetic_images(width, height, count=8, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def run_worker(model_factory, config, images, duration, go, warmup=2):
+    # Lazo cerrado dentro de un worker: lotes de batch_size imágenes hasta agotar duration.
+    # go() bloquea hasta que todos los workers terminan el calentamiento
+    yolo = model_factory(config)
+    batch = config['batch_size']
+    i = 0
+
+    def step():
+        nonlocal i
+        blobs = [yolo.preprocess(images[(i + k) % len(images)])[0] for k in range(batch)]
+        i += batch
+        yolo.run_batch(blobs)
+
+    for _ in range(warmup):
+        step()
+    go()
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        step()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def measure(config, model_factory, images, duration):
+    # Lanza config['workers'] procesos con fork, los arranca a la vez y combina sus latencias
+    children = []
+    for _ in range(config['workers']):
+        ready_r, ready_w = os.pipe()
+        go_r, go_w = os.pipe()
+        out_r, out_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                os.close(ready_r)
+                os.close(go_w)
+                os.close(out_r)
+
+                def go():
+                    os.write(ready_w, b'1')
+                    os.read(go_r, 1)
+
+                try:
+                    result = {'latencies': run_worker(model_factory, config, images, duration, go)}
+                except Exception as e:
+                    os.write(ready_w, b'0')
+                    result = {'error': str(e)}
+                with os.fdopen(out_w, 'w') as f:
+                    json.dump(result, f)
+            except BaseException as e:
+                print(f'Error en el worker: {str(e)}', file=sys.stderr)
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(ready_w)
+        os.close(go_r)
+        os.close(out_w)
+        children.append((pid, ready_r, go_w, out_r))
+
+    for _, ready_r, _, _ in children:
+        os.read(ready_r, 1)
+    for _, _, go_w, _ in children:
+        try:
+            os.write(go_w, b'1')
+        except OSError:  # el worker ya terminó con error
+            pass
+    latencies, errors = [], []
+    for pid, ready_r, go_w, out_r in children:
+        with os.fdopen(out_r) as f:
+            data = f.read()
+        os.waitpid(pid, 0)
+        os.close(ready_r)
+        os.close(go_w)
+        result = json.loads(data) if data else {'error': 'El worker terminó sin resultado'}
+        if 'error' in result:
+            errors.append(result['error'])
+        else:
+            latencies.extend(result['latencies'])
+
+    row = dict(config)
+    if errors or not latencies:
+        row['error'] = errors[0] if errors else 'Sin mediciones'
+        return row
+    ms = np.array(latencies) * 1000
+    p50, p99 = np.percentile(ms, [50, 99])
+    row.update({'throughput': round(len(ms) * config['batch_size'] / duration, 2),
+                'p50_ms': round(float(p50), 2), 'p99_ms': round(float(p99), 2), 'batches': len(ms)})
+    return row
+
+
+def choose(results, target_p99_ms):
+    # Mayor throughput que cumple el p99; a igual throughput, menos hilos en total.
+    # Si ninguna cumple, la de menor p99
+    valid = [r for r in results if 'error' not in r]
+    if not valid:
+        return None, False
+    meeting = [r for r in valid if r['p99_ms'] <= target_p99_ms]
+    if meeting:
+        return max(meeting, key=lambda r: (r['throughput'], -r['workers'] * r['intra_op_threads'])), True
+    return min(valid, key=lambda r: r['p99_ms']), False
+
+
+def tune(grid, model_factory, images, duration, target_p99_ms, log=print):
+    results = []
+    failed_sizes = set()
+    for i, config in enumerate(grid, 1):
+        # Un export con resolución fija falla igual en todas las configuraciones de ese tamaño
+        if config['input_size'] in failed_sizes:
+            results.append(dict(config, error='Resolución no soportada por el modelo'))
+            continue
+        row = measure(config, model_factory, images, duration)
+        if 'error' in row:
+            failed_sizes.add(config['input_size'])
+            log(f"[{i}/{len(grid)}] {format_config(config)}: error ({row['error'].splitlines()[0]})")
+        else:
+            log(f"[{i}/{len(grid)}] {format_config(config)}: {row['throughput']:.1f} img/s, "
+                f"p50 {row['p50_ms']:.1f} ms, p99 {row['p99_ms']:.1f} ms")
+        results.append(row)
+    best, meets = choose(results, target_p99_ms)
+    return best, meets, results
+
+
+def format_config(config):
+    return (f"workers={config['workers']} hilos={config['intra_op_threads']} "
+            f"lote={config['batch_size']} entrada={config['input_size']}")
+
+
+def write_profile(path, best, meets, results, target_p99_ms, model_path):
+    profile = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'host': host_info(),
+        'model': os.path.basename(model_path),
+        'target_p99_ms': target_p99_ms,
+        'meets_target': meets,
+        'workers': best['workers'],
+        'intra_op_threads': best['intra_op_threads'],
+        'batch_size': best['batch_size'],
+        'input_size': best['input_size'],
+        'throughput': best['throughput'],
+        'p99_ms': best['p99_ms'],
+        'results': results,
+    }
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp, path)
+    return profile
+
+
+def parse_list(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def main(argv=None):
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description='Elige hilos, workers, lote y resolución para este host')
+    parser.add_argument('--target-p99-ms', type=float, default=250, help='Latencia p99 máxima por lote')
+    parser.add_argument('--threads', type=parse_list, default=default_counts(cpus), help='Hilos ORT por sesión')
+    parser.add_argument('--workers', type=parse_list, default=default_counts(cpus), help='Procesos worker')
+    parser.add_argument('--batch', type=parse_list, default=[1, 2, 4], help='Imágenes por session.run')
+    parser.add_argument('--sizes', type=parse_list, default=[640, 512, 416, 320], help='Lado de la entrada')
+    parser.add_argument('--duration', type=float, default=3, help='Segundos por configuración')
+    parser.add_argument('--image-size', default='1280x720', help='Tamaño de las imágenes sintéticas')
+    parser.add_argument('--oversubscribe', action='store_true', help='Incluir workers * hilos > CPUs')
+    parser.add_argument('--model', help='Ruta al modelo ONNX (por defecto, el de app/yolomodel.py)')
+    parser.add_argument('--output', default=profile_path, help='Archivo del perfil')
+    parser.add_argument('--dry-run', action='store_true', help='Medir sin escribir el perfil')
+    args = parser.parse_args(argv)
+
+    try:
+        from .yolocounterv1 import YoloOnnx
+    except ImportError:
+        from yolocounterv1 import YoloOnnx
+    if args.model:
+        model_path, class_names = args.model, []
+    else:
+        try:
+            from .yolomodel import yolopath as model_path, class_names
+        except ImportError:
+            from yolomodel import yolopath as model_path, class_names
+
+    def factory(config):
+        return YoloOnnx(weigths_path=model_path, class_names=class_names, intra_op_threads=config['intra_op_threads'],
+                        inter_op_threads=1, input_size=config['input_size'], batch_size=config['batch_size'])
+
+    if any(s % 32 for s in args.sizes):
+        parser.error('Las resoluciones deben ser múltiplos de 32')
+    width, height = (int(v) for v in args.image_size.lower().split('x'))
+    grid = build_grid(args.threads, args.workers, args.batch, args.sizes, cpus, args.oversubscribe)
+    if not grid:
+        parser.error('Ninguna configuración cabe en las CPUs del host (ver --oversubscribe)')
+    print(f'Host: {cpus} CPUs; modelo {model_path}; {len(grid)} configuraciones de {args.duration:g} s')
+
+    best, meets, results = tune(grid, factory, synthetic_images(width, height), args.duration, args.target_p99_ms)
+    if best is None:
+        print('Ninguna configuración se pudo medir')
+        return 1
+    print(f'\nElegida: {format_config(best)} -> {best["throughput"]:.1f} img/s, p99 {best["p99_ms"]:.1f} ms')
+    if not meets:
+        print(f'Aviso: ninguna configuración cumple p99 <= {args.target_p99_ms:g} ms; se eligió la de menor p99')
+    if args.dry_run:
+        return 0
+    write_profile(args.output, best, meets, results, args.target_p99_ms, model_path)
+    print(f'Perfil guardado en {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+import numpy as np
+
+# Operaciones vectorizadas sobre detecciones con el formato de salida del modelo:
+# filas (batch_id, x0, y0, x1, y1, cls_id, score)
+
+
+def box_area(boxes):
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+
+def pairwise_overlap(box, boxes, metric='iou'):
+    # Solapamiento de una caja contra un arreglo de cajas (IoU o intersección sobre la menor)
+    x0 = np.maximum(box[0], boxes[:, 0])
+    y0 = np.maximum(box[1], boxes[:, 1])
+    x1 = np.minimum(box[2], boxes[:, 2])
+    y1 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    area = box_area(box[None])[0]
+    areas = box_area(boxes)
+    if metric == 'ios':
+        denom = np.minimum(area, areas)
+    else:
+        denom = area + areas - inter
+    return inter / np.maximum(denom, 1e-9)
+
+
+def nms(dets, iou_thres=0.5, metric='iou', merge=None):
+    # NMS por clase. Con merge='wbf' las cajas suprimidas se fusionan con la que
+    # las absorbe promediando coordenadas ponderadas por score (weighted boxes fusion)
+    dets = np.asarray(dets, dtype=np.float32).reshape(-1, 7)
+    if len(dets) == 0:
+        return dets
+    # Desplazar cada clase a una región distinta evita mezclar clases en una sola pasada
+    span = dets[:, 1:5].max() - dets[:, 1:5].min() + 1
+    offset = (dets[:, 5:6] * span).astype(np.float32)
+    boxes = dets[:, 1:5] + offset
+    order = np.argsort(-dets[:, 6], kind='stable')
+    keep = []
+    while order.size:
+        i = order[0]
+        overlap = pairwise_overlap(boxes[i], boxes[order[1:]], metric)
+        matched = order[1:][overlap > iou_thres]
+        if merge == 'wbf' and matched.size:
+            group = np.concatenate(([i], matched))
+            weights = dets[group, 6:7]
+            fused = dets[i].copy()
+            fused[1:5] = (dets[group, 1:5] * weights).sum(0) / weights.sum()
+            keep.append(fused)
+        else:
+            keep.append(dets[i])
+        order = order[1:][overlap <= iou_thres]
+    return np.stack(keep)
+
+
+def unletterbox(dets, ratio, dwdh, offset=(0, 0)):
+    # Versión vectorizada de YoloOnnx.convertbox para un arreglo de detecciones;
+    # offset desplaza a coordenadas globales cuando la entrada fue un recorte
+    dets = np.array(dets, dtype=np.float32).reshape(-1, 7)
+    dets[:, 1:5] -= np.array(dwdh * 2, dtype=np.float32)
+    dets[:, 1:5] /= ratio
+    dets[:, [1, 3]] += offset[0]
+    dets[:, [2, 4]] += offset[1]
+    return dets
+
+
+def tile_windows(width, height, tile=640, overlap=0.2):
+    # Ventanas (x0, y0, x1, y1) que cubren la imagen con el solapamiento pedido.
+    # La última fila/columna se alinea al borde para que todas midan tile x tile
+    stride = max(int(tile * (1 - overlap)), 1)
+
+    def starts(size):
+        if size <= tile:
+            return [0]
+        points = list(range(0, size - tile, stride))
+        return points + [size - tile]
+
+    return [(x, y, min(x + tile, width), min(y + tile, height))
+            for y in starts(height) for x in starts(width)]
+
+
+def clip_rois(rois, width, height, scale=1.0):
+    # ROIs (x0, y0, x1, y1) en coordenadas originales -> ventanas enteras dentro de la
+    # imagen decodificada (escalada por scale). Las ROIs vacías tras recortar se descartan
+    windows = []
+    for x0, y0, x1, y1 in rois:
+        x0, x1 = sorted((x0 * scale, x1 * scale))
+        y0, y1 = sorted((y0 * scale, y1 * scale))
+        x0, y0 = max(int(np.floor(x0)), 0), max(int(np.floor(y0)), 0)
+        x1, y1 = min(int(np.ceil(x1)), width), min(int(np.ceil(y1)), height)
+        if x1 > x0 and y1 > y0:
+            windows.append((x0, y0, x1, y1))
+    if not windows:
+        raise ValueError('Ninguna región de interés cae dentro de la imagen')
+    return windows
+
+
+def select(dets, class_names, min_score=None, classes=None):
+    # Filtros por clase con una sola máscara sobre el arreglo. min_score: umbral global o
+    # {nombre: umbral}, donde la clave '*' fija el umbral de las clases no listadas;
+    # classes: nombres permitidos. Un nombre desconocido es ValueError
+    dets = np.asarray(dets, dtype=np.float32).reshape(-1, 7)
+    index = {name: i for i, name in enumerate(class_names)}
+    names = list(classes or []) + [n for n in (min_score if isinstance(min_score, dict) else {}) if n != '*']
+    unknown = [n for n in names if n not in index]
+    if unknown:
+        raise ValueError(f"Clase desconocida: {', '.join(unknown)}")
+    cls = dets[:, 5].astype(np.intp)
+    keep = np.ones(len(dets), dtype=bool)
+    if classes:
+        allowed = np.zeros(len(class_names), dtype=bool)
+        allowed[[index[n] for n in classes]] = True
+        keep &= allowed[cls]
+    if min_score is not None:
+        if not isinstance(min_score, dict):
+            min_score = {'*': min_score}
+        thresholds = np.full(len(class_names), float(min_score.get('*', 0.0)), dtype=np.float32)
+        for name, value in min_score.items():
+            if name != '*':
+                thresholds[index[name]] = float(value)
+        keep &= dets[:, 6] >= thresholds[cls]
+    return dets[keep]
+
+
+def count_classes(dets, class_names):
+    # Conteo por clase de mayor a menor; a igual conteo, en orden de primera aparición
+    dets = np.asarray(dets, dtype=np.float32).reshape(-1, 7)
+    ids, first, counts = np.unique(dets[:, 5].astype(np.intp), return_index=True, return_counts=True)
+    return {class_names[ids[i]]: int(counts[i]) for i in np.lexsort((first, -counts))}
+
+
+def mosaic_cells(grid, size=(640, 640), gutter=16):
+    # Celdas (x0, y0, x1, y1) de una grilla grid x grid dentro del lienzo (ancho, alto),
+    # separadas por gutter píxeles de relleno para que ninguna caja cruce de una imagen a otra
+    width, height = size
+    cw = (width - gutter * (grid - 1)) // grid
+    ch = (height - gutter * (grid - 1)) // grid
+    return [(c * (cw + gutter), r * (ch + gutter), c * (cw + gutter) + cw, r * (ch + gutter) + ch)
+            for r in range(grid) for c in range(grid)]
+
+
+def mosaic_grid(n, max_grid=3):
+    # La grilla más chica (celdas más grandes) donde caben n imágenes
+    grid = 1
+    while grid < max_grid and grid * grid < n:
+        grid += 1
+    return grid
+
+
+def assign_regions(dets, regions):
+    # Índice de la región (x0, y0, x1, y1) que contiene el centro de cada caja, o -1
+    dets = np.asarray(dets, dtype=np.float32).reshape(-1, 7)
+    regions = np.asarray(regions, dtype=np.float32).reshape(-1, 4)
+    cx = (dets[:, 1] + dets[:, 3]) / 2
+    cy = (dets[:, 2] + dets[:, 4]) / 2
+    inside = ((cx[:, None] >= regions[:, 0]) & (cx[:, None] < regions[:, 2]) &
+              (cy[:, None] >= regions[:, 1]) & (cy[:, None] < regions[:, 3]))
+    return np.where(inside.any(1), inside.argmax(1), -1)
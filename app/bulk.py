@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+"""
+Procesamiento masivo fuera de línea con YoloOnnx.
+
+Recorre un directorio (o un manifiesto con una ruta por línea), reparte las imágenes
+en lotes entre procesos worker (uno por núcleo, cada uno con su propia sesión ORT de
+un hilo) y escribe conteos y detecciones por imagen en shards CSV, JSONL o Parquet.
+El progreso se guarda por shard: si la ejecución se interrumpe, al relanzarla con los
+mismos argumentos continúa desde el primer shard incompleto.
+
+Ejemplos:
+    python -m app.bulk --input /datos/archivo --output /datos/conteos --format parquet
+    python -m app.bulk --manifest rutas.txt --output salida --workers 8 --shard-size 5000
+"""
+import os
+import csv
+import sys
+import json
+import time
+import hashlib
+import argparse
+import multiprocessing as mp
+from functools import partial
+
+try:
+    from .yolocounterv1 import YoloOnnx
+    from .imageprobe import decode_path, tile_threshold
+    from .pipeline import Failed
+except ImportError:
+    from yolocounterv1 import YoloOnnx
+    from imageprobe import decode_path, tile_threshold
+    from pipeline import Failed
+
+image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif', '.tiff', '.webp'}
+fields = ['path', 'status', 'error', 'width', 'height', 'n_detections', 'countings', 'detections']
+progress_file = '_progress.json'
+
+
+# ---------------------------------------------------------------------------
+# Entrada
+# ---------------------------------------------------------------------------
+
+def walk_images(root):
+    # Orden determinista para que los shards sean estables entre ejecuciones
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if os.path.splitext(name)[1].lower() in image_extensions:
+                paths.append(os.path.join(dirpath, name))
+    return paths
+
+
+def read_manifest(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def signature(paths, shard_size):
+    digest = hashlib.sha1(str(shard_size).encode())
+    for p in paths:
+        digest.update(p.encode('utf-8', 'surrogateescape'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Workers
+# ---------------------------------------------------------------------------
+
+_worker = {}
+
+
+def init_worker(model_path, class_names, threads, tiled, tile_threshold, infer_batch=4, mosaic=None):
+    yolo = YoloOnnx(weigths_path=model_path, class_names=class_names,
+                    intra_op_threads=threads, inter_op_threads=1)
+    # Decodificación y letterbox de las siguientes imágenes solapados con session.run
+    _worker['pipeline'] = yolo.make_pipeline(
+        loader=partial(decode_path, tiled=tiled, tile_threshold=tile_threshold),
+        decode_workers=1, batch_size=infer_batch, tiled_kwargs={'workers': 1}, mosaic=mosaic)
+
+
+def error_row(path, error):
+    return {'path': path, 'status': 'error', 'error': str(error), 'width': None, 'height': None,
+            'n_detections': 0, 'countings': {}, 'detections': []}
+
+
+def process_batch(paths):
+    # Devuelve las filas y el tiempo ocupado por etapa del pipeline del worker
+    pipeline = _worker['pipeline']
+    rows = []
+    for path, item in zip(paths, pipeline.map(paths)):
+        if isinstance(item, Failed):
+            rows.append(error_row(path, item.error))
+            continue
+        info = item['info']
+        rows.append({'path': path, 'status': 'ok', 'error': None, 'width': info.width, 'height': info.height,
+                     'n_detections': len(item['detections']), 'countings': item['countings'],
+                     'detections': item['detections']})
+    stats = pipeline.stats()
+    return rows, {name: (s['busy_s'] / s['workers'], stats['elapsed_s']) for name, s in stats['stages'].items()}
+
+
+# ---------------------------------------------------------------------------
+# Salida
+# ---------------------------------------------------------------------------
+
+def write_shard(rows, path, fmt):
+    # Escritura atómica: un shard existe solo si está completo
+    tmp = path + '.tmp'
+    if fmt == 'csv':
+        with open(tmp, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(dict(row, countings=json.dumps(row['countings']),
+                                     detections=json.dumps(row['detections'])))
+    elif fmt == 'jsonl':
+        with open(tmp, 'w') as f:
+            for row in rows:
+                f.write(json.dumps(row) + '\n')
+    elif fmt == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pylist([dict(row, countings=json.dumps(row['countings']),
+                                           detections=json.dumps(row['detections'])) for row in rows])
+        pq.write_table(table, tmp)
+    os.replace(tmp, path)
+
+
+class Progress:
+    def __init__(self, output_dir, sig, restart=False):
+        self.path = os.path.join(output_dir, progress_file)
+        self.state = {'signature': sig, 'completed': [], 'images': 0, 'seconds': 0.0}
+        if not restart and os.path.exists(self.path):
+            with open(self.path) as f:
+                state = json.load(f)
+            if state.get('signature') == sig:
+                self.state = state
+            else:
+                raise SystemExit(f'{self.path} corresponde a otra entrada; use --restart para empezar de nuevo')
+
+    @property
+    def completed(self):
+        return set(self.state['completed'])
+
+    def mark(self, shard_id, images, seconds):
+        self.state['completed'].append(shard_id)
+        self.state['images'] += images
+        self.state['seconds'] += seconds
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+
+
+# ---------------------------------------------------------------------------
+# Orquestación
+# ---------------------------------------------------------------------------
+
+def run(paths, output_dir, fmt='jsonl', shard_size=10000, batch_size=16, workers=None, threads=1,
+        tiled=None, tile_threshold=None, restart=False, model_path=None, class_names=None, log_every=10.0,
+        infer_batch=4, mosaic=None):
+    if fmt == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise SystemExit('El formato parquet requiere pyarrow (pip install pyarrow)')
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    progress = Progress(output_dir, signature(paths, shard_size), restart=restart)
+    done = progress.completed
+
+    shards = [(k, paths[i:i + shard_size]) for k, i in enumerate(range(0, len(paths), shard_size))]
+    pending = [(k, items) for k, items in shards if k not in done]
+    total = sum(len(items) for _, items in pending)
+    print(f'{len(paths)} imágenes en {len(shards)} shards; pendientes: {total} en {len(pending)} shards; '
+          f'{workers} workers')
+    if not pending:
+        return progress.state
+
+    # Cada tarea es un lote de un shard; imap conserva el orden para armar cada shard
+    tasks = [(k, items[j:j + batch_size]) for k, items in pending for j in range(0, len(items), batch_size)]
+    remaining = {k: -(-len(items) // batch_size) for k, items in pending}
+    buffers = {k: [] for k, _ in pending}
+
+    ctx = mp.get_context('spawn')
+    start = last_log = time.perf_counter()
+    shard_start = {k: start for k, _ in pending}
+    processed = 0
+    occupancy = {}
+    with ctx.Pool(workers, initializer=init_worker,
+                  initargs=(model_path, class_names, threads, tiled, tile_threshold, infer_batch,
+                            mosaic)) as pool:
+        for (k, _), (rows, stages) in zip(tasks, pool.imap(process_batch, [batch for _, batch in tasks])):
+            for name, (busy, elapsed) in stages.items():
+                total_busy, total_elapsed = occupancy.get(name, (0.0, 0.0))
+                occupancy[name] = (total_busy + busy, total_elapsed + elapsed)
+            buffers[k].extend(rows)
+            remaining[k] -= 1
+            processed += len(rows)
+            if remaining[k] == 0:
+                write_shard(buffers.pop(k), os.path.join(output_dir, f'part-{k:05d}.{fmt}'), fmt)
+                progress.mark(k, len(shards[k][1]), time.perf_counter() - shard_start[k])
+            now = time.perf_counter()
+            if now - last_log >= log_every:
+                rate = processed / (now - start)
+                eta = (total - processed) / rate if rate else float('inf')
+                print(f'{processed}/{total} imágenes  {rate:.1f} img/s  ETA {eta / 60:.1f} min')
+                last_log = now
+
+    elapsed = time.perf_counter() - start
+    print(f'Listo: {processed} imágenes en {elapsed:.1f}s ({processed / elapsed:.1f} img/s)')
+    if occupancy:
+        # Fracción del tiempo de cada lote que cada etapa estuvo ocupada; la mayor es el cuello de botella
+        print('Ocupación por etapa: ' + '  '.join(
+            f'{name} {busy / total:.0%}' for name, (busy, total) in occupancy.items() if total))
+    return progress.state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Conteo masivo de imágenes con YOLO')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', help='Directorio a recorrer recursivamente')
+    source.add_argument('--manifest', help='Archivo con una ruta de imagen por línea')
+    parser.add_argument('--output', required=True, help='Directorio de salida para los shards')
+    parser.add_argument('--format', choices=['csv', 'jsonl', 'parquet'], default='jsonl')
+    parser.add_argument('--shard-size', type=int, default=10000, help='Imágenes por shard (unidad de checkpoint)')
+    parser.add_argument('--batch-size', type=int, default=16, help='Imágenes por tarea enviada a un worker')
+    parser.add_argument('--workers', type=int, default=None, help='Procesos worker (por defecto, todos los núcleos)')
+    parser.add_argument('--threads', type=int, default=1, help='Hilos ORT por worker')
+    parser.add_argument('--infer-batch', type=int, default=4, help='Imágenes por session.run dentro de cada worker')
+    parser.add_argument('--tiled', choices=['auto', 'on', 'off'], default='auto')
+    parser.add_argument('--mosaic', type=int, choices=[0, 2, 3], default=0,
+                        help='Empaquetar miniaturas de a 2x2 o 3x3 en un mismo lienzo de entrada')
+    parser.add_argument('--restart', action='store_true', help='Ignorar el progreso guardado')
+    parser.add_argument('--model', help='Ruta al modelo ONNX (por defecto, el de app/yolomodel.py)')
+    args = parser.parse_args(argv)
+
+    try:
+        from .yolomodel import yolopath, class_names
+    except ImportError:
+        from yolomodel import yolopath, class_names
+
+    paths = walk_images(args.input) if args.input else read_manifest(args.manifest)
+    tiled = {'auto': None, 'on': True, 'off': False}[args.tiled]
+    run(paths, args.output, fmt=args.format, shard_size=args.shard_size, batch_size=args.batch_size,
+        workers=args.workers, threads=args.threads, tiled=tiled, tile_threshold=tile_threshold,
+        restart=args.restart, model_path=args.model or yolopath, class_names=class_names,
+        infer_batch=args.infer_batch, mosaic=args.mosaic)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
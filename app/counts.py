@@ -0,0 +1,216 @@
+import os
+import math
+import time
+import sqlite3
+import tempfile
+import threading
+from collections import defaultdict
+
+# Serie temporal de conteos en SQLite. Las peticiones solo agregan a un búfer en
+# memoria; un hilo lo vuelca por lotes en una transacción que inserta las filas crudas
+# y actualiza de forma incremental los acumulados por minuto, hora y día. Las consultas
+# leen solo los acumulados, indexados por (resolución, bucket)
+counts_db = os.getenv('YOLO_COUNTS_DB', os.path.join(tempfile.gettempdir(), 'yolo_counts', 'counts.sqlite3'))
+counts_enabled = os.getenv('YOLO_COUNTS', '1') != '0'
+flush_interval = float(os.getenv('YOLO_COUNTS_FLUSH', 1.0))
+# Días que se conservan las filas crudas (los acumulados no vencen)
+raw_retention_days = float(os.getenv('YOLO_COUNTS_RAW_DAYS', 7))
+max_pending = 100_000
+
+resolutions = {'minute': 60, 'hour': 3600, 'day': 86400}
+# Clase sintética con el total de objetos; su campo images cuenta las observaciones
+all_classes = '*'
+
+schema = """
+CREATE TABLE IF NOT EXISTS counts (
+    source TEXT NOT NULL,
+    ts REAL NOT NULL,
+    class TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS counts_ts ON counts (ts);
+CREATE TABLE IF NOT EXISTS rollups (
+    resolution INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    class TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    images INTEGER NOT NULL,
+    max INTEGER NOT NULL,
+    PRIMARY KEY (resolution, bucket, source, class)
+) WITHOUT ROWID;
+"""
+
+upsert = """
+INSERT INTO rollups (resolution, bucket, source, class, count, images, max) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (resolution, bucket, source, class) DO UPDATE SET
+    count = count + excluded.count,
+    images = images + excluded.images,
+    max = MAX(max, excluded.max)
+"""
+
+
+class CountStore:
+    def __init__(self, path=None, flush_interval=flush_interval, max_pending=max_pending):
+        self.path = path or counts_db
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_prune = 0.0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.connection() as conn:
+            conn.executescript(schema)
+
+    def connection(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def record(self, source, countings, ts=None):
+        # Camino de la petición: solo agrega al búfer. Si el escritor no da abasto se
+        # descartan los registros más nuevos y se cuentan en dropped
+        ts = time.time() if ts is None else float(ts)
+        if not math.isfinite(ts):
+            raise ValueError(f'Marca de tiempo no finita: {ts}')
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append((source, ts, dict(countings)))
+        self.start()
+
+    def start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._writer, name='yolo-counts', daemon=True)
+                    self._thread.start()
+
+    def after_fork(self):
+        # En el proceso hijo de un fork: el hilo escritor no existe y los locks pudieron
+        # quedar tomados. Los registros pendientes son del padre, que es quien los vuelca
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._pending = []
+        self._thread = None
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._stop.clear()
+        self.flush()
+
+    def _writer(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Error al guardar conteos: {str(e)}")
+            except Exception as e:
+                # Un lote con datos inesperados se pierde, pero el hilo sigue volcando los siguientes
+                print(f"Error inesperado al volcar conteos: {str(e)}")
+
+    def flush(self):
+        # Vuelca el búfer en una sola transacción: filas crudas + acumulados preagregados
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+        raw = []
+        rollup = defaultdict(lambda: [0, 0, 0])
+        for source, ts, countings in batch:
+            totals = dict(countings)
+            totals[all_classes] = sum(countings.values())
+            for cls, count in countings.items():
+                raw.append((source, ts, cls, int(count)))
+            for seconds in resolutions.values():
+                bucket = int(ts // seconds * seconds)
+                for cls, count in totals.items():
+                    acc = rollup[(seconds, bucket, source, cls)]
+                    acc[0] += int(count)
+                    acc[1] += 1
+                    acc[2] = max(acc[2], int(count))
+
+        with self._flush_lock:
+            conn = self.connection()
+            try:
+                with conn:
+                    conn.executemany('INSERT INTO counts (source, ts, class, count) VALUES (?, ?, ?, ?)', raw)
+                    conn.executemany(upsert, [key + tuple(acc) for key, acc in rollup.items()])
+                    if time.time() - self._last_prune > 3600:
+                        conn.execute('DELETE FROM counts WHERE ts < ?', (time.time() - raw_retention_days * 86400,))
+                        self._last_prune = time.time()
+            finally:
+                conn.close()
+        return len(batch)
+
+    def query(self, start, end, resolution=None, group_by=('bucket', 'class'), sources=None, classes=None):
+        # Consulta de rango sobre los acumulados. start se redondea hacia abajo al bucket
+        # de la resolución; se incluyen los buckets que empiezan antes de end
+        resolution = resolution or auto_resolution(end - start)
+        seconds = resolutions[resolution]
+        columns = [c for c in ('bucket', 'source', 'class') if c in group_by]
+        where = ['resolution = ?', 'bucket >= ?', 'bucket < ?']
+        args = [seconds, int(start // seconds * seconds), end]
+        if sources:
+            where.append(f"source IN ({','.join('?' * len(sources))})")
+            args.extend(sources)
+        if classes:
+            where.append(f"class IN ({','.join('?' * len(classes))})")
+            args.extend(classes)
+        else:
+            # Sin filtro de clase el total sintético duplicaría los conteos al agrupar
+            where.append('class != ?')
+            args.append(all_classes)
+        select = columns + ['SUM(count) AS count', 'MAX(max) AS max']
+        sql = f"SELECT {', '.join(select)} FROM rollups WHERE {' AND '.join(where)}"
+        if columns:
+            sql += f" GROUP BY {', '.join(columns)} ORDER BY {', '.join(columns)}"
+        conn = self.connection()
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = [dict(row) for row in conn.execute(sql, args)]
+        finally:
+            conn.close()
+        return {'resolution': resolution, 'start': args[1], 'end': end,
+                'rows': [row for row in rows if row['count'] is not None]}
+
+    def images(self, start, end, resolution=None, sources=None):
+        # Número de observaciones (imágenes o cuadros) por fuente en el rango
+        resolution = resolution or auto_resolution(end - start)
+        seconds = resolutions[resolution]
+        where = ['resolution = ?', 'bucket >= ?', 'bucket < ?', 'class = ?']
+        args = [seconds, int(start // seconds * seconds), end, all_classes]
+        if sources:
+            where.append(f"source IN ({','.join('?' * len(sources))})")
+            args.extend(sources)
+        conn = self.connection()
+        try:
+            rows = conn.execute(f"SELECT source, SUM(images) FROM rollups WHERE {' AND '.join(where)} "
+                                "GROUP BY source", args).fetchall()
+        finally:
+            conn.close()
+        return dict(rows)
+
+
+def auto_resolution(span):
+    # La resolución más fina que no devuelva demasiados buckets
+    if span <= 6 * 3600:
+        return 'minute'
+    if span <= 14 * 86400:
+        return 'hour'
+    return 'day'
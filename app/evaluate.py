@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+"""
+Evaluación de exactitud contra velocidad de los modos de servicio.
+
+Pasa un conjunto local de imágenes etiquetadas (anotaciones en formato COCO) por
+YoloOnnx en cada modo y reporta, en una sola tabla, mAP (IoU .50:.95 y .50), error
+de conteo por clase y latencia/throughput. Así los puntos de operación (resolución
+de entrada, INT8, mosaicos, salto de cuadros, decodificación reducida) se eligen con
+datos.
+
+    python -m app.evaluate --annotations instances_val2017.json --images val2017 --limit 500
+    python -m app.evaluate --annotations anotaciones.json --images fotos \\
+        --mode full=decode=full --mode base= --mode int8=model=yolo_int8.onnx --mode skip3=skip=3
+
+Un modo es NOMBRE=[opción=valor,...] con las opciones:
+  model       ruta a otro modelo ONNX (p. ej. cuantizado a INT8)
+  input_size  lado de la entrada (requiere un export con alto/ancho dinámicos)
+  decode      reduced (como el servidor: JPEG grande decodificado a 1/2..1/8) o full
+  tiled       1 para inferencia por mosaicos a resolución completa
+  skip        k: solo se infiere una de cada k imágenes (en orden de nombre) y las demás
+              reutilizan el último resultado, como el salto de cuadros de una fuente en vivo
+  threads     hilos ORT de la sesión
+
+El mAP sigue la definición de COCO (101 puntos de recall, 100 detecciones por imagen,
+las regiones iscrowd se ignoran) sin el desglose por área; no requiere pycocotools.
+Las categorías se asocian a las clases del modelo por nombre.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from collections import defaultdict
+
+import numpy as np
+from PIL import Image
+
+try:
+    from .yolocounterv1 import YoloOnnx
+    from .imageprobe import decode_path, probe, upright
+    from .boxes import box_area, unletterbox
+except ImportError:
+    from yolocounterv1 import YoloOnnx
+    from imageprobe import decode_path, probe, upright
+    from boxes import box_area, unletterbox
+
+iou_thresholds = np.round(np.linspace(0.5, 0.95, 10), 2)
+recall_points = np.linspace(0, 1, 101)
+max_detections = 100
+default_modes = ['base=', 'full=decode=full', 'tiled=tiled=1', 'skip2=skip=2']
+
+
+# ---------------------------------------------------------------------------
+# Anotaciones
+# ---------------------------------------------------------------------------
+
+def load_coco(path, class_names):
+    # -> (imágenes ordenadas por nombre, {image_id: (n, 5) [cls, x0, y0, x1, y1]},
+    #     {image_id: (m, 4) regiones iscrowd}). Las categorías que el modelo no conoce se omiten
+    with open(path) as f:
+        data = json.load(f)
+    index = {name: i for i, name in enumerate(class_names)}
+    categories = {c['id']: index.get(c['name']) for c in data.get('categories', [])}
+    missing = sorted(c['name'] for c in data.get('categories', []) if c['name'] not in index)
+    if missing:
+        print(f"Categorías sin clase en el modelo (se omiten): {', '.join(missing)}")
+
+    boxes, crowd = defaultdict(list), defaultdict(list)
+    for ann in data.get('annotations', []):
+        cls = categories.get(ann['category_id'])
+        if cls is None:
+            continue
+        x, y, w, h = ann['bbox']
+        if ann.get('iscrowd'):
+            crowd[ann['image_id']].append((x, y, x + w, y + h))
+        else:
+            boxes[ann['image_id']].append((cls, x, y, x + w, y + h))
+    images = sorted(data['images'], key=lambda im: im['file_name'])
+    gts = {im['id']: np.array(boxes[im['id']], dtype=np.float32).reshape(-1, 5) for im in images}
+    crowds = {im['id']: np.array(crowd[im['id']], dtype=np.float32).reshape(-1, 4) for im in images}
+    return images, gts, crowds
+
+
+# ---------------------------------------------------------------------------
+# Métricas
+# ---------------------------------------------------------------------------
+
+def box_intersection(a, b):
+    # Área de intersección de todos contra todos: (n, 4) x (m, 4) -> (n, m)
+    x0 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y0 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x1 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y1 = np.minimum(a[:, None, 3], b[None, :, 3])
+    return np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+
+
+def box_iou(a, b):
+    inter = box_intersection(a, b)
+    return inter / np.maximum(box_area(a)[:, None] + box_area(b)[None, :] - inter, 1e-9)
+
+
+def match_image(dets, gts, crowd):
+    # Emparejamiento codicioso por score y por umbral de IoU, como COCO.
+    # dets: (n, 5) [x0, y0, x1, y1, score] de una clase; gts: (m, 4).
+    # Devuelve tp e ignoradas (n, T): una detección sin pareja que cae sobre una
+    # región iscrowd no cuenta como falso positivo
+    order = np.argsort(-dets[:, 4], kind='stable')
+    dets = dets[order]
+    tp = np.zeros((len(dets), len(iou_thresholds)), dtype=bool)
+    ignored = np.zeros_like(tp)
+    iou = box_iou(dets[:, :4], gts) if len(gts) else np.zeros((len(dets), 0))
+    if len(crowd) and len(dets):
+        # Contra una región iscrowd cuenta la fracción de la detección que cae dentro
+        inter = box_intersection(dets[:, :4], crowd)
+        crowd_overlap = (inter / np.maximum(box_area(dets[:, :4])[:, None], 1e-9)).max(1)
+    else:
+        crowd_overlap = np.zeros(len(dets))
+    for t, thres in enumerate(iou_thresholds):
+        used = np.zeros(len(gts), dtype=bool)
+        for i in range(len(dets)):
+            candidates = np.where(used, -1.0, iou[i]) if len(gts) else iou[i]
+            if len(gts) and candidates.max() >= thres:
+                j = int(candidates.argmax())
+                used[j] = True
+                tp[i, t] = True
+            elif crowd_overlap[i] >= thres:
+                ignored[i, t] = True
+    return dets[:, 4], tp, ignored
+
+
+def average_precision(scores, tp, ignored, n_gt):
+    # AP por umbral de IoU con interpolación de 101 puntos; NaN si la clase no tiene GT
+    if n_gt == 0:
+        return np.full(len(iou_thresholds), np.nan)
+    order = np.argsort(-scores, kind='mergesort')
+    tp, ignored = tp[order], ignored[order]
+    ap = np.zeros(len(iou_thresholds))
+    for t in range(len(iou_thresholds)):
+        keep = ~ignored[:, t]
+        hits = tp[keep, t]
+        if not hits.size:
+            continue
+        tps = np.cumsum(hits)
+        fps = np.cumsum(~hits)
+        recall = tps / n_gt
+        precision = tps / (tps + fps)
+        # Envolvente decreciente de la precisión
+        precision = np.maximum.accumulate(precision[::-1])[::-1]
+        idx = np.searchsorted(recall, recall_points, side='left')
+        ap[t] = np.where(idx < len(precision), precision[np.minimum(idx, len(precision) - 1)], 0).mean()
+    return ap
+
+
+def evaluate(predictions, gts, crowds, n_classes, count_score=0.0):
+    # predictions/gts: {image_id: arreglos}. predicciones con filas del modelo
+    # (batch_id, x0, y0, x1, y1, cls_id, score) en coordenadas originales
+    per_class = defaultdict(lambda: ([], [], []))
+    n_gt = np.zeros(n_classes, dtype=np.int64)
+    count_error = np.zeros(n_classes)
+    count_gt = np.zeros(n_classes)
+    for image_id, gt in gts.items():
+        dets = np.asarray(predictions.get(image_id, []), dtype=np.float32).reshape(-1, 7)
+        gt_cls = gt[:, 0].astype(np.intp)
+        n_gt += np.bincount(gt_cls, minlength=n_classes)
+
+        # El conteo usa todas las detecciones, como /detect-count; el mAP solo las 100 mejores
+        counted = dets[dets[:, 6] >= count_score, 5].astype(np.intp)
+        predicted = np.bincount(counted, minlength=n_classes)
+        expected = np.bincount(gt_cls, minlength=n_classes)
+        count_error += np.abs(predicted - expected)
+        count_gt += expected
+        dets = dets[np.argsort(-dets[:, 6], kind='stable')[:max_detections]]
+
+        for cls in np.union1d(np.unique(dets[:, 5]).astype(np.intp), np.unique(gt_cls)):
+            scores, tp, ignored = match_image(dets[dets[:, 5] == cls][:, [1, 2, 3, 4, 6]],
+                                              gt[gt_cls == cls, 1:], crowds.get(image_id, np.zeros((0, 4))))
+            acc = per_class[cls]
+            acc[0].append(scores)
+            acc[1].append(tp)
+            acc[2].append(ignored)
+
+    ap = np.full((n_classes, len(iou_thresholds)), np.nan)
+    for cls, (scores, tp, ignored) in per_class.items():
+        ap[cls] = average_precision(np.concatenate(scores), np.concatenate(tp), np.concatenate(ignored), n_gt[cls])
+    with np.errstate(invalid='ignore'):
+        valid = ~np.isnan(ap[:, 0])
+        n_images = max(len(gts), 1)
+        return {
+            'map': float(ap[valid].mean()) if valid.any() else None,
+            'ap50': float(ap[valid, 0].mean()) if valid.any() else None,
+            'count_mae': float(count_error.sum() / n_images),
+            'count_rel_error': float(count_error.sum() / count_gt.sum()) if count_gt.sum() else None,
+            'classes': {int(c): {'ap': None if np.isnan(ap[c, 0]) else float(ap[c].mean()),
+                                 'ap50': None if np.isnan(ap[c, 0]) else float(ap[c, 0]),
+                                 'gt': int(count_gt[c]), 'count_mae': float(count_error[c] / n_images)}
+                        for c in range(n_classes) if count_gt[c] or count_error[c]},
+        }
+
+
+# ---------------------------------------------------------------------------
+# Modos
+# ---------------------------------------------------------------------------
+
+def parse_mode(spec):
+    # "nombre=opción=valor,opción=valor" -> (nombre, {opción: valor})
+    name, _, rest = spec.partition('=')
+    options = {}
+    for item in filter(None, rest.split(',')):
+        key, _, value = item.partition('=')
+        if key not in ('model', 'input_size', 'decode', 'tiled', 'skip', 'threads'):
+            raise ValueError(f'Opción de modo desconocida: {key}')
+        options[key] = int(value) if key in ('input_size', 'skip', 'threads', 'tiled') else value
+    if options.get('decode', 'reduced') not in ('reduced', 'full'):
+        raise ValueError(f"decode debe ser reduced o full: {options['decode']}")
+    return name or 'base', options
+
+
+def predict(yolo, path, options):
+    # Detecciones en coordenadas originales con la misma decodificación que el servidor
+    if options.get('decode') == 'full':
+        with open(path, 'rb') as f:
+            orientation = probe(f).orientation
+        img = upright(Image.open(path).convert('RGB'), orientation)
+        scale, tiled = 1.0, bool(options.get('tiled'))
+    else:
+        item = decode_path(path, tiled=bool(options.get('tiled')))
+        img, scale, tiled = item['img'], item['scale'], item['tiled']
+    if tiled:
+        _, outputs, _ = yolo.inference_tiled(img)
+        return unletterbox(outputs, scale, (0.0, 0.0))
+    _, outputs, _ = yolo.inference(img, scale=scale)
+    return unletterbox(outputs, yolo.ratio, yolo.dwdh)
+
+
+def run_mode(yolo, images, image_dir, options):
+    # Latencia por imagen de extremo a extremo (decodificación + inferencia); una imagen
+    # reutilizada por el salto de cuadros cuesta 0
+    skip = max(int(options.get('skip', 1)), 1)
+    predictions, latencies = {}, []
+    if images:
+        predict(yolo, os.path.join(image_dir, images[0]['file_name']), options)  # calentamiento
+    previous = np.zeros((0, 7), np.float32)
+    start = time.perf_counter()
+    for i, image in enumerate(images):
+        t0 = time.perf_counter()
+        if i % skip == 0:
+            previous = predict(yolo, os.path.join(image_dir, image['file_name']), options)
+        predictions[image['id']] = previous
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    ms = np.array(latencies) * 1000
+    p50, p99 = np.percentile(ms, [50, 99]) if ms.size else (0.0, 0.0)
+    return predictions, {'p50_ms': float(p50), 'p99_ms': float(p99),
+                         'throughput': len(images) / elapsed if elapsed else 0.0}
+
+
+# ---------------------------------------------------------------------------
+# Reporte
+# ---------------------------------------------------------------------------
+
+def format_value(value, fmt):
+    return f'{value:{fmt}}' if value is not None else '-'.rjust(len(f'{0:{fmt}}'))
+
+
+def print_report(report, class_names, per_class=False):
+    print(f"\n{'modo':14s} {'mAP':>6s} {'AP50':>6s} {'err.conteo':>10s} {'err.rel':>7s} "
+          f"{'p50 ms':>8s} {'p99 ms':>8s} {'img/s':>7s}")
+    for name, row in report.items():
+        if 'error' in row:
+            print(f"{name:14s} error: {row['error']}")
+            continue
+        print(f"{name:14s} {format_value(row['map'], '6.3f')} {format_value(row['ap50'], '6.3f')} "
+              f"{row['count_mae']:10.2f} {format_value(row['count_rel_error'], '7.1%')} "
+              f"{row['p50_ms']:8.1f} {row['p99_ms']:8.1f} {row['throughput']:7.1f}")
+    if not per_class:
+        return
+    names = [n for n, row in report.items() if 'error' not in row]
+    classes = sorted({c for n in names for c in report[n]['classes']})
+    print(f"\nError de conteo medio por imagen y clase\n{'clase':16s} {'GT':>6s} " + ' '.join(f'{n:>10s}' for n in names))
+    for c in classes:
+        gt = next(report[n]['classes'][c]['gt'] for n in names if c in report[n]['classes'])
+        print(f'{class_names[c]:16s} {gt:6d} ' + ' '.join(
+            f"{report[n]['classes'].get(c, {'count_mae': 0.0})['count_mae']:10.3f}" for n in names))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='mAP y error de conteo contra latencia por modo de servicio')
+    parser.add_argument('--annotations', required=True, help='Anotaciones en formato COCO (JSON)')
+    parser.add_argument('--images', required=True, help='Directorio de las imágenes (file_name relativo)')
+    parser.add_argument('--mode', action='append', help='NOMBRE=[opción=valor,...] (ver la ayuda del módulo)')
+    parser.add_argument('--limit', type=int, help='Evaluar solo las primeras N imágenes')
+    parser.add_argument('--count-score', type=float, default=0.0,
+                        help='Score mínimo de una detección para el conteo')
+    parser.add_argument('--per-class', action='store_true', help='Mostrar el error de conteo por clase')
+    parser.add_argument('--model', help='Modelo por defecto (por defecto, el de app/yolomodel.py)')
+    parser.add_argument('--json', help='Guardar el reporte completo en un archivo JSON')
+    args = parser.parse_args(argv)
+
+    try:
+        from .yolomodel import yolopath, class_names
+    except ImportError:
+        from yolomodel import yolopath, class_names
+    try:
+        modes = [parse_mode(spec) for spec in args.mode or default_modes]
+    except ValueError as e:
+        parser.error(str(e))
+
+    images, gts, crowds = load_coco(args.annotations, class_names)
+    images = images[:args.limit] if args.limit else images
+    gts = {im['id']: gts[im['id']] for im in images}
+    print(f'{len(images)} imágenes, {sum(len(g) for g in gts.values())} objetos, {len(modes)} modos')
+
+    models = {}
+    report = {}
+    for name, options in modes:
+        key = (options.get('model') or args.model or yolopath, options.get('input_size'), options.get('threads'))
+        try:
+            if key not in models:
+                models[key] = YoloOnnx(weigths_path=key[0], class_names=class_names, input_size=key[1],
+                                       intra_op_threads=key[2])
+            predictions, speed = run_mode(models[key], images, args.images, options)
+        except Exception as e:
+            report[name] = {'error': str(e).splitlines()[0], 'options': options}
+            print(f"[{name}] error: {report[name]['error']}")
+            continue
+        report[name] = dict(evaluate(predictions, gts, crowds, len(class_names), args.count_score),
+                            **speed, options=options)
+        row = report[name]
+        print(f"[{name}] mAP {format_value(row['map'], '.3f')}, error de conteo {row['count_mae']:.2f}, "
+              f"{row['throughput']:.1f} img/s")
+
+    print_report(report, class_names, args.per_class)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'images': len(images), 'modes': report}, f, indent=2)
+        print(f'\nReporte guardado en {args.json}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+import os
+from collections import namedtuple
+
+from PIL import Image
+
+# Presupuesto de píxeles: por encima de max_pixels la imagen se rechaza sin decodificar
+max_pixels = int(os.getenv('YOLO_MAX_PIXELS', 100_000_000))
+# Lado mínimo que conserva la decodificación reducida (entrada del modelo)
+decode_target = int(os.getenv('YOLO_DECODE_TARGET', 640))
+reduced_decode = os.getenv('YOLO_REDUCED_DECODE', '1') != '0'
+# Imágenes con más píxeles que este umbral se procesan por mosaicos automáticamente
+tile_threshold = int(os.getenv('YOLO_TILE_THRESHOLD', 16_000_000))
+# Cuadros procesados como máximo por subida (GIF animado, TIFF multipágina)
+max_frames = int(os.getenv('YOLO_MAX_FRAMES', 300))
+# Orientación EXIF -> transposición que deja la imagen como se ve (igual que
+# ImageOps.exif_transpose); 5..8 intercambian ancho y alto
+transposes = {2: Image.Transpose.FLIP_LEFT_RIGHT, 3: Image.Transpose.ROTATE_180,
+              4: Image.Transpose.FLIP_TOP_BOTTOM, 5: Image.Transpose.TRANSPOSE, 6: Image.Transpose.ROTATE_270,
+              7: Image.Transpose.TRANSVERSE, 8: Image.Transpose.ROTATE_90}
+swapped_orientations = (5, 6, 7, 8)
+
+# width y height son los de la imagen ya orientada según EXIF (orientation 1..8)
+ImageInfo = namedtuple('ImageInfo', ['format', 'width', 'height', 'mode', 'frames', 'orientation'], defaults=(1,))
+DecodePlan = namedtuple('DecodePlan', ['strategy', 'draft_size'])
+
+
+class ImageTooLarge(ValueError):
+    def __init__(self, info, budget):
+        super().__init__(f'{info.width}x{info.height} excede el presupuesto de {budget} píxeles')
+        self.info = info
+        self.budget = budget
+
+
+class TooManyFrames(ValueError):
+    def __init__(self, info, selected, budget):
+        super().__init__(f'{selected} de {info.frames} cuadros excede el presupuesto de {budget} cuadros')
+        self.info = info
+        self.selected = selected
+        self.budget = budget
+
+
+def probe(fp):
+    # Image.open solo lee el encabezado del contenedor; los píxeles no se decodifican.
+    # n_frames en GIF/TIFF recorre la estructura de bloques sin descomprimirlos.
+    # La orientación EXIF también está en el encabezado; las dimensiones se devuelven ya
+    # orientadas, como muestran la imagen los navegadores (y createImageBitmap en script.js)
+    img = Image.open(fp)
+    frames = getattr(img, 'n_frames', 1)
+    orientation = img.getexif().get(0x0112, 1)
+    width, height = img.size
+    if orientation in swapped_orientations:
+        width, height = height, width
+    return ImageInfo(img.format, width, height, img.mode, frames, orientation)
+
+
+def plan_decode(info, tiled=None, tile_threshold=None, budget=None, target=None):
+    # Decide cómo decodificar a partir del encabezado:
+    #  - 'tiled': mosaicos a resolución completa (pedido explícito o sobre el umbral)
+    #  - 'reduced': JPEG decodificado a 1/2, 1/4 o 1/8 con escalado DCT (Image.draft),
+    #    sin bajar de target en el lado mayor, porque el letterbox reduciría igual
+    #  - 'full': decodificación normal
+    budget = max_pixels if budget is None else budget
+    target = decode_target if target is None else target
+    pixels = info.width * info.height
+    if pixels > budget:
+        raise ImageTooLarge(info, budget)
+
+    if tiled is None:
+        tiled = tile_threshold is not None and pixels > tile_threshold
+    if tiled:
+        return DecodePlan('tiled', None)
+
+    if reduced_decode and info.format == 'JPEG':
+        long_side = max(info.width, info.height)
+        scale = 1
+        while scale < 8 and long_side // (scale * 2) >= target:
+            scale *= 2
+        if scale > 1:
+            return DecodePlan('reduced', (info.width // scale, info.height // scale))
+    return DecodePlan('full', None)
+
+
+def roi_target(info, rois):
+    # Con ROIs, la decodificación reducida debe conservar target píxeles en el lado
+    # mayor de la ROI más grande, no de la imagen completa
+    longest = max(max(abs(x1 - x0), abs(y1 - y0)) for x0, y0, x1, y1 in rois)
+    return decode_target * max(info.width, info.height) / max(min(longest, max(info.width, info.height)), 1)
+
+
+def decode_image(fp, tiled=None, tile_threshold=None, rois=None):
+    # Lee el encabezado, aplica el presupuesto, verifica y decodifica según el plan.
+    # Devuelve (imagen PIL cargada, ImageInfo, DecodePlan)
+    info = probe(fp)
+    if rois:
+        plan = plan_decode(info, tiled=False, target=roi_target(info, rois))
+    else:
+        plan = plan_decode(info, tiled=tiled, tile_threshold=tile_threshold)
+    fp.seek(0)
+    image = Image.open(fp)
+    image.verify()
+    fp.seek(0)
+    image = Image.open(fp)
+    if plan.draft_size:
+        # El plan está en dimensiones orientadas; draft trabaja sobre las almacenadas
+        swapped = info.orientation in swapped_orientations
+        image.draft('RGB', plan.draft_size[::-1] if swapped else plan.draft_size)
+    image.load()
+    return upright(image, info.orientation), info, plan
+
+
+def upright(image, orientation):
+    # Aplica la orientación EXIF para que las cajas y las ROIs estén en las coordenadas
+    # de la imagen tal como se ve. Sin rotación no hay copia
+    if orientation not in transposes:
+        return image
+    return image.transpose(transposes[orientation])
+
+
+def decode_path(path, tiled=None, tile_threshold=None, rois=None):
+    # Etapa de decodificación para YoloOnnx.make_pipeline: devuelve el elemento con la
+    # imagen, la escala de la decodificación reducida y si va por mosaicos
+    with open(path, 'rb') as f:
+        image, info, plan = decode_image(f, tiled=tiled, tile_threshold=tile_threshold, rois=rois)
+    return {'img': image, 'scale': image.size[0] / info.width, 'tiled': plan.strategy == 'tiled', 'info': info,
+            'rois': rois}
+
+
+def frame_indices(info, step=1, budget=None):
+    # Cuadros a procesar (uno de cada step); TooManyFrames si superan el presupuesto
+    budget = max_frames if budget is None else budget
+    indices = range(0, info.frames, step)
+    if len(indices) > budget:
+        raise TooManyFrames(info, len(indices), budget)
+    return indices
+
+
+def read_frame(image, index, orientation=1):
+    # Cuadro index de un GIF/TIFF ya abierto, como imagen RGB independiente. Los índices
+    # deben pedirse en orden creciente: en GIF cada seek hacia adelante solo decodifica
+    # los cuadros intermedios, y así hay un único cuadro en memoria a la vez
+    image.seek(index)
+    return upright(image.convert('RGB'), orientation)
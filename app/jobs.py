@@ -0,0 +1,342 @@
+import os
+import json
+import math
+import time
+import uuid
+import shutil
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from functools import partial
+
+try:
+    from .imageprobe import decode_path
+    from .pipeline import Failed
+except ImportError:
+    from imageprobe import decode_path
+    from pipeline import Failed
+
+# Cola de trabajos persistente en SQLite: sobrevive reinicios y puede drenarse
+# desde varios procesos, porque la reserva de un trabajo es una transacción exclusiva.
+# Cada trabajo reservado lleva su dueño (pid del proceso) y un lease que el dueño
+# renueva mientras vive; solo vuelven a la cola los trabajos con el lease vencido
+jobs_dir = os.getenv('YOLO_JOBS_DIR', os.path.join(tempfile.gettempdir(), 'yolo_jobs'))
+job_workers = int(os.getenv('YOLO_JOB_WORKERS', 1))
+result_ttl = float(os.getenv('YOLO_JOB_TTL', 3600))
+# Segundos sin renovar tras los que un trabajo en ejecución se da por abandonado
+lease_s = float(os.getenv('YOLO_JOB_LEASE', 60))
+# Reservas como máximo por trabajo: uno que mata al proceso que lo toma (OOM, fallo en
+# la decodificación) vuelve con el lease vencido y se marca fallido al agotarlas
+max_attempts = int(os.getenv('YOLO_JOB_MAX_ATTEMPTS', 3))
+max_wait = 60.0
+
+schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    idempotency_key TEXT UNIQUE,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    lease REAL,
+    files TEXT NOT NULL,
+    params TEXT NOT NULL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created);
+CREATE INDEX IF NOT EXISTS jobs_expires ON jobs (expires);
+"""
+# Columnas agregadas después de la primera versión del esquema
+migrations = {'owner': 'ALTER TABLE jobs ADD COLUMN owner TEXT',
+              'lease': 'ALTER TABLE jobs ADD COLUMN lease REAL'}
+
+
+class JobStore:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.connection() as conn:
+            conn.executescript(schema)
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for column, statement in migrations.items():
+                if column not in columns:
+                    conn.execute(statement)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self.connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def add(self, files, params, priority=0, idempotency_key=None):
+        # Devuelve (trabajo, creado). Con una clave ya usada se devuelve el trabajo
+        # existente sin volver a encolarlo
+        job_id = uuid.uuid4().hex
+        with self.connection() as conn:
+            try:
+                conn.execute(
+                    'INSERT INTO jobs (id, idempotency_key, priority, status, created, files, params) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (job_id, idempotency_key, priority, 'queued', time.time(), json.dumps(files), json.dumps(params)))
+                return self.get(job_id, conn), True
+            except sqlite3.IntegrityError:
+                return self.find(idempotency_key), False
+
+    def get(self, job_id, conn=None):
+        if conn is None:
+            with self.connection() as conn:
+                return self.get(job_id, conn)
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        job = self.decode(row)
+        if job and job['expires'] and job['expires'] < time.time():
+            return None
+        return job
+
+    def find(self, idempotency_key):
+        with self.connection() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE idempotency_key = ?', (idempotency_key,)).fetchone()
+        return self.decode(row)
+
+    def claim(self, owner=None, lease=None, attempts=None):
+        # Reserva atómicamente el trabajo en cola de mayor prioridad (y más antiguo);
+        # un trabajo en ejecución cuyo dueño dejó de renovar el lease también se toma.
+        # Los que ya agotaron attempts reservas se marcan fallidos en lugar de retomarse
+        now = time.time()
+        lease = lease_s if lease is None else lease
+        attempts = max_attempts if attempts is None else attempts
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            while True:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' OR (status = 'running' AND "
+                    "(lease IS NULL OR lease < ?)) ORDER BY priority DESC, created LIMIT 1", (now,)).fetchone()
+                if row is None:
+                    conn.execute('COMMIT')
+                    return None
+                if row['attempts'] < attempts:
+                    break
+                print(f"Trabajo {row['id']} abandonado tras {row['attempts']} intentos")
+                conn.execute("UPDATE jobs SET status = 'failed', finished = ?, expires = ?, error = ?, owner = NULL, "
+                             "lease = NULL WHERE id = ?",
+                             (now, now + result_ttl, f"El trabajo se interrumpió en {row['attempts']} intentos",
+                              row['id']))
+            conn.execute("UPDATE jobs SET status = 'running', started = ?, attempts = attempts + 1, owner = ?, "
+                         "lease = ? WHERE id = ?", (now, owner, now + lease, row['id']))
+            conn.execute('COMMIT')
+            return self.decode(row)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def finish(self, job_id, result=None, error=None, ttl=None, owner=None):
+        # Con owner solo se escribe si el trabajo sigue siendo de ese dueño (otro proceso
+        # pudo retomarlo tras vencer el lease). Devuelve si se registró el resultado
+        now = time.time()
+        ttl = result_ttl if ttl is None else ttl
+        query = 'UPDATE jobs SET status = ?, finished = ?, expires = ?, result = ?, error = ?, lease = NULL WHERE id = ?'
+        args = ['failed' if error else 'done', now, now + ttl, json.dumps(result) if result is not None else None,
+                error, job_id]
+        if owner is not None:
+            query += " AND owner = ? AND status = 'running'"
+            args.append(owner)
+        with self.connection() as conn:
+            return conn.execute(query, args).rowcount > 0
+
+    def renew(self, owner, lease=None):
+        # Extiende el lease de los trabajos en ejecución de owner
+        lease = lease_s if lease is None else lease
+        with self.connection() as conn:
+            return conn.execute("UPDATE jobs SET lease = ? WHERE owner = ? AND status = 'running'",
+                                (time.time() + lease, owner)).rowcount
+
+    def requeue_expired(self):
+        # Trabajos cuyo dueño murió (lease vencido) vuelven a la cola; los de otro
+        # proceso vivo siguen en ejecución
+        with self.connection() as conn:
+            return conn.execute("UPDATE jobs SET status = 'queued', owner = NULL, lease = NULL "
+                                "WHERE status = 'running' AND (lease IS NULL OR lease < ?)",
+                                (time.time(),)).rowcount
+
+    def expire(self):
+        # Borra resultados vencidos y devuelve sus archivos para eliminarlos
+        now = time.time()
+        with self.connection() as conn:
+            rows = conn.execute('SELECT id, files FROM jobs WHERE expires < ?', (now,)).fetchall()
+            conn.execute('DELETE FROM jobs WHERE expires < ?', (now,))
+        return [(row['id'], json.loads(row['files'])) for row in rows]
+
+    def counts(self):
+        with self.connection() as conn:
+            rows = conn.execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status').fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    @staticmethod
+    def decode(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job['files'] = json.loads(job['files'])
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+
+def process_job(yolo, job):
+    # Mismo resultado que /detect-count para cada imagen del trabajo. Las imágenes pasan
+    # por el pipeline del modelo: se decodifica la siguiente mientras corre la actual
+    params = job['params']
+    loader = partial(decode_path, tiled=params.get('tiled'), tile_threshold=params.get('tile_threshold'),
+                     rois=params.get('rois'))
+    pipeline = yolo.make_pipeline(loader=loader, tiled_kwargs={'merge': params.get('merge', 'nms')},
+                                  mosaic=params.get('mosaic'))
+    results = []
+    for item, out in zip(job['files'], pipeline.map([item['path'] for item in job['files']])):
+        if isinstance(out, Failed):
+            raise out.error
+        results.append({'filename': item['filename'], 'countings': out['countings'],
+                        'detections': out['detections']})
+    return {'results': results, 'pipeline': pipeline.stats()}
+
+
+class JobQueue:
+    def __init__(self, path=None, spool_dir=None, model_factory=None, workers=None, process=process_job,
+                 lease=None):
+        self.spool_dir = spool_dir or os.path.join(jobs_dir, 'files')
+        self.store = JobStore(path or os.path.join(jobs_dir, 'jobs.sqlite3'))
+        self.model_factory = model_factory
+        self.workers = job_workers if workers is None else workers
+        self.process = process
+        self.lease = lease_s if lease is None else lease
+        self.owner = None
+        self.cond = threading.Condition()
+        self.threads = []
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    def submit(self, uploads, params, priority=0, idempotency_key=None):
+        # uploads: lista de (nombre, objeto con save()) p. ej. FileStorage de Flask.
+        # Las imágenes se guardan en disco antes de registrar el trabajo
+        if idempotency_key:
+            job = self.store.find(idempotency_key)
+            if job is not None:
+                return job, False
+        job_dir = os.path.join(self.spool_dir, uuid.uuid4().hex)
+        os.makedirs(job_dir)
+        files = []
+        for i, (filename, upload) in enumerate(uploads):
+            path = os.path.join(job_dir, f'{i:05d}_{os.path.basename(filename)}')
+            upload.save(path)
+            files.append({'filename': filename, 'path': path})
+        job, created = self.store.add(files, params, priority, idempotency_key)
+        if not created:
+            shutil.rmtree(job_dir, ignore_errors=True)
+        with self.cond:
+            self.cond.notify_all()
+        return job, created
+
+    def wait(self, job_id, timeout=0.0):
+        # Long polling: espera hasta timeout segundos a que el trabajo termine. Otro proceso
+        # puede completarlo, por eso además de la notificación se consulta la base.
+        # Un timeout no finito o negativo no espera (nan haría eterno el plazo)
+        timeout = min(timeout, max_wait) if math.isfinite(timeout) and timeout > 0 else 0.0
+        deadline = time.time() + timeout
+        while True:
+            job = self.store.get(job_id)
+            if job is None or job['status'] in ('done', 'failed'):
+                return job
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return job
+            with self.cond:
+                self.cond.wait(min(remaining, 0.5))
+
+    def start(self):
+        with self._start_lock:
+            if self.threads or self.workers <= 0:
+                return
+            # Dueño propio de este proceso (después de un fork cambia el pid)
+            self.owner = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+            recovered = self.store.requeue_expired()
+            if recovered:
+                print(f'Trabajos reencolados por lease vencido: {recovered}')
+            threads = [threading.Thread(target=self._heartbeat, name='yolo-job-lease', daemon=True)]
+            threads += [threading.Thread(target=self._worker, name=f'yolo-job-{i}', daemon=True)
+                        for i in range(self.workers)]
+            for t in threads:
+                t.start()
+                self.threads.append(t)
+
+    def stop(self):
+        self._stop.set()
+        with self.cond:
+            self.cond.notify_all()
+        for t in self.threads:
+            t.join()
+        self.threads = []
+        self._stop.clear()
+
+    def _heartbeat(self):
+        # Renueva el lease de los trabajos en curso varias veces por período
+        while not self._stop.wait(self.lease / 3):
+            try:
+                self.store.renew(self.owner, self.lease)
+            except sqlite3.Error as e:
+                print(f'Error al renovar el lease de los trabajos: {str(e)}')
+
+    def _worker(self):
+        # Cada worker tiene su propio YoloOnnx (sesión y arena de ORT propias)
+        yolo = self.model_factory()
+        last_sweep = 0.0
+        while not self._stop.is_set():
+            if time.time() - last_sweep > 60:
+                self.sweep()
+                last_sweep = time.time()
+            job = self.store.claim(self.owner, self.lease)
+            if job is None:
+                with self.cond:
+                    self.cond.wait(1.0)
+                continue
+            try:
+                result = self.process(yolo, job)
+                recorded = self.store.finish(job['id'], result=result, owner=self.owner)
+            except Exception as e:
+                print(f"Error en el trabajo {job['id']}: {str(e)}")
+                recorded = self.store.finish(job['id'], error=str(e), owner=self.owner)
+            if not recorded:
+                print(f"El trabajo {job['id']} fue retomado por otro proceso; se descarta este resultado")
+            with self.cond:
+                self.cond.notify_all()
+
+    def sweep(self):
+        for job_id, files in self.store.expire():
+            dirs = {os.path.dirname(item['path']) for item in files}
+            for d in dirs:
+                shutil.rmtree(d, ignore_errors=True)
+
+    @staticmethod
+    def to_json(job):
+        data = {k: job[k] for k in ('id', 'status', 'priority', 'created', 'started', 'finished', 'expires')}
+        if job['status'] == 'done':
+            data['result'] = job['result']
+        if job['status'] == 'failed':
+            data['error'] = job['error']
+        return data
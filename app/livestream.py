@@ -0,0 +1,91 @@
+import os
+import time
+import threading
+
+# Difusión del último cuadro anotado de una fuente a los espectadores MJPEG.
+# El lazo de inferencia solo deja el cuadro y sus cajas (sin dibujar ni codificar);
+# el primer espectador que lo pide lo dibuja y lo codifica una vez y los demás reusan
+# esos bytes. Un espectador lento no acumula cuadros: cada vez que puede escribir toma
+# el más nuevo y los intermedios se pierden. Sin espectadores no se dibuja nada
+stream_max_dim = int(os.getenv('YOLO_STREAM_MAX_DIM', 960))
+stream_quality = int(os.getenv('YOLO_STREAM_QUALITY', 75))
+keepalive_s = 5.0
+boundary = 'frame'
+
+
+class FrameBroadcast:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.encode_lock = threading.Lock()
+        self.seq = 0
+        self.pending = None
+        self.data = None
+        self.data_seq = 0
+        self.viewers = 0
+        self.published = 0
+        self.encoded = 0
+        self.closed = False
+
+    def publish(self, render):
+        # render(): bytes JPEG del cuadro; se llama a lo sumo una vez y solo si alguien mira
+        with self.cond:
+            self.pending = render
+            self.seq += 1
+            self.published += 1
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def latest(self, after=0, timeout=keepalive_s):
+        # (seq, bytes) del cuadro más nuevo posterior a after, o None si no llegó
+        # ninguno en timeout o la difusión se cerró
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.closed or self.seq > after, timeout) or self.closed:
+                return None
+            seq, render = self.seq, self.pending
+        with self.encode_lock:
+            # Si otro espectador ya codificó este cuadro (o uno más nuevo) se reusa
+            if self.data_seq < seq:
+                self.data = render()
+                self.data_seq = seq
+                self.encoded += 1
+            return self.data_seq, self.data
+
+    def frames(self, max_fps=None, keepalive=None):
+        # Generador de partes multipart/x-mixed-replace para un espectador. Si en
+        # keepalive segundos no llega un cuadro nuevo (la fuente se está reconectando)
+        # se reenvía el último: un espectador que se fue se detecta al escribir y libera
+        # su hilo, y un proxy no corta el stream por inactividad
+        keepalive = keepalive_s if keepalive is None else keepalive
+        with self.cond:
+            self.viewers += 1
+        try:
+            last = 0
+            interval = 1.0 / max_fps if max_fps else 0.0
+            while not self.closed:
+                started = time.perf_counter()
+                latest = self.latest(last, keepalive)
+                if latest is not None:
+                    last, data = latest
+                elif self.closed:
+                    break
+                elif self.data is not None:
+                    data = self.data
+                else:
+                    # Aún sin cuadros: un CRLF antes de la primera parte es preámbulo
+                    # multipart y el cliente lo ignora
+                    yield b'\r\n'
+                    continue
+                yield (f'--{boundary}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(data)}\r\n\r\n'
+                       .encode() + data + b'\r\n')
+                if interval:
+                    time.sleep(max(interval - (time.perf_counter() - started), 0))
+        finally:
+            with self.cond:
+                self.viewers -= 1
+
+    def stats(self):
+        return {'viewers': self.viewers, 'published': self.published, 'encoded': self.encoded}
@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+"""
+Generador de carga local para /detect-count.
+
+Levanta la aplicación (una o varias configuraciones de servidor), la ejercita
+en lazo cerrado (concurrencia fija) o lazo abierto (tasa de llegadas fija) con
+una mezcla de imágenes configurable y reporta throughput, latencias p50/p95/p99,
+tasa de error y CPU/RSS del proceso servidor para cada nivel de carga.
+
+Ejemplos:
+    python -m app.loadtest --mode closed --levels 1,2,4,8 --duration 20
+    python -m app.loadtest --mode open --levels 2,4,8 --image foto.jpg:3 --synthetic 1920x1080:1
+    python -m app.loadtest --server "base=" --server "2hilos=YOLO_ORT_THREADS=2" --json reporte.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import shlex
+import random
+import socket
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import psutil
+import requests
+from PIL import Image
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+default_command = '{python} -m flask --app application run --port {port} --no-reload'
+
+
+# ---------------------------------------------------------------------------
+# Mezcla de imágenes
+# ---------------------------------------------------------------------------
+
+def parse_weighted(spec):
+    # "valor:peso" -> (valor, peso); el peso es opcional y por defecto 1
+    value, _, weight = spec.rpartition(':')
+    if not value or not weight.replace('.', '', 1).isdigit():
+        return spec, 1.0
+    return value, float(weight)
+
+
+def synthetic_image(width, height, seed=0, format_name='JPEG', quality=90):
+    # Ruido con bloques de color para que el JPEG tenga un tamaño realista
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, 256, size=(max(height // 16, 1), max(width // 16, 1), 3), dtype=np.uint8)
+    img = Image.fromarray(blocks).resize((width, height), Image.NEAREST)
+    noise = rng.integers(-20, 20, size=(height, width, 3))
+    arr = np.clip(np.asarray(img, dtype=np.int16) + noise, 0, 255).astype(np.uint8)
+    img_io = io.BytesIO()
+    Image.fromarray(arr).save(img_io, format=format_name, quality=quality)
+    return img_io.getvalue()
+
+
+def build_image_mix(image_specs, synthetic_specs):
+    mix = []  # (nombre, bytes, peso)
+    for spec in image_specs or []:
+        path, weight = parse_weighted(spec)
+        with open(path, 'rb') as f:
+            mix.append((os.path.basename(path), f.read(), weight))
+    for i, spec in enumerate(synthetic_specs or []):
+        size, weight = parse_weighted(spec)
+        width, height = (int(v) for v in size.lower().split('x'))
+        mix.append((f'synthetic_{width}x{height}.jpg', synthetic_image(width, height, seed=i), weight))
+    if not mix:
+        mix = [
+            ('synthetic_640x480.jpg', synthetic_image(640, 480, seed=0), 3.0),
+            ('synthetic_1920x1080.jpg', synthetic_image(1920, 1080, seed=1), 1.0),
+        ]
+    return mix
+
+
+class ImageMix:
+    def __init__(self, mix, seed=0):
+        self.mix = mix
+        self.weights = [w for _, _, w in mix]
+        self.seed = seed
+
+    def sampler(self, worker_id):
+        # Un generador independiente por hilo para no compartir estado
+        rng = random.Random(self.seed + worker_id)
+        while True:
+            yield rng.choices(self.mix, weights=self.weights)[0]
+
+
+# ---------------------------------------------------------------------------
+# Configuraciones de servidor
+# ---------------------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def parse_server(spec):
+    # "nombre=VAR=valor VAR2=valor comando..." -> (nombre, env, comando)
+    name, _, rest = spec.partition('=')
+    tokens = shlex.split(rest)
+    env = {}
+    while tokens and '=' in tokens[0] and not tokens[0].startswith('-'):
+        key, _, value = tokens.pop(0).partition('=')
+        env[key] = value
+    command = ' '.join(tokens) if tokens else default_command
+    return name or 'default', env, command
+
+
+class ServerProcess:
+    def __init__(self, name, env, command, port=None, startup_timeout=120):
+        self.name = name
+        self.env = env
+        self.command = command
+        self.port = port or free_port()
+        self.startup_timeout = startup_timeout
+        self.proc = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self):
+        env = dict(os.environ, **self.env)
+        env['PORT'] = str(self.port)
+        cmd = self.command.format(python=shlex.quote(sys.executable), port=self.port)
+        print(f'[{self.name}] Iniciando servidor: {cmd}')
+        self.proc = subprocess.Popen(shlex.split(cmd), cwd=root_dir, env=env,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.time() + self.startup_timeout
+        while time.time() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f'El servidor {self.name} terminó con código {self.proc.returncode}')
+            try:
+                if requests.get(self.url + '/', timeout=1).status_code == 200:
+                    return self
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        self.stop()
+        raise RuntimeError(f'El servidor {self.name} no respondió en {self.startup_timeout}s')
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class ProcessSampler:
+    # Muestrea CPU y RSS del proceso servidor (y sus hijos) en segundo plano
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.cpu = []
+        self.rss = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _processes(self):
+        try:
+            parent = psutil.Process(self.pid)
+            return [parent] + parent.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+
+    def _run(self):
+        procs = self._processes()
+        for p in procs:
+            p.cpu_percent(None)
+        while not self._stop.wait(self.interval):
+            cpu, rss = 0.0, 0
+            for p in procs:
+                try:
+                    cpu += p.cpu_percent(None)
+                    rss += p.memory_info().rss
+                except psutil.NoSuchProcess:
+                    continue
+            self.cpu.append(cpu)
+            self.rss.append(rss)
+
+    def __enter__(self):
+        if self.pid:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def summary(self):
+        return {
+            'cpu_percent': float(np.mean(self.cpu)) if self.cpu else None,
+            'rss_mb': max(self.rss) / 2**20 if self.rss else None,
+        }
+
+
+# ---------------------------------------------------------------------------
+# Generación de carga
+# ---------------------------------------------------------------------------
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        self.total = 0
+
+    def add(self, latency, ok):
+        with self.lock:
+            self.total += 1
+            if ok:
+                self.latencies.append(latency)
+            else:
+                self.errors += 1
+
+
+def send(session, url, item, timeout):
+    name, data, _ = item
+    try:
+        response = session.post(url, files={'image': (name, data)}, timeout=timeout)
+        return response.status_code == 200
+    except requests.RequestException:
+        return False
+
+
+def closed_loop(url, mix, concurrency, duration, timeout=60):
+    # Cada hilo envía la siguiente petición en cuanto recibe la respuesta anterior
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+
+    def worker(worker_id):
+        session = requests.Session()
+        sampler = mix.sampler(worker_id)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            ok = send(session, url, next(sampler), timeout)
+            recorder.add(time.perf_counter() - start, ok)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return recorder, time.perf_counter() - start
+
+
+def open_loop(url, mix, rate, duration, timeout=60, max_workers=256, seed=0):
+    # Llegadas de Poisson a tasa fija; la latencia se mide desde el instante
+    # programado para no ocultar el tiempo en cola (omisión coordinada)
+    recorder = Recorder()
+    rng = random.Random(seed)
+    sampler = mix.sampler(0)
+    local = threading.local()
+
+    def task(item, scheduled):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        ok = send(local.session, url, item, timeout)
+        recorder.add(time.perf_counter() - scheduled, ok)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        scheduled = start
+        while scheduled < start + duration:
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(task, next(sampler), scheduled)
+            scheduled += rng.expovariate(rate)
+    return recorder, time.perf_counter() - start
+
+
+def summarize(recorder, elapsed):
+    latencies = np.array(recorder.latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies.size else (None, None, None)
+    return {
+        'requests': recorder.total,
+        'throughput': len(recorder.latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': p50,
+        'p95_ms': p95,
+        'p99_ms': p99,
+        'error_rate': recorder.errors / recorder.total if recorder.total else 0.0,
+    }
+
+
+def run_levels(url, mix, mode, levels, duration, pid=None, warmup=3, timeout=60):
+    session = requests.Session()
+    sampler = mix.sampler(-1)
+    for _ in range(warmup):
+        send(session, url, next(sampler), timeout)
+
+    results = []
+    for level in levels:
+        with ProcessSampler(pid) as sampler_proc:
+            if mode == 'closed':
+                recorder, elapsed = closed_loop(url, mix, int(level), duration, timeout)
+            else:
+                recorder, elapsed = open_loop(url, mix, float(level), duration, timeout)
+        row = {'level': level}
+        row.update(summarize(recorder, elapsed))
+        row.update(sampler_proc.summary())
+        results.append(row)
+        print(format_row(row))
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Reporte
+# ---------------------------------------------------------------------------
+
+columns = [
+    # (clave, título, ancho, formato)
+    ('level', 'nivel', 7, '{:>7}'),
+    ('throughput', 'req/s', 8, '{:>8.2f}'),
+    ('p50_ms', 'p50 ms', 9, '{:>9.1f}'),
+    ('p95_ms', 'p95 ms', 9, '{:>9.1f}'),
+    ('p99_ms', 'p99 ms', 9, '{:>9.1f}'),
+    ('error_rate', 'error', 7, '{:>7.1%}'),
+    ('cpu_percent', 'cpu %', 7, '{:>7.0f}'),
+    ('rss_mb', 'rss MB', 8, '{:>8.0f}'),
+]
+
+
+def format_header():
+    return ' '.join(f'{title:>{width}}' for _, title, width, _ in columns)
+
+
+def format_row(row):
+    cells = []
+    for key, _, width, fmt in columns:
+        value = row.get(key)
+        cells.append(fmt.format(value) if value is not None else f'{"-":>{width}}')
+    return ' '.join(cells)
+
+
+def print_report(report, mode):
+    unit = 'concurrencia' if mode == 'closed' else 'llegadas/s'
+    for name, rows in report.items():
+        print(f'\n=== {name} (nivel = {unit}) ===')
+        print(format_header())
+        for row in rows:
+            print(format_row(row))
+
+    # Comparación entre las dos primeras configuraciones
+    names = list(report)
+    if len(names) >= 2:
+        base, other = names[0], names[1]
+        print(f'\n=== {other} vs {base} ===')
+        print(f'{"nivel":>7} {"req/s":>9} {"p99":>9}')
+        for a, b in zip(report[base], report[other]):
+            d_tp = (b['throughput'] / a['throughput'] - 1) if a['throughput'] else float('nan')
+            d_p99 = (b['p99_ms'] / a['p99_ms'] - 1) if a['p99_ms'] and b['p99_ms'] else float('nan')
+            print(f'{a["level"]:>7} {d_tp:>+9.1%} {d_p99:>+9.1%}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pruebas de carga locales para /detect-count')
+    parser.add_argument('--mode', choices=['closed', 'open'], default='closed',
+                        help='closed: concurrencia fija; open: tasa de llegadas fija')
+    parser.add_argument('--levels', default='1,2,4,8',
+                        help='Concurrencias (closed) o tasas en req/s (open), separadas por coma')
+    parser.add_argument('--duration', type=float, default=15, help='Segundos por nivel')
+    parser.add_argument('--image', action='append', help='Imagen de la mezcla: RUTA[:PESO]')
+    parser.add_argument('--synthetic', action='append', help='Imagen sintética: ANCHOxALTO[:PESO]')
+    parser.add_argument('--server', action='append',
+                        help='Configuración a levantar: NOMBRE=[VAR=valor ...] [comando con {port}]')
+    parser.add_argument('--url', help='Usar un servidor ya levantado en lugar de iniciar uno')
+    parser.add_argument('--pid', type=int, help='PID del servidor indicado con --url para medir CPU/RSS')
+    parser.add_argument('--endpoint', default='/detect-count')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--json', help='Guardar el reporte en un archivo JSON')
+    args = parser.parse_args(argv)
+
+    levels = [float(v) if args.mode == 'open' else int(v) for v in args.levels.split(',')]
+    mix = ImageMix(build_image_mix(args.image, args.synthetic))
+    print('Mezcla de imágenes:', ', '.join(f'{n} ({len(d) // 1024} KB, peso {w:g})' for n, d, w in mix.mix))
+
+    report = {}
+    if args.url:
+        report['externo'] = run_levels(args.url.rstrip('/') + args.endpoint, mix, args.mode, levels,
+                                       args.duration, pid=args.pid, timeout=args.timeout)
+    else:
+        for spec in args.server or ['default=']:
+            name, env, command = parse_server(spec)
+            with ServerProcess(name, env, command) as server:
+                print(f'\n[{name}] {server.url}')
+                print(format_header())
+                report[name] = run_levels(server.url + args.endpoint, mix, args.mode, levels,
+                                          args.duration, pid=server.proc.pid, timeout=args.timeout)
+
+    print_report(report, args.mode)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'mode': args.mode, 'duration': args.duration, 'results': report}, f, indent=2)
+        print(f'\nReporte guardado en {args.json}')
+
+
+if __name__ == '__main__':
+    main()
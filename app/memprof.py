@@ -0,0 +1,140 @@
+import os
+import time
+import threading
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+import psutil
+
+# Instrumentación de memoria por petición:
+#  - RSS antes/después y pico de RSS de la sección. En Linux el pico se reinicia al
+#    entrar escribiendo 5 en /proc/self/clear_refs y se lee de VmHWM; es un valor del
+#    proceso, así que con varias peticiones concurrentes incluye las de los demás hilos
+#  - asignaciones Python (incluye buffers de numpy) con tracemalloc, si está activo:
+#    pico y neto de la sección. YOLO_TRACEMALLOC=N lo activa con N cuadros por traza
+tracemalloc_frames = int(os.getenv('YOLO_TRACEMALLOC', 0))
+history_size = 256
+
+_clear_refs = '/proc/self/clear_refs'
+_status = '/proc/self/status'
+
+
+def rss():
+    return psutil.Process().memory_info().rss
+
+
+def peak_rss():
+    # VmHWM en bytes, o None si la plataforma no lo expone
+    try:
+        with open(_status) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    try:
+        with open(_clear_refs, 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class MemoryTracker:
+    def __init__(self, frames=None, history=history_size):
+        frames = tracemalloc_frames if frames is None else frames
+        if frames and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.baseline = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        self.recent = deque(maxlen=history)
+        self.totals = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._process = psutil.Process()
+
+    @contextmanager
+    def measure(self, label):
+        # Secciones anidadas (p. ej. inferencia dentro de predict): cada una reinicia los
+        # picos al entrar y los propaga a la sección que la contiene al salir
+        stack = self._local.__dict__.setdefault('stack', [])
+        tracing = tracemalloc.is_tracing()
+        if stack:
+            parent = stack[-1]
+            parent['peak'] = max(parent['peak'], peak_rss() or 0)
+            if tracing:
+                parent['py_peak'] = max(parent['py_peak'], tracemalloc.get_traced_memory()[1])
+        frame = {'peak': 0, 'py_peak': 0}
+        result = {}
+        stack.append(frame)
+        reset = reset_peak_rss()
+        if tracing:
+            tracemalloc.reset_peak()
+        py_before = tracemalloc.get_traced_memory()[0] if tracing else 0
+        rss_before = self._process.memory_info().rss
+        start = time.perf_counter()
+        try:
+            yield result
+        finally:
+            elapsed = time.perf_counter() - start
+            rss_after = self._process.memory_info().rss
+            peak = max(frame['peak'], (peak_rss() or 0) if reset else 0, rss_after)
+            record = {
+                'label': label,
+                'time': time.time(),
+                'elapsed_ms': round(elapsed * 1000, 2),
+                'rss_before': rss_before,
+                'rss_after': rss_after,
+                'peak_rss': peak,
+                'peak_rss_delta': peak - rss_before,
+            }
+            if tracing:
+                current, py_peak = tracemalloc.get_traced_memory()
+                py_peak = max(frame['py_peak'], py_peak)
+                record['py_peak'] = py_peak - py_before
+                record['py_net'] = current - py_before
+            stack.pop()
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+                if tracing:
+                    stack[-1]['py_peak'] = max(stack[-1]['py_peak'], py_peak)
+            result.update(record)
+            self.add(record)
+
+    def add(self, record):
+        with self._lock:
+            self.recent.append(record)
+            total = self.totals.setdefault(record['label'], {'count': 0, 'peak_rss_delta_max': 0,
+                                                             'peak_rss_delta_sum': 0, 'py_peak_max': 0})
+            total['count'] += 1
+            total['peak_rss_delta_max'] = max(total['peak_rss_delta_max'], record['peak_rss_delta'])
+            total['peak_rss_delta_sum'] += record['peak_rss_delta']
+            total['py_peak_max'] = max(total['py_peak_max'], record.get('py_peak', 0))
+
+    def summary(self):
+        with self._lock:
+            totals = {label: dict(t, peak_rss_delta_mean=t['peak_rss_delta_sum'] // t['count'])
+                      for label, t in self.totals.items()}
+            recent = list(self.recent)[-20:]
+        return {'rss': rss(), 'peak_rss': peak_rss(), 'tracemalloc': tracemalloc.is_tracing(),
+                'sections': totals, 'recent': recent}
+
+    def top_allocations(self, limit=20, key='lineno', diff=True):
+        # Sitios con más memoria Python viva; con diff, el crecimiento desde el arranque
+        # del tracker (lo que más ayuda a encontrar fugas)
+        if not tracemalloc.is_tracing():
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ])
+        if diff and self.baseline is not None:
+            stats = snapshot.compare_to(self.baseline, key)[:limit]
+            return [{'site': str(s.traceback), 'size': s.size, 'size_diff': s.size_diff,
+                     'count': s.count, 'count_diff': s.count_diff} for s in stats]
+        stats = snapshot.statistics(key)[:limit]
+        return [{'site': str(s.traceback), 'size': s.size, 'count': s.count} for s in stats]
@@ -0,0 +1,187 @@
+import time
+import queue
+import threading
+from collections import namedtuple
+
+# Motor de etapas con colas acotadas: cada etapa corre en sus propios hilos, de modo
+# que la decodificación y el preprocesamiento de los siguientes elementos avanzan
+# mientras ORT ejecuta el lote actual. Las colas acotadas dan contrapresión y limitan
+# la memoria a (maxsize + hilos) elementos por etapa.
+
+Failed = namedtuple('Failed', ['error'])
+_end = object()
+
+
+class Stage:
+    def __init__(self, name, fn, workers=1, batch_size=1, batch_timeout=0.005, batched=None):
+        # Una etapa por lotes (por defecto si batch_size > 1) recibe una lista y devuelve
+        # una lista del mismo largo
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batched = batch_size > 1 if batched is None else batched
+        self.batch_timeout = batch_timeout
+        self.reset()
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.items = 0
+        self.calls = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+
+    def record(self, items, busy, starved, blocked):
+        with self.lock:
+            self.items += items
+            self.calls += 1
+            self.busy += busy
+            self.starved += starved
+            self.blocked += blocked
+
+
+class Pipeline:
+    def __init__(self, stages, maxsize=4):
+        self.stages = stages
+        self.maxsize = maxsize
+        self.elapsed = 0.0
+        self._started = None
+        self._run_lock = threading.Lock()
+        self._cancel = threading.Event()
+
+    def map(self, items):
+        # Generador con los resultados en el orden de entrada. Un error en cualquier
+        # etapa se entrega como Failed(error) para ese elemento y no detiene el resto.
+        # Una instancia corre una sola pasada a la vez (las estadísticas son por pasada)
+        if not self._run_lock.acquire(blocking=False):
+            raise RuntimeError('El pipeline ya está en ejecución')
+        try:
+            for stage in self.stages:
+                stage.reset()
+            queues = [queue.Queue(self.maxsize) for _ in range(len(self.stages) + 1)]
+            threads = []
+            for i, stage in enumerate(self.stages):
+                remaining = [stage.workers]
+                for _ in range(stage.workers):
+                    t = threading.Thread(target=self._work, args=(stage, queues[i], queues[i + 1], remaining),
+                                         name=f'pipeline-{stage.name}', daemon=True)
+                    t.start()
+                    threads.append(t)
+
+            feeder = threading.Thread(target=self._feed, args=(items, queues[0]), daemon=True)
+            start = self._started = time.perf_counter()
+            feeder.start()
+            done = False
+            try:
+                pending = {}
+                expected = 0
+                while True:
+                    entry = queues[-1].get()
+                    if entry is _end:
+                        done = True
+                        break
+                    seq, value = entry
+                    pending[seq] = value
+                    while expected in pending:
+                        yield pending.pop(expected)
+                        expected += 1
+            finally:
+                if not done:
+                    # El consumidor abandonó el generador: se deja de alimentar y se
+                    # drena la salida para que ningún hilo quede bloqueado en una cola
+                    self._cancel.set()
+                    while queues[-1].get() is not _end:
+                        pass
+                self.elapsed = time.perf_counter() - start
+                self._started = None
+                feeder.join()
+                for t in threads:
+                    t.join()
+                self._cancel.clear()
+        finally:
+            self._run_lock.release()
+
+    def _feed(self, items, out):
+        try:
+            for seq, item in enumerate(items):
+                if self._cancel.is_set():
+                    break
+                out.put((seq, item))
+        finally:
+            out.put(_end)
+
+    @staticmethod
+    def _take(stage, inq):
+        # Toma hasta batch_size elementos; espera a lo sumo batch_timeout por los siguientes
+        first = inq.get()
+        if first is _end or stage.batch_size == 1:
+            return [first]
+        batch = [first]
+        deadline = time.perf_counter() + stage.batch_timeout
+        while len(batch) < stage.batch_size:
+            try:
+                entry = inq.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            batch.append(entry)
+            if entry is _end:
+                break
+        return batch
+
+    def _work(self, stage, inq, outq, remaining):
+        while True:
+            t0 = time.perf_counter()
+            batch = self._take(stage, inq)
+            t1 = time.perf_counter()
+            finished = batch[-1] is _end
+            entries = [e for e in batch if e is not _end]
+            live = [(seq, value) for seq, value in entries if not isinstance(value, Failed)]
+            results = {}
+            if live and not self._cancel.is_set():
+                try:
+                    if stage.batched:
+                        outputs = stage.fn([value for _, value in live])
+                    else:
+                        outputs = [stage.fn(live[0][1])]
+                    results = {seq: out for (seq, _), out in zip(live, outputs)}
+                except Exception as e:
+                    results = {seq: Failed(e) for seq, _ in live}
+            t2 = time.perf_counter()
+            for seq, value in entries:
+                outq.put((seq, results.get(seq, value)))
+            t3 = time.perf_counter()
+            if entries:
+                stage.record(len(live), t2 - t1, t1 - t0, t3 - t2)
+            if finished:
+                # El último hilo de la etapa propaga el fin; los demás lo reinyectan
+                with stage.lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    outq.put(_end)
+                else:
+                    inq.put(_end)
+                return
+
+    def stats(self):
+        # Ocupación = tiempo ocupado / (tiempo total * hilos). La etapa con mayor
+        # ocupación es el cuello de botella; starved indica espera por la etapa previa
+        # y blocked espera por la siguiente (cola llena). Durante una pasada en curso
+        # (p. ej. fuentes en vivo) se usa el tiempo transcurrido hasta ahora
+        started = self._started
+        elapsed = (time.perf_counter() - started if started else self.elapsed) or 1e-9
+        report = {}
+        for stage in self.stages:
+            report[stage.name] = {
+                'items': stage.items,
+                'calls': stage.calls,
+                'workers': stage.workers,
+                'busy_s': round(stage.busy, 4),
+                'occupancy': round(stage.busy / (elapsed * stage.workers), 3),
+                'starved_s': round(stage.starved, 4),
+                'blocked_s': round(stage.blocked, 4),
+                'avg_batch': round(stage.items / stage.calls, 2) if stage.calls else 0.0,
+            }
+        return {'elapsed_s': round(elapsed, 4), 'stages': report,
+                'bottleneck': max(report, key=lambda k: report[k]['occupancy']) if report else None}
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# Clases de prioridad para el acceso al modelo compartido dentro de un worker.
+# Menor número = más prioridad. La clase la fija la API key (X-API-Key, ver
+# YOLO_API_KEYS); X-Priority-Class solo se considera con una clave válida y solo
+# para bajar la prioridad. Sin clave se usa YOLO_QOS_DEFAULT
+priorities = {'interactive': 0, 'standard': 1, 'bulk': 2}
+default_class = os.getenv('YOLO_QOS_DEFAULT', 'standard')
+
+# Inferencias simultáneas sobre la instancia compartida (con GUNICORN_THREADS > 1 las
+# demás peticiones esperan su turno en la cola en lugar de competir por los núcleos).
+# El letterbox de cada inferencia es estado por hilo de YoloOnnx, así que varias
+# peticiones pueden usar el modelo a la vez
+infer_slots = int(os.getenv('YOLO_INFER_SLOTS', 4))
+# Fracción de los slots que solo puede usar el tráfico interactivo (al menos uno si
+# es mayor que cero y hay más de un slot)
+interactive_share = float(os.getenv('YOLO_QOS_RESERVED', 0.25))
+# Cada aging_s segundos de espera una petición sube una clase de prioridad, así las
+# de menor prioridad no esperan indefinidamente bajo carga interactiva sostenida
+aging_s = float(os.getenv('YOLO_QOS_AGING', 5.0))
+# Espera máxima en la cola antes de responder 503
+max_queue_wait = float(os.getenv('YOLO_QOS_TIMEOUT', 30.0))
+history_size = 1024
+
+
+class QueueTimeout(Exception):
+    def __init__(self, qos_class, waited):
+        super().__init__(f'Tiempo de espera agotado en la cola {qos_class} ({waited:.1f} s)')
+        self.qos_class = qos_class
+        self.waited = waited
+
+
+def parse_limits(value):
+    # "bulk:1,standard:2" o JSON -> {clase: inferencias simultáneas máximas}
+    if not value:
+        return {}
+    if value.lstrip().startswith('{'):
+        limits = json.loads(value)
+    else:
+        limits = dict(part.split(':', 1) for part in value.split(',') if part.strip())
+    limits = {name.strip(): int(limit) for name, limit in limits.items()}
+    unknown = set(limits) - set(priorities)
+    if unknown:
+        raise ValueError(f"Clases desconocidas: {', '.join(sorted(unknown))}")
+    return limits
+
+
+def load_api_keys(value=None):
+    # YOLO_API_KEYS: JSON {"clave": "bulk", ...} o ruta a un archivo con ese JSON
+    value = os.getenv('YOLO_API_KEYS') if value is None else value
+    if not value:
+        return {}
+    if not value.lstrip().startswith('{'):
+        with open(value) as f:
+            value = f.read()
+    keys = json.loads(value)
+    unknown = set(keys.values()) - set(priorities)
+    if unknown:
+        raise ValueError(f"Clases desconocidas: {', '.join(sorted(unknown))}")
+    return keys
+
+
+def resolve_class(requested, api_key=None, api_keys=None):
+    # La clase de la API key es un techo: el encabezado solo puede bajar la prioridad.
+    # Sin clave el encabezado no se considera (cualquiera podría pedir interactive) y
+    # una clave desconocida cuenta como bulk
+    api_keys = api_keys or {}
+    requested = (requested or '').strip().lower() or None
+    if requested is not None and requested not in priorities:
+        raise ValueError(f'Clase de prioridad desconocida: {requested}')
+    if not api_key:
+        return default_class
+    if api_key not in api_keys:
+        return 'bulk'
+    ceiling = api_keys[api_key]
+    if requested is None or priorities[requested] < priorities[ceiling]:
+        return ceiling
+    return requested
+
+
+class QosScheduler:
+    """Cola de acceso al modelo con prioridad estricta, envejecimiento, límites por
+    clase y una parte de los slots reservada para el tráfico interactivo"""
+
+    def __init__(self, slots=None, limits=None, reserved=None, aging=None, timeout=None, history=history_size):
+        self.slots = max(int(slots or infer_slots), 1)
+        self.limits = dict(limits if limits is not None else parse_limits(os.getenv('YOLO_QOS_LIMITS')))
+        share = interactive_share if reserved is None else reserved
+        # Nunca se reservan todos los slots: las demás clases siempre pueden avanzar
+        self.reserved = min(max(int(self.slots * share), 1 if share > 0 else 0), self.slots - 1)
+        self.aging = aging_s if aging is None else aging
+        self.timeout = max_queue_wait if timeout is None else timeout
+        self.cond = threading.Condition()
+        self.waiting = []
+        self.running = dict.fromkeys(priorities, 0)
+        self.served = dict.fromkeys(priorities, 0)
+        self.timeouts = dict.fromkeys(priorities, 0)
+        self.waits = {name: deque(maxlen=history) for name in priorities}
+        self._seq = itertools.count()
+
+    def eligible(self, qos_class):
+        if self.running[qos_class] >= self.limits.get(qos_class, self.slots):
+            return False
+        busy = sum(self.running.values())
+        if qos_class == 'interactive':
+            return busy < self.slots
+        # Las demás clases no ocupan los slots reservados
+        return busy - self.running['interactive'] < self.slots - self.reserved and busy < self.slots
+
+    def effective_priority(self, waiter, now):
+        priority = priorities[waiter['class']]
+        if self.aging > 0:
+            priority -= (now - waiter['enqueued']) / self.aging
+        return priority
+
+    def next_waiter(self, now):
+        # El de mejor prioridad efectiva entre los que pueden ejecutarse; a igual
+        # prioridad, el que llegó primero
+        candidates = [w for w in self.waiting if self.eligible(w['class'])]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda w: (self.effective_priority(w, now), w['seq']))
+
+    @contextmanager
+    def slot(self, qos_class):
+        # Bloquea hasta obtener un slot; devuelve un dict con la espera en ms.
+        # QueueTimeout si la espera supera timeout
+        if qos_class not in priorities:
+            raise ValueError(f'Clase de prioridad desconocida: {qos_class}')
+        start = time.perf_counter()
+        waiter = {'class': qos_class, 'seq': next(self._seq), 'enqueued': start}
+        with self.cond:
+            self.waiting.append(waiter)
+            try:
+                while self.next_waiter(time.perf_counter()) is not waiter:
+                    remaining = start + self.timeout - time.perf_counter()
+                    if remaining <= 0:
+                        self.timeouts[qos_class] += 1
+                        raise QueueTimeout(qos_class, time.perf_counter() - start)
+                    # Con envejecimiento el orden cambia con el tiempo: se reevalúa aunque
+                    # nadie libere un slot
+                    self.cond.wait(min(remaining, self.aging / 4) if self.aging > 0 else remaining)
+            finally:
+                self.waiting.remove(waiter)
+                # El siguiente de la cola puede ser otro ahora que este ya no compite
+                self.cond.notify_all()
+            waited = time.perf_counter() - start
+            self.running[qos_class] += 1
+            self.served[qos_class] += 1
+            self.waits[qos_class].append(waited)
+        try:
+            yield {'class': qos_class, 'wait_ms': round(waited * 1000, 2)}
+        finally:
+            with self.cond:
+                self.running[qos_class] -= 1
+                self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            waiting = {name: 0 for name in priorities}
+            for w in self.waiting:
+                waiting[w['class']] += 1
+            classes = {}
+            for name in priorities:
+                row = {'running': self.running[name], 'waiting': waiting[name], 'served': self.served[name],
+                       'timeouts': self.timeouts[name], 'limit': self.limits.get(name, self.slots)}
+                if self.waits[name]:
+                    ms = np.array(self.waits[name]) * 1000
+                    p50, p99 = np.percentile(ms, [50, 99])
+                    row.update({'wait_p50_ms': round(float(p50), 2), 'wait_p99_ms': round(float(p99), 2),
+                                'wait_max_ms': round(float(ms.max()), 2), 'wait_samples': len(ms)})
+                classes[name] = row
+        return {'slots': self.slots, 'reserved_interactive': self.reserved, 'aging_s': self.aging,
+                'timeout_s': self.timeout, 'classes': classes}
@@ -0,0 +1,82 @@
+import math
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+try:
+    from .imageprobe import ImageInfo, ImageTooLarge, max_pixels
+except ImportError:
+    from imageprobe import ImageInfo, ImageTooLarge, max_pixels
+
+# Cuadros ya decodificados enviados por clientes de borde como bytes crudos, sin códec.
+# Encabezados (o parámetros de la query con el mismo nombre sin X- y en minúsculas):
+#   X-Frame-Format: rgb | bgr | nv12
+#   X-Frame-Shape:  alto,ancho[,3] (orden de numpy; en nv12 el tamaño de la imagen)
+#   X-Frame-Dtype:  uint8 | float32 (float32 en [0, 1], solo rgb/bgr letterboxeado)
+#   X-Letterbox:    ratio,dw,dh si el cuadro ya viene letterboxeado al tamaño de
+#                   entrada del modelo; las cajas se devuelven en coordenadas originales
+FrameSpec = namedtuple('FrameSpec', ['format', 'height', 'width', 'dtype', 'letterbox'])
+
+frame_formats = ('rgb', 'bgr', 'nv12')
+frame_dtypes = ('uint8', 'float32')
+
+
+def header(headers, args, name):
+    return headers.get(f'X-{name}') or args.get(name.lower().replace('-', '_'))
+
+
+def parse_frame_spec(headers, args):
+    # ValueError si falta un campo o es inválido
+    fmt = (header(headers, args, 'Frame-Format') or '').lower()
+    dtype = (header(headers, args, 'Frame-Dtype') or 'uint8').lower()
+    if fmt not in frame_formats:
+        raise ValueError(f"Formato de cuadro no soportado: {fmt or '(vacío)'}")
+    if dtype not in frame_dtypes or (fmt == 'nv12' and dtype != 'uint8'):
+        raise ValueError(f'Tipo de dato no soportado para {fmt}: {dtype}')
+    shape = [int(v) for v in (header(headers, args, 'Frame-Shape') or '').replace('x', ',').split(',') if v.strip()]
+    if len(shape) == 3 and (shape[2] != 3 or fmt == 'nv12'):
+        raise ValueError('Solo se admiten 3 canales')
+    if len(shape) not in (2, 3) or min(shape[:2]) <= 0:
+        raise ValueError('Forma de cuadro inválida')
+    height, width = shape[:2]
+    if fmt == 'nv12' and (height % 2 or width % 2):
+        raise ValueError('NV12 requiere alto y ancho pares')
+
+    letterbox = parse_letterbox(header(headers, args, 'Letterbox'))
+    if not letterbox and dtype != 'uint8':
+        raise ValueError('float32 solo se admite con X-Letterbox')
+    return FrameSpec(fmt, height, width, dtype, letterbox)
+
+
+def parse_letterbox(value):
+    # "ratio,dw,dh" del letterbox hecho por el cliente -> (ratio, (dw, dh)) o None
+    if not value:
+        return None
+    ratio, dw, dh = (float(v) for v in value.split(','))
+    if not math.isfinite(ratio) or ratio <= 0 or not (math.isfinite(dw) and math.isfinite(dh)):
+        raise ValueError('Ratio de letterbox inválido')
+    return ratio, (dw, dh)
+
+
+def frame_bytes(spec):
+    if spec.format == 'nv12':
+        return spec.height * spec.width * 3 // 2
+    return spec.height * spec.width * 3 * np.dtype(spec.dtype).itemsize
+
+
+def decode_frame(data, spec):
+    # bytes -> arreglo HxWx3 sin copiar (rgb/bgr) o convertido a RGB (nv12).
+    # Devuelve (arreglo, bgr). ValueError si el largo no coincide con la forma
+    info = ImageInfo('RAW', spec.width, spec.height, spec.format.upper(), 1)
+    if spec.width * spec.height > max_pixels:
+        raise ImageTooLarge(info, max_pixels)
+    expected = frame_bytes(spec)
+    if len(data) != expected:
+        raise ValueError(f'Se esperaban {expected} bytes para {spec.format} {spec.height}x{spec.width} '
+                         f'{spec.dtype} y llegaron {len(data)}')
+    if spec.format == 'nv12':
+        yuv = np.frombuffer(data, np.uint8).reshape(spec.height * 3 // 2, spec.width)
+        return cv2.cvtColor(yuv, cv2.COLOR_YUV2RGB_NV12), False
+    frame = np.frombuffer(data, spec.dtype).reshape(spec.height, spec.width, 3)
+    return frame, spec.format == 'bgr'
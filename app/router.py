@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+"""
+Router local con afinidad de caché delante de N procesos de la aplicación.
+
+Cada petición se asigna con hashing consistente a un worker preferido: las de una
+fuente (parámetro source, encabezado X-Source o /sources/<id>) por su id, y las demás
+por el hash del contenido de la imagen. Así una imagen repetida y los cuadros de una
+misma cámara caen siempre en el mismo proceso (estado por fuente, cachés en memoria),
+y al quitar o agregar un worker solo se mueven las claves de ese worker.
+
+Si el preferido está saturado (capacity peticiones en curso) se usa el siguiente del
+anillo y, si todos lo están, el menos cargado. Un hilo revisa /healthz de cada worker:
+tras fail_threshold fallos seguidos el worker sale del anillo y vuelve cuando responde.
+Si no se pudo abrir la conexión con un worker, la petición se reintenta en el siguiente
+(el anterior no llegó a recibirla). Un corte o un timeout después de enviarla cuenta
+como fallo y se responde 502 sin reenviarla: el worker pudo haberla procesado.
+Las respuestas se pasan al cliente por partes, sin guardarlas enteras en memoria.
+
+    python -m app.router --workers 4 --port 8000
+    python -m app.router --backend http://127.0.0.1:8001 --backend http://127.0.0.1:8002
+"""
+import os
+import sys
+import time
+import bisect
+import signal
+import hashlib
+import argparse
+import threading
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from flask import Flask, Response, jsonify, request
+
+try:
+    from .uploads import max_upload_bytes
+except ImportError:
+    from uploads import max_upload_bytes
+
+router_capacity = int(os.getenv('YOLO_ROUTER_CAPACITY', 4))
+health_interval = float(os.getenv('YOLO_ROUTER_HEALTH_INTERVAL', 2.0))
+fail_threshold = int(os.getenv('YOLO_ROUTER_FAIL_THRESHOLD', 2))
+forward_timeout = float(os.getenv('YOLO_ROUTER_TIMEOUT', 120))
+
+# Encabezados propios de cada conexión que no se reenvían (RFC 9110, 7.6.1)
+hop_headers = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailer',
+               'transfer-encoding', 'upgrade', 'host', 'content-length'}
+
+
+def hash_key(key):
+    return int.from_bytes(hashlib.blake2b(key.encode() if isinstance(key, str) else key,
+                                          digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Anillo de hashing consistente con replicas nodos virtuales por worker"""
+
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self.points = []
+        self.owners = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        for i in range(self.replicas):
+            point = hash_key(f'{node}#{i}')
+            k = bisect.bisect(self.points, point)
+            self.points.insert(k, point)
+            self.owners.insert(k, node)
+
+    def remove(self, node):
+        keep = [(p, o) for p, o in zip(self.points, self.owners) if o != node]
+        self.points = [p for p, _ in keep]
+        self.owners = [o for _, o in keep]
+
+    def preference(self, key):
+        # Workers distintos en el orden en que aparecen en el anillo a partir de la clave
+        if not self.points:
+            return []
+        start = bisect.bisect(self.points, hash_key(key))
+        total = len(set(self.owners))
+        order, seen = [], set()
+        for i in range(len(self.points)):
+            owner = self.owners[(start + i) % len(self.points)]
+            if owner not in seen:
+                seen.add(owner)
+                order.append(owner)
+                if len(order) == total:
+                    break
+        return order
+
+
+class Backend:
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url.rstrip('/')
+        self.inflight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.healthy = True
+        self.last_check = None
+
+    def to_json(self):
+        return {'url': self.url, 'healthy': self.healthy, 'inflight': self.inflight, 'requests': self.requests,
+                'failures': self.failures, 'last_check': self.last_check}
+
+
+class NoBackend(Exception):
+    pass
+
+
+class Router:
+    def __init__(self, urls, capacity=None, health_path='/healthz', interval=None, threshold=None,
+                 timeout=None, replicas=64):
+        self.backends = {f'w{i}': Backend(f'w{i}', url) for i, url in enumerate(urls)}
+        self.capacity = capacity or router_capacity
+        self.health_path = health_path
+        self.interval = health_interval if interval is None else interval
+        self.threshold = threshold or fail_threshold
+        self.timeout = timeout or forward_timeout
+        self.ring = HashRing(self.backends, replicas)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.counters = {'affine': 0, 'spill': 0, 'least_loaded': 0, 'unkeyed': 0, 'retries': 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def session(self):
+        # Una sesión por hilo: reutiliza las conexiones keep-alive a cada worker
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def choose(self, key, exclude=()):
+        # Preferido del anillo si tiene capacidad; si no, el siguiente con capacidad;
+        # si todos están saturados, el menos cargado. Reserva el lugar (inflight += 1)
+        with self.lock:
+            healthy = [b for b in self.backends.values() if b.healthy and b.name not in exclude]
+            if not healthy:
+                raise NoBackend('Ningún worker disponible')
+            if key is None:
+                backend = min(healthy, key=lambda b: (b.inflight, b.requests))
+                self.counters['unkeyed'] += 1
+            else:
+                order = [self.backends[name] for name in self.ring.preference(key) if name not in exclude]
+                free = [b for b in order if b.inflight < self.capacity]
+                if free:
+                    backend = free[0]
+                    self.counters['affine' if backend is order[0] else 'spill'] += 1
+                else:
+                    backend = min(healthy, key=lambda b: b.inflight)
+                    self.counters['least_loaded'] += 1
+            backend.inflight += 1
+            backend.requests += 1
+            return backend
+
+    def release(self, backend):
+        with self.lock:
+            backend.inflight -= 1
+
+    def mark(self, backend, ok, immediate=False):
+        # Un worker sale del anillo tras threshold fallos seguidos (o al primero con
+        # immediate) y vuelve al responder
+        with self.lock:
+            if ok:
+                backend.consecutive_failures = 0
+                if not backend.healthy:
+                    print(f'Worker {backend.name} ({backend.url}) disponible de nuevo')
+                    backend.healthy = True
+                    self.ring.add(backend.name)
+                return
+            backend.failures += 1
+            backend.consecutive_failures += 1
+            if backend.healthy and (immediate or backend.consecutive_failures >= self.threshold):
+                print(f'Worker {backend.name} ({backend.url}) fuera del anillo tras '
+                      f'{backend.consecutive_failures} fallos')
+                backend.healthy = False
+                self.ring.remove(backend.name)
+
+    def forward(self, method, path, headers, body, key):
+        # Devuelve (respuesta, backend) con el cuerpo sin leer (stream=True); quien llama
+        # cierra la respuesta y libera el backend con release() al terminar de enviarla.
+        # Solo los fallos al conectar se reintentan en otro worker; un error HTTP del
+        # worker se devuelve tal cual y cualquier otro error de red se propaga
+        tried = set()
+        while True:
+            backend = self.choose(key, tried)
+            try:
+                response = self.session().request(method, backend.url + path, headers=headers, data=body,
+                                                  timeout=self.timeout, allow_redirects=False, stream=True)
+            except requests.RequestException as e:
+                self.release(backend)
+                print(f'Error de conexión con {backend.name}: {str(e).splitlines()[0]}')
+                if not connect_failed(e):
+                    # La petición pudo llegar al worker: reenviarla repetiría un POST
+                    self.mark(backend, False)
+                    raise
+                # Sin conexión el worker no procesó la petición: sale del anillo ya
+                self.mark(backend, False, immediate=True)
+                tried.add(backend.name)
+                with self.lock:
+                    self.counters['retries'] += 1
+                continue
+            return response, backend
+
+    def check(self, backend):
+        try:
+            ok = self.session().get(backend.url + self.health_path, timeout=2).status_code == 200
+        except requests.RequestException:
+            ok = False
+        backend.last_check = time.time()
+        self.mark(backend, ok)
+        return ok
+
+    def check_all(self):
+        for backend in list(self.backends.values()):
+            self.check(backend)
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='router-health', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check_all()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        with self.lock:
+            return {'capacity': self.capacity, 'routing': dict(self.counters),
+                    'backends': {name: b.to_json() for name, b in self.backends.items()}}
+
+
+def connect_failed(error):
+    # True si el error ocurrió al abrir la conexión, antes de enviar la petición
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and \
+        isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+def request_key(req, body):
+    # Clave de afinidad: id de la fuente si la hay; si no, hash del contenido de la imagen
+    if req.path.startswith('/sources/'):
+        return 'source:' + req.path.split('/')[2]
+    if req.path.rstrip('/') == '/sources' and req.method == 'POST':
+        # Alta de una fuente: el id va en el JSON (o el formulario), y debe caer en el
+        # mismo worker que después atiende /sources/<id>
+        data = req.get_json(silent=True) if req.is_json else req.form
+        if isinstance(data, dict) and data.get('id') is not None:
+            return f"source:{data['id']}"
+        return None
+    source = req.args.get('source') or req.headers.get('X-Source')
+    if source is None and req.mimetype == 'multipart/form-data':
+        source = req.form.get('source')
+    if source:
+        return 'source:' + source
+    if req.mimetype == 'multipart/form-data':
+        upload = req.files.get('image')
+        if upload is None:
+            return None
+        digest = hashlib.blake2b(digest_size=16)
+        for chunk in iter(lambda: upload.stream.read(1 << 16), b''):
+            digest.update(chunk)
+        return 'image:' + digest.hexdigest()
+    return ('body:' + hashlib.blake2b(body, digest_size=16).hexdigest()) if body else None
+
+
+def create_app(router):
+    app = Flask(__name__)
+    app.config['MAX_CONTENT_LENGTH'] = max_upload_bytes + 64 * 1024
+
+    @app.route('/router/stats')
+    def router_stats():
+        return jsonify(router.stats())
+
+    @app.route('/', defaults={'path': ''}, methods=['GET', 'POST', 'PUT', 'DELETE', 'PATCH'])
+    @app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE', 'PATCH'])
+    def proxy(path):
+        # El cuerpo se lee una vez; el formulario se parsea desde esa copia para la clave
+        body = request.get_data()
+        key = request_key(request, body) if request.method in ('POST', 'PUT') or path.startswith('sources/') \
+            else None
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in hop_headers}
+        target = request.full_path if request.query_string else request.path
+        try:
+            response, backend = router.forward(request.method, target, headers, body, key)
+        except NoBackend as e:
+            return jsonify({'error': str(e)}), 503
+        except requests.RequestException as e:
+            return jsonify({'error': 'El worker no respondió', 'details': str(e).splitlines()[0]}), 502
+
+        def close():
+            response.close()
+            router.release(backend)
+
+        # El cuerpo se reenvía a medida que llega (iter_content ya quita el gzip del worker);
+        # el worker cuenta como ocupado hasta que la respuesta termina o el cliente se va
+        out = Response(response.iter_content(chunk_size=64 * 1024), status=response.status_code)
+        out.call_on_close(close)
+        for k, v in response.headers.items():
+            if k.lower() not in hop_headers and k.lower() != 'content-encoding':
+                out.headers[k] = v
+        out.headers['X-Routed-To'] = backend.name
+        return out
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Router con afinidad delante de varios procesos de la app')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Procesos worker a levantar')
+    parser.add_argument('--backend', action='append', help='URL de un worker ya levantado (en lugar de --workers)')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--capacity', type=int, default=router_capacity,
+                        help='Peticiones en curso por worker antes de desbordar al siguiente')
+    parser.add_argument('--command', help='Comando de cada worker, con {port} (por defecto, flask run)')
+    args = parser.parse_args(argv)
+
+    try:
+        from .loadtest import ServerProcess, default_command
+    except ImportError:
+        from loadtest import ServerProcess, default_command
+
+    # SIGTERM también detiene los workers levantados por el router
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    servers = []
+    try:
+        if args.backend:
+            urls = args.backend
+        else:
+            # Un hilo ORT por worker: el paralelismo lo dan los procesos
+            env = {'YOLO_ORT_THREADS': os.getenv('YOLO_ORT_THREADS', '1')}
+            servers = [ServerProcess(f'w{i}', env, args.command or default_command).start()
+                       for i in range(args.workers)]
+            urls = [server.url for server in servers]
+        router = Router(urls, capacity=args.capacity).start()
+        print(f'Router en http://127.0.0.1:{args.port} -> {", ".join(urls)}')
+        create_app(router).run(host='127.0.0.1', port=args.port, threaded=True)
+    finally:
+        for server in servers:
+            server.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Memoria del modelo compartida entre workers pre-forkeados.
+
+Con gunicorn --preload (ver gunicorn.conf.py) la sesión ONNX se construye una sola vez
+en el proceso maestro al importar app/yolomodel.py; los workers la heredan con fork y
+los pesos (y los buffers preempaquetados por ORT) quedan en páginas compartidas
+copy-on-write, porque la inferencia solo los lee. Cada worker paga solo su arena de
+activaciones.
+
+Este módulo mide la memoria única (USS) por worker en los dos modos:
+
+    python -m app.sharedmodel --workers 4
+    python -m app.sharedmodel --workers 4 --model /ruta/modelo.onnx --runs 5
+
+  private: cada worker construye su propia InferenceSession después del fork
+  preload: la sesión se construye antes del fork y los workers la heredan
+"""
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+import psutil
+
+
+def worker_memory(pid=None):
+    # USS: memoria que se liberaría al terminar el proceso (lo que no comparte con nadie).
+    # PSS reparte las páginas compartidas entre los procesos que las usan
+    info = psutil.Process(pid).memory_full_info()
+    return {'uss_mb': round(info.uss / 1e6, 1), 'pss_mb': round(getattr(info, 'pss', 0) / 1e6, 1),
+            'rss_mb': round(info.rss / 1e6, 1)}
+
+
+def measure(mode, workers, model_factory, runs=3, size=640):
+    # Lanza workers con fork, ejecuta runs inferencias en cada uno y devuelve su memoria
+    # medida mientras todos siguen vivos
+    shared = model_factory() if mode == 'preload' else None
+    if shared is not None:
+        shared.run(np.zeros((1, 3, size, size), np.float32))
+    children = []
+    for _ in range(workers):
+        ready_r, ready_w = os.pipe()
+        done_r, done_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                os.close(ready_r)
+                os.close(done_w)
+                yolo = shared or model_factory()
+                blob = np.random.rand(1, 3, size, size).astype(np.float32)
+                for _ in range(runs):
+                    yolo.run(blob)
+                os.write(ready_w, b'1')
+                os.read(done_r, 1)
+            except BaseException as e:
+                print(f'Error en el worker: {str(e)}', file=sys.stderr)
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(ready_w)
+        os.close(done_r)
+        children.append((pid, ready_r, done_w))
+
+    report = []
+    for pid, ready_r, _ in children:
+        os.read(ready_r, 1)
+    for pid, _, _ in children:
+        report.append(dict(worker_memory(pid), pid=pid))
+    for pid, ready_r, done_w in children:
+        os.write(done_w, b'1')
+        os.waitpid(pid, 0)
+        os.close(ready_r)
+        os.close(done_w)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='USS por worker con y sin modelo precargado')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--runs', type=int, default=3, help='Inferencias por worker antes de medir')
+    parser.add_argument('--threads', type=int, default=1, help='Hilos ORT por sesión')
+    parser.add_argument('--model', help='Ruta al modelo ONNX (por defecto, el de app/yolomodel.py)')
+    parser.add_argument('--json', action='store_true', help='Salida en JSON')
+    args = parser.parse_args(argv)
+
+    try:
+        from .yolocounterv1 import YoloOnnx
+    except ImportError:
+        from yolocounterv1 import YoloOnnx
+    if args.model:
+        model_path, class_names = args.model, []
+    else:
+        try:
+            from .yolomodel import yolopath as model_path, class_names
+        except ImportError:
+            from yolomodel import yolopath as model_path, class_names
+
+    def factory():
+        return YoloOnnx(weigths_path=model_path, class_names=class_names,
+                        intra_op_threads=args.threads, inter_op_threads=1)
+
+    results = {mode: measure(mode, args.workers, factory, args.runs) for mode in ('private', 'preload')}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'Modelo: {model_path} ({os.path.getsize(model_path) / 1e6:.1f} MB), {args.workers} workers')
+    for mode, rows in results.items():
+        total = sum(r['uss_mb'] for r in rows)
+        print(f'{mode:8s} USS por worker: ' + ', '.join(f"{r['uss_mb']:.1f}" for r in rows)
+              + f' MB  (total {total:.1f} MB)')
+    before = sum(r['uss_mb'] for r in results['private'])
+    after = sum(r['uss_mb'] for r in results['preload'])
+    print(f'Ahorro: {before - after:.1f} MB ({(1 - after / before) if before else 0:.0%})')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,89 @@
-document.getElementById('upload-form').addEventListener('submit', function(event) {
+// Antes de subir, el navegador reduce la imagen al tamaño de entrada del modelo (y
+// opcionalmente la letterboxea) y envía un WebP/JPEG compacto junto con la escala, así
+// el servidor devuelve las cajas en coordenadas de la imagen original. Si el navegador
+// no puede decodificar el archivo, se sube el original como antes
+const form = document.getElementById('upload-form');
+const inputSize = parseInt(form.dataset.inputSize, 10) || 640;
+const quality = 0.9;
+
+function encodeCanvas(canvas) {
+    // WebP si el navegador lo codifica (Safari devuelve PNG), si no JPEG
+    return new Promise(resolve => canvas.toBlob(blob => {
+        if (blob && blob.type === 'image/webp') {
+            resolve(blob);
+        } else {
+            canvas.toBlob(resolve, 'image/jpeg', quality);
+        }
+    }, 'image/webp', quality));
+}
+
+async function prepareUpload(file, letterbox) {
+    const original = {blob: file, name: file.name, fields: {}};
+    let bitmap;
+    try {
+        // from-image aplica la orientación EXIF; el servidor decodifica igual
+        // (imageprobe.upright), así client_scale y las cajas usan los mismos ejes
+        bitmap = await createImageBitmap(file, {imageOrientation: 'from-image'});
+    } catch (error) {
+        return original;
+    }
+    const width = bitmap.width, height = bitmap.height;
+    const r = Math.min(inputSize / width, inputSize / height);
+    if (r >= 1 && !letterbox) {
+        bitmap.close();
+        return original;
+    }
+
+    const canvas = document.createElement('canvas');
+    let fields;
+    if (letterbox) {
+        // Misma geometría que YoloOnnx.preprocess: relleno gris 114 centrado
+        const newWidth = Math.round(width * r), newHeight = Math.round(height * r);
+        const dw = (inputSize - newWidth) / 2, dh = (inputSize - newHeight) / 2;
+        canvas.width = canvas.height = inputSize;
+        const ctx = canvas.getContext('2d');
+        ctx.fillStyle = 'rgb(114, 114, 114)';
+        ctx.fillRect(0, 0, inputSize, inputSize);
+        ctx.imageSmoothingQuality = 'high';
+        ctx.drawImage(bitmap, Math.round(dw - 0.1), Math.round(dh - 0.1), newWidth, newHeight);
+        fields = {letterbox: `${r},${dw},${dh}`};
+    } else {
+        canvas.width = Math.round(width * r);
+        canvas.height = Math.round(height * r);
+        const ctx = canvas.getContext('2d');
+        ctx.imageSmoothingQuality = 'high';
+        ctx.drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+        fields = {client_scale: String(canvas.width / width)};
+    }
+    bitmap.close();
+
+    const blob = await encodeCanvas(canvas);
+    if (!blob || blob.size >= file.size) {
+        return original;
+    }
+    const extension = blob.type === 'image/webp' ? 'webp' : 'jpg';
+    return {blob: blob, name: file.name.replace(/\.[^.]*$/, '') + '.' + extension, fields: fields};
+}
+
+form.addEventListener('submit', async function(event) {
     event.preventDefault();
-    const formData = new FormData(this);
+    const file = form.elements.image.files[0];
+    const upload = await prepareUpload(file, form.elements.letterbox.checked);
+    const formData = new FormData();
+    formData.append('image', upload.blob, upload.name);
+    for (const [name, value] of Object.entries(upload.fields)) {
+        formData.append(name, value);
+    }
+    const sizes = `Uploaded ${Math.ceil(upload.blob.size / 1024)} KB (original ${Math.ceil(file.size / 1024)} KB)`;
 
     fetch('/detect-count', {
         method: 'POST',
+        // Sin API key el servidor ignora X-Priority-Class: la página usa YOLO_QOS_DEFAULT
         body: formData
     })
     .then(response => response.json())
     .then(data => {
-        document.getElementById('result').innerHTML = `<h2>Detected Objects:</h2><pre>${JSON.stringify(data, null, 2)}</pre>`;
+        document.getElementById('result').innerHTML = `<h2>Detected Objects:</h2><p class="upload-info">${sizes}</p><pre>${JSON.stringify(data, null, 2)}</pre>`;
     })
     .catch(error => {
         console.error('Error:', error);
@@ -0,0 +1,61 @@
+import io
+import os
+import mmap
+import tempfile
+from contextlib import contextmanager
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# Límite por archivo (igual al client_max_body_size de nginx) y tamaño a partir del
+# cual la subida deja la memoria y pasa a un archivo temporal en disco
+max_upload_bytes = int(os.getenv('YOLO_MAX_UPLOAD_BYTES', 25 * 1024 * 1024))
+spool_max_memory = int(os.getenv('YOLO_UPLOAD_SPOOL_BYTES', 256 * 1024))
+spool_dir = os.getenv('YOLO_UPLOAD_SPOOL_DIR') or None
+
+
+class CappedSpooledFile(tempfile.SpooledTemporaryFile):
+    # Archivo temporal que aborta la subida en cuanto se supera el límite,
+    # aunque el cliente no envíe Content-Length (transferencia por chunks)
+    def __init__(self, max_bytes, max_size, dir=None):
+        super().__init__(max_size=max_size, mode='w+b', dir=dir)
+        self.max_bytes = max_bytes
+        self.written = 0
+
+    def write(self, s):
+        self.written += len(s)
+        if self.written > self.max_bytes:
+            raise RequestEntityTooLarge()
+        return super().write(s)
+
+
+class SpooledRequest(Request):
+    # El parser de multipart escribe cada archivo por bloques en este destino,
+    # así la memoria por petición queda acotada a spool_max_memory
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return CappedSpooledFile(max_upload_bytes, spool_max_memory, dir=spool_dir)
+
+
+@contextmanager
+def open_upload(file):
+    # Entrega un objeto legible por PIL sin copiar la subida: si ya está en disco se
+    # mapea en memoria (las páginas las comparte el caché del sistema); si sigue en
+    # memoria se usa el buffer tal cual
+    stream = file.stream
+    inner = getattr(stream, '_file', stream)
+    mapped = None
+    if getattr(stream, '_rolled', True):
+        try:
+            fd = inner.fileno()
+            if os.fstat(fd).st_size > 0:
+                mapped = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError, io.UnsupportedOperation, AttributeError):
+            mapped = None
+    if mapped is None:
+        stream.seek(0)
+        yield stream
+        return
+    try:
+        yield mapped
+    finally:
+        mapped.close()
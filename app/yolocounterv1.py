@@ -2,47 +2,387 @@ import cv2
 import time
 import requests
 import random
+import threading
 import numpy as np
 import onnxruntime as ort
 from PIL import Image
 from pathlib import Path
 from collections import OrderedDict,namedtuple
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from .boxes import nms, unletterbox, tile_windows, clip_rois, count_classes, \
+        mosaic_cells, mosaic_grid, assign_regions
+    from .render import annotate
+    from .pipeline import Pipeline, Stage
+except ImportError:
+    from boxes import nms, unletterbox, tile_windows, clip_rois, count_classes, \
+        mosaic_cells, mosaic_grid, assign_regions
+    from render import annotate
+    from pipeline import Pipeline, Stage
+
+# Lienzo uint8 de entrada reutilizado por hilo; el relleno solo se repinta si cambia la geometría
+_canvas = threading.local()
 
 class YoloOnnx:
-    def __init__(self, weigths_path, class_names, cuda = False):
+    # Lado de la entrada y lote de inferencia por defecto (ver app/autotune.py)
+    input_shape = (640, 640)
+    batch_size = 4
+
+    def __init__(self, weigths_path, class_names, cuda = False, intra_op_threads=None, inter_op_threads=None,
+                 input_size=None, batch_size=None):
         providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if cuda else ['CPUExecutionProvider']
-        self.session = ort.InferenceSession(weigths_path, providers=providers)
+        options = ort.SessionOptions()
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+        self.session = ort.InferenceSession(weigths_path, sess_options=options, providers=providers)
         self.class_names = class_names
         self.colors = {name:[random.randint(0, 255) for _ in range(3)] for i,name in enumerate(class_names)}
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_names = [o.name for o in self.session.get_outputs()]
+        # Un export con eje de batch dinámico acepta varias imágenes por session.run
+        shape = self.session.get_inputs()[0].shape
+        self.dynamic_batch = not isinstance(shape[0], int)
+        # Un export con alto/ancho fijos solo admite su propia resolución
+        if input_size:
+            self.input_shape = (int(input_size), int(input_size))
+        elif isinstance(shape[2], int) and isinstance(shape[3], int):
+            self.input_shape = (shape[2], shape[3])
+        if batch_size:
+            self.batch_size = int(batch_size)
+
+    # ratio/dwdh del último letterbox, guardados por hilo: con la instancia compartida
+    # entre los hilos de un worker cada petición convierte sus cajas (convertbox,
+    # to_detections, visualize_detections) con los de su propia inferencia
+    @property
+    def transform(self):
+        return self.__dict__.setdefault('_transform', threading.local())
+
+    @property
+    def ratio(self):
+        return getattr(self.transform, 'ratio', 1.0)
+
+    @ratio.setter
+    def ratio(self, value):
+        self.transform.ratio = value
+
+    @property
+    def dwdh(self):
+        return getattr(self.transform, 'dwdh', (0.0, 0.0))
 
-    def inference(self, img_path):        
-        img = Image.open(img_path)
+    @dwdh.setter
+    def dwdh(self, value):
+        self.transform.dwdh = value
+
+    def load_image(self, img_path):
+        # Acepta ruta, stream, imagen PIL o arreglo RGB ya decodificado
+        if isinstance(img_path, np.ndarray):
+            return img_path
+        img = img_path if isinstance(img_path, Image.Image) else Image.open(img_path)
         if img.mode != 'RGB': 
             img = img.convert('RGB')
-        img = np.asarray(img)
-        image = img.copy()
-        image, self.ratio, self.dwdh = self.letterbox(image, auto=False)
-        image = image.transpose((2, 0, 1))
-        image = np.expand_dims(image, 0)
-        image = np.ascontiguousarray(image)
-        im = image.astype(np.float32)
-        im /= 255
-        outname = [i.name for i in self.session.get_outputs()]
-        inname = [i.name for i in self.session.get_inputs()]
-        inp = {inname[0]:im}
-        outputs = self.session.run(outname, inp)[0]
+        return np.asarray(img)
+
+    def preprocess(self, img, new_shape=None, color=(114, 114, 114), bgr=False):
+        # Letterbox + normalización + HWC->CHW fusionados: el resize escribe directo en la
+        # ROI de un lienzo ya relleno y cada plano se convierte a float32/255 en una sola
+        # pasada sobre la salida final. Mismo resultado exacto que letterbox(auto=False)
+        # seguido de transpose/astype/255, sin copyMakeBorder ni copias intermedias
+        new_shape = new_shape or self.input_shape
+        shape = img.shape[:2]
+        r = min(new_shape[0] / shape[0], new_shape[1] / shape[1])
+        new_unpad = int(round(shape[1] * r)), int(round(shape[0] * r))
+        dw, dh = (new_shape[1] - new_unpad[0]) / 2, (new_shape[0] - new_unpad[1]) / 2
+        top, left = int(round(dh - 0.1)), int(round(dw - 0.1))
+
+        key = (new_shape, new_unpad, top, left, color)
+        if getattr(_canvas, 'key', None) != key:
+            _canvas.image = np.empty((new_shape[0], new_shape[1], 3), np.uint8)
+            _canvas.image[:] = color
+            _canvas.key = key
+        canvas = _canvas.image
+        roi = canvas[top:top + new_unpad[1], left:left + new_unpad[0]]
+        if shape[::-1] != new_unpad:
+            resized = cv2.resize(img, new_unpad, dst=roi, interpolation=cv2.INTER_LINEAR)
+            if resized is not roi:  # OpenCV que no escribe sobre la vista
+                roi[:] = resized
+        else:
+            roi[:] = img
+
+        return self.to_blob(canvas, bgr), r, (dw, dh)
+
+    def to_blob(self, img, bgr=False):
+        # HxWx3 ya letterboxeado -> 1x3xHxW float32 en [0, 1], un plano por pasada.
+        # Una entrada BGR solo invierte el orden de los planos (sin cvtColor)
+        im = np.empty((1, 3) + img.shape[:2], np.float32)
+        planes = cv2.split(img)
+        for i, plane in enumerate(planes[::-1] if bgr else planes):
+            if img.dtype == np.uint8:
+                np.divide(plane, np.float32(255), out=im[0, i], dtype=np.float32)
+            else:
+                im[0, i] = plane
+        return im
+
+    def run(self, im):
+        return self.session.run(self.output_names, {self.input_name: im})[0]
+
+    def run_batch(self, blobs):
+        # Ejecuta varias entradas de 1x3xHxW; si el modelo no admite batch se ejecutan
+        # una a una y se reasigna el batch_id para conservar el formato de salida
+        if self.dynamic_batch and len(blobs) > 1:
+            return self.run(np.concatenate(blobs))
+        outputs = []
+        for i, blob in enumerate(blobs):
+            out = np.array(self.run(blob), dtype=np.float32).reshape(-1, 7)
+            out[:, 0] = i
+            outputs.append(out)
+        return np.concatenate(outputs) if outputs else np.zeros((0, 7), np.float32)
+
+    def inference(self, img_path, scale=1.0, bgr=False):        
+        # scale: tamaño decodificado / tamaño original (decodificación reducida);
+        # se incorpora al ratio para que convertbox devuelva coordenadas originales
+        img = self.load_image(img_path)
+        im, ratio, self.dwdh = self.preprocess(img, bgr=bgr)
+        self.ratio = ratio * scale
+        outputs = self.run(im)
+        c_classes = self.counting(outputs)
+        return img, outputs, c_classes
+
+    def inference_letterboxed(self, img, ratio, dwdh, bgr=False):
+        # Cuadro que el cliente ya letterboxeó al tamaño de entrada: solo se normaliza.
+        # ratio/dwdh son los del letterbox del cliente, para volver a coordenadas originales
+        if tuple(img.shape[:2]) != tuple(self.input_shape):
+            raise ValueError(f'El cuadro letterboxeado debe medir {self.input_shape[0]}x{self.input_shape[1]}')
+        self.ratio, self.dwdh = ratio, tuple(dwdh)
+        outputs = self.run(self.to_blob(img, bgr))
+        c_classes = self.counting(outputs)
+        return img, outputs, c_classes
+
+    def inference_tiled(self, img_path, tile=640, overlap=0.2, batch_size=4, workers=2,
+                        iou_thres=0.5, merge='nms', include_full=True):
+        # Inferencia por mosaicos solapados a resolución nativa para objetos pequeños.
+        # Los mosaicos se procesan en lotes de batch_size (en paralelo con workers hilos),
+        # así la memoria extra queda acotada a workers * batch_size entradas de 640x640.
+        # La imagen decodificada sí debe caber entera en memoria (PIL no decodifica JPEG
+        # ni PNG por regiones): el tope es el presupuesto YOLO_MAX_PIXELS de imageprobe.py.
+        # Con una imagen PIL no se hace ninguna copia de tamaño completo: cada mosaico se
+        # recorta y convierte a RGB por separado y la pasada completa parte de una reducción
+        img = img_path if isinstance(img_path, (np.ndarray, Image.Image)) else Image.open(img_path)
+        w, h = img.size if isinstance(img, Image.Image) else img.shape[1::-1]
+        windows = tile_windows(w, h, tile, overlap)
+        chunks = [windows[i:i + batch_size] for i in range(0, len(windows), batch_size)]
+
+        def process(chunk):
+            blobs, metas = [], []
+            for (x0, y0, x1, y1) in chunk:
+                im, ratio, dwdh = self.preprocess(self.read_region(img, (x0, y0, x1, y1)))
+                blobs.append(im)
+                metas.append((ratio, dwdh, (x0, y0)))
+            outputs = np.array(self.run_batch(blobs), dtype=np.float32).reshape(-1, 7)
+            dets = [unletterbox(outputs[outputs[:, 0] == i], *meta) for i, meta in enumerate(metas)]
+            return np.concatenate(dets) if dets else np.zeros((0, 7), np.float32)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(process, chunks))
+
+        # Una pasada sobre la imagen completa recupera objetos grandes partidos entre mosaicos
+        if include_full and len(windows) > 1:
+            full, scale = img, 1.0
+            if isinstance(img, Image.Image):
+                r = min(self.input_shape[0] / h, self.input_shape[1] / w)
+                size = max(int(round(w * r)), 1), max(int(round(h * r)), 1)
+                full = self.load_image(img.resize(size, Image.BILINEAR, reducing_gap=2.0))
+                scale = size[0] / w
+            im, ratio, dwdh = self.preprocess(full)
+            results.append(unletterbox(self.run(im), ratio * scale, dwdh))
+
+        outputs = nms(np.concatenate(results), iou_thres=iou_thres, merge=merge)
+        outputs[:, 0] = 0
+        # Las cajas ya están en coordenadas globales: convertbox queda como identidad
+        self.ratio, self.dwdh = 1.0, (0.0, 0.0)
         c_classes = self.counting(outputs)
         return img, outputs, c_classes
+
+    def read_region(self, img, box):
+        # Ventana (x0, y0, x1, y1) como arreglo RGB: vista del arreglo o recorte de la imagen PIL
+        x0, y0, x1, y1 = box
+        if isinstance(img, np.ndarray):
+            return img[y0:y1, x0:x1]
+        return self.load_image(img.crop(box))
     
+    def crops(self, img, rois=None, scale=1.0):
+        # Entradas letterboxeadas de cada ROI (en coordenadas originales) o de la imagen
+        # completa, con (ratio, dwdh, offset) para volver a coordenadas originales
+        h, w = img.shape[:2]
+        windows = clip_rois(rois, w, h, scale) if rois else [(0, 0, w, h)]
+        blobs, metas = [], []
+        for (x0, y0, x1, y1) in windows:
+            im, ratio, dwdh = self.preprocess(img[y0:y1, x0:x1])
+            blobs.append(im)
+            metas.append((ratio * scale, dwdh, (x0 / scale, y0 / scale)))
+        return blobs, metas
+
+    def merge_crops(self, outputs, metas, iou_thres=0.5):
+        # Salidas de un lote de recortes -> detecciones globales; los solapamientos
+        # entre ROIs se resuelven con NMS
+        outputs = np.array(outputs, dtype=np.float32).reshape(-1, 7)
+        dets = np.concatenate([unletterbox(outputs[outputs[:, 0] == i], *meta) for i, meta in enumerate(metas)])
+        if len(metas) > 1:
+            dets = nms(dets, iou_thres=iou_thres)
+        dets[:, 0] = 0
+        return dets
+
+    def inference_rois(self, img_path, rois, scale=1.0, iou_thres=0.5):
+        # Solo las regiones de interés se letterboxean e infieren, todas en un mismo
+        # run_batch (un solo session.run si el export tiene batch dinámico; si no, una
+        # por ROI): más resolución efectiva en la región y menos píxeles desperdiciados.
+        # rois: (x0, y0, x1, y1) en coordenadas originales; scale como en inference()
+        img = self.load_image(img_path)
+        blobs, metas = self.crops(img, rois, scale)
+        outputs = self.merge_crops(self.run_batch(blobs), metas, iou_thres)
+        # Las cajas ya están en coordenadas originales: convertbox queda como identidad
+        self.ratio, self.dwdh = 1.0, (0.0, 0.0)
+        c_classes = self.counting(outputs)
+        return img, outputs, c_classes
+
+    def pack(self, imgs, grid, gutter=16, color=(114, 114, 114)):
+        # Varias imágenes chicas en un solo lienzo de entrada (grilla grid x grid separada
+        # por gutter píxeles de relleno), cada una redimensionada y centrada en su celda.
+        # Devuelve el blob y, por imagen, (ratio, offset en el lienzo, región ocupada)
+        height, width = self.input_shape
+        canvas = np.empty((height, width, 3), np.uint8)
+        canvas[:] = color
+        metas = []
+        for img, (x0, y0, x1, y1) in zip(imgs, mosaic_cells(grid, (width, height), gutter)):
+            h, w = img.shape[:2]
+            r = min((x1 - x0) / w, (y1 - y0) / h)
+            nw, nh = min(int(round(w * r)), x1 - x0), min(int(round(h * r)), y1 - y0)
+            left, top = x0 + (x1 - x0 - nw) // 2, y0 + (y1 - y0 - nh) // 2
+            roi = canvas[top:top + nh, left:left + nw]
+            if (w, h) != (nw, nh):
+                resized = cv2.resize(img, (nw, nh), dst=roi, interpolation=cv2.INTER_LINEAR)
+                if resized is not roi:
+                    roi[:] = resized
+            else:
+                roi[:] = img
+            metas.append((r, (left, top), (left, top, left + nw, top + nh)))
+        return self.to_blob(canvas), metas
+
+    def split_mosaic(self, outputs, metas, scales=None):
+        # Detecciones de un lienzo empaquetado -> detecciones por imagen en coordenadas
+        # originales. Cada caja va a la imagen que contiene su centro y se recorta a esa
+        # región (las que caen en el relleno se descartan)
+        outputs = np.array(outputs, dtype=np.float32).reshape(-1, 7)
+        scales = scales or [1.0] * len(metas)
+        owner = assign_regions(outputs, [region for _, _, region in metas])
+        results = []
+        for i, ((r, offset, region), scale) in enumerate(zip(metas, scales)):
+            dets = outputs[owner == i].copy()
+            dets[:, [1, 3]] = np.clip(dets[:, [1, 3]], region[0], region[2])
+            dets[:, [2, 4]] = np.clip(dets[:, [2, 4]], region[1], region[3])
+            dets = unletterbox(dets, r * scale, offset)
+            dets[:, 0] = 0
+            results.append(dets)
+        return results
+
+    def make_pipeline(self, loader=None, decode_workers=2, preprocess_workers=1, batch_size=None,
+                      maxsize=8, keep_images=False, tiled_kwargs=None, mosaic=None, mosaic_gutter=16):
+        # Etapas decode -> preprocess -> infer (por lotes) -> post, solapadas con colas
+        # acotadas. loader(fuente) devuelve un dict con 'img' (RGB) y opcionalmente
+        # 'scale' (decodificación reducida), 'tiled' y 'rois'; las demás claves se conservan.
+        # Todos los recortes de un lote de elementos van en el mismo run_batch.
+        # Cada resultado trae 'outputs' en coordenadas originales, 'countings' y 'detections'.
+        # El ratio/dwdh viaja con cada elemento, no en la instancia.
+        # mosaic=2 o 3: las imágenes sin ROIs que caben en una celda de esa grilla se
+        # empaquetan de a mosaic*mosaic en un mismo lienzo (un solo blob) en vez de
+        # letterboxear cada miniatura a la entrada completa
+        loader = loader or (lambda source: {'img': source})
+        batch_size = batch_size or self.batch_size
+        tiled_kwargs = tiled_kwargs or {}
+        mosaic = int(mosaic or 0)
+        if mosaic > 1:
+            x0, y0, x1, y1 = mosaic_cells(mosaic, self.input_shape[::-1], mosaic_gutter)[0]
+            cell = min(x1 - x0, y1 - y0)
+            batch_size = max(batch_size, mosaic * mosaic)
+
+        def preprocess(item):
+            if item.get('tiled'):
+                # inference_tiled lee los mosaicos de la imagen PIL sin copiarla entera
+                return item
+            item['img'] = self.load_image(item['img'])
+            # Solo las que caben en una celda sin reducirse: no se pierde resolución
+            if mosaic > 1 and not item.get('rois') and max(item['img'].shape[:2]) <= cell:
+                item['mosaic'] = True
+            else:
+                item['blobs'], item['metas'] = self.crops(item['img'], item.get('rois'), item.get('scale', 1.0))
+            return item
+
+        def infer(items):
+            # Cada bloque es (blobs, función que reparte sus filas de salida)
+            blocks = []
+            for item in items:
+                if not item.get('tiled') and not item.get('mosaic'):
+                    blocks.append((item.pop('blobs'), partial(set_crops, item, item.pop('metas'))))
+            packed = [item for item in items if item.get('mosaic')]
+            for i in range(0, len(packed), mosaic * mosaic or 1):
+                group = packed[i:i + mosaic * mosaic]
+                if len(group) == 1:  # sola, a resolución completa
+                    item = group[0]
+                    item.pop('mosaic')
+                    blobs, metas = self.crops(item['img'], scale=item.get('scale', 1.0))
+                    blocks.append((blobs, partial(set_crops, item, metas)))
+                    continue
+                blob, metas = self.pack([item['img'] for item in group], mosaic_grid(len(group), mosaic),
+                                        mosaic_gutter)
+                blocks.append(([blob], partial(set_mosaic, group, metas)))
+            if blocks:
+                outputs = np.array(self.run_batch([blob for blobs, _ in blocks for blob in blobs]),
+                                   dtype=np.float32).reshape(-1, 7)
+                first = 0
+                for blobs, assign in blocks:
+                    rows = outputs[(outputs[:, 0] >= first) & (outputs[:, 0] < first + len(blobs))].copy()
+                    rows[:, 0] -= first
+                    assign(rows)
+                    first += len(blobs)
+            for item in items:
+                if item.get('tiled'):
+                    _, item['outputs'], _ = self.inference_tiled(item['img'], **tiled_kwargs)
+            return items
+
+        def set_crops(item, metas, rows):
+            item['outputs'] = self.merge_crops(rows, metas)
+
+        def set_mosaic(group, metas, rows):
+            dets = self.split_mosaic(rows, metas, [item.get('scale', 1.0) for item in group])
+            for item, outputs in zip(group, dets):
+                item.pop('mosaic')
+                item['outputs'] = outputs
+
+        def post(item):
+            item['countings'] = self.counting(item['outputs'])
+            item['detections'] = self.format_detections(item['outputs'])
+            if not keep_images:
+                item.pop('img', None)
+            elif 'img' in item:
+                item['img'] = self.load_image(item['img'])
+            return item
+
+        return Pipeline([
+            Stage('decode', loader, workers=decode_workers),
+            Stage('preprocess', preprocess, workers=preprocess_workers),
+            Stage('infer', infer, batch_size=batch_size, batched=True),
+            Stage('post', post),
+        ], maxsize=maxsize)
+
+    def inference_many(self, sources, **kwargs):
+        # Atajo: resultados en orden (o pipeline.Failed por elemento con error)
+        return self.make_pipeline(**kwargs).map(sources)
+
     def counting(self, outputs):
-        countings = {self.class_names[int(cls_id)]:0 for _, _, _, _, _, cls_id,_ in outputs}  #(batch_id,x0,y0,x1,y1,cls_id,score)
-        for _, _, _, _, _, cls_id,_ in outputs:
-            countings[self.class_names[int(cls_id)]] += 1  
-            
-        countings_list = list(countings.items())
-        countings_list.sort(key = lambda x: x[1], reverse=True)
-        countings = {c:n for (c,n) in countings_list}
-        return countings
+        # {clase: n} de mayor a menor, contado sobre el arreglo (ver boxes.count_classes)
+        return count_classes(outputs, self.class_names)
         
     def letterbox(self, im, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleup=True, stride=32):
         # Resize and pad image while meeting stride-multiple constraints
@@ -72,20 +412,24 @@ class YoloOnnx:
         im = cv2.copyMakeBorder(im, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)  # add border
         return im, r, (dw, dh)
     
-    def visualize_detections(self, img, outputs): 
-        ori_images = [img.copy()]
-        for i,(batch_id,x0,y0,x1,y1,cls_id,score) in enumerate(outputs):
-            image = ori_images[int(batch_id)]
-            box = self.convertbox([x0,y0,x1,y1])
-            cls_id = int(cls_id)
-            score = round(float(score),3)
-            name = self.class_names[cls_id]
-            color = self.colors[name]
-            name += ' '+str(score)
-            cv2.rectangle(image,box[:2],box[2:],color,2)
-            cv2.putText(image,name,(box[0], box[1] - 2),cv2.FONT_HERSHEY_SIMPLEX,0.75,[225, 255, 255],thickness=2)  
-        return ori_images[0]
+    def visualize_detections(self, img, outputs, max_dim=None): 
+        # Conversión de cajas vectorizada y etiquetas cacheadas (ver render.py)
+        return annotate(img, outputs, self.ratio, self.dwdh, self.class_names, self.colors, max_dim=max_dim)
     
+    def to_detections(self, outputs):
+        # Mismo formato que /detect-count: (caja, cls_id, score, nombre)
+        return [
+            (self.convertbox([x0, y0, x1, y1]), int(cls_id), str(prob), self.class_names[int(cls_id)])
+            for (batch_id, x0, y0, x1, y1, cls_id, prob) in outputs
+        ]
+
+    def format_detections(self, outputs):
+        # Como to_detections pero para salidas que ya están en coordenadas originales
+        outputs = np.asarray(outputs, dtype=np.float32).reshape(-1, 7)
+        boxes = outputs[:, 1:5].round().astype(np.int32).tolist()
+        return [(box, int(cls_id), str(prob), self.class_names[int(cls_id)])
+                for box, cls_id, prob in zip(boxes, outputs[:, 5], outputs[:, 6])]
+
     def convertbox(self, box0):
         box = np.array(box0)
         box -= np.array(self.dwdh*2)
@@ -3,8 +3,10 @@ import urllib.request
 from dotenv import load_dotenv
 try:
     from .yolocounterv1 import YoloOnnx
+    from .autotune import load_profile
 except:
     from yolocounterv1 import YoloOnnx
+    from autotune import load_profile
 
 # Cargar variables de entorno
 load_dotenv()
@@ -35,5 +37,24 @@ except:
     urllib.request.urlretrieve(cloud_dir + filename, yolopath)
     print('Descargado desde S3:', filename)
 
+# Configuración elegida por python -m app.autotune para este host (yolo_profile.json o
+# YOLO_PROFILE); las variables de entorno tienen prioridad sobre el perfil
+tuning = load_profile()
+
+# Hilos ORT por sesión (por defecto, los del perfil o los que elija ORT). Con workers
+# pre-forkeados gunicorn.conf.py fija los del perfil o 1: un worker por núcleo y ningún
+# pool de hilos antes del fork
+ort_threads = int(os.getenv('YOLO_ORT_THREADS', 0)) or tuning.get('intra_op_threads')
+# Lado de la entrada y lote de inferencia de los pipelines (trabajos, fuentes en vivo)
+input_size = int(os.getenv('YOLO_INPUT_SIZE', 0)) or tuning.get('input_size')
+infer_batch = int(os.getenv('YOLO_INFER_BATCH', 0)) or tuning.get('batch_size')
+
+def create_model(**kwargs):
+    # Instancias adicionales (p. ej. un modelo por worker) con la misma configuración
+    kwargs.setdefault('intra_op_threads', ort_threads)
+    kwargs.setdefault('input_size', input_size)
+    kwargs.setdefault('batch_size', infer_batch)
+    return YoloOnnx(weigths_path=yolopath, class_names=class_names, cuda=False, **kwargs)
+
 # Instancia del modelo
-yolo = YoloOnnx(weigths_path=yolopath, class_names=class_names, cuda=False)
+yolo = create_model()
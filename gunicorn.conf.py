@@ -0,0 +1,58 @@
+# Configuración de gunicorn (se lee automáticamente desde el directorio de la app).
+# preload_app: app/yolomodel.py se importa una vez en el maestro y la sesión ONNX se
+# comparte con los workers por copy-on-write; ver app/sharedmodel.py para medir la USS
+import os
+import sys
+import multiprocessing
+
+from app.autotune import load_profile
+
+# Workers e hilos ORT del perfil de python -m app.autotune si existe; si no, un hilo
+# ORT por worker: el paralelismo lo dan los workers y el maestro no crea un pool de
+# hilos que el fork dejaría inconsistente
+profile = load_profile()
+os.environ.setdefault('YOLO_ORT_THREADS', str(profile.get('intra_op_threads', 1)))
+
+bind = os.getenv('GUNICORN_BIND', '127.0.0.1:8000')
+# Las fuentes en vivo (/sources) viven en un solo proceso: para usarlas, WEB_CONCURRENCY=1
+# o app/router.py delante de varios procesos (ver app/application.py)
+workers = int(os.getenv('WEB_CONCURRENCY', profile.get('workers', multiprocessing.cpu_count())))
+# Con más de un hilo por worker las peticiones esperan el modelo en la cola con
+# prioridades de app/qos.py (YOLO_INFER_SLOTS inferencias simultáneas).
+# Cada espectador de /sources/<id>/stream ocupa un hilo mientras mira: con fuentes
+# (YOLO_SOURCES o YOLO_STREAMING=1) los workers son gthread con 8 hilos, porque un
+# worker sync quedaría tomado por un solo espectador y el timeout lo reiniciaría. La
+# app responde 503 a los streams pedidos a un worker sin hilos
+streaming = bool(os.getenv('YOLO_SOURCES')) or os.getenv('YOLO_STREAMING') == '1'
+threads = int(os.getenv('GUNICORN_THREADS', 8 if streaming else 1))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread' if threads > 1 else 'sync')
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+preload_app = os.getenv('YOLO_PRELOAD', '1') != '0'
+# Con preload el maestro no arranca hilos (fuentes de YOLO_SOURCES): los abre cada worker
+if preload_app:
+    os.environ.setdefault('YOLO_DEFER_START', '1')
+
+
+def report_memory(log, label, pid=None):
+    try:
+        from app.sharedmodel import worker_memory
+        mem = worker_memory(pid)
+    except Exception as e:
+        log.warning('No se pudo medir la memoria: %s', e)
+        return
+    log.info('%s USS %.1f MB, PSS %.1f MB, RSS %.1f MB', label, mem['uss_mb'], mem['pss_mb'], mem['rss_mb'])
+
+
+def when_ready(server):
+    report_memory(server.log, f'Maestro (preload={preload_app})')
+
+
+def post_worker_init(worker):
+    report_memory(worker.log, f'Worker {worker.pid}')
+
+
+def worker_exit(server, worker):
+    # Vuelca los conteos que quedaron en el búfer del worker antes de que termine
+    application = sys.modules.get('app.application')
+    if application is not None:
+        application.flush_counts()
@@ -11,6 +11,7 @@ import pytest
 import json
 import io
 import os
+import numpy as np
 from PIL import Image
 import tempfile
 from unittest.mock import patch, MagicMock
@@ -195,6 +196,702 @@ class TestDetectRoute:
         assert response.status_code == 500
 
 
+    @patch('app.application.yolo')
+    def test_detect_route_tiled_flag(self, mock_yolo, client):
+        """Prueba que tiled=1 use la inferencia por mosaicos"""
+        mock_yolo.inference_tiled.return_value = (None, [(0, 10, 10, 50, 50, 0, 0.9)], {'person': 1})
+        mock_yolo.convertbox.return_value = [10, 10, 50, 50]
+        mock_yolo.class_names = ['person', 'bicycle', 'car']
+
+        img = Image.new('RGB', (100, 100), color='red')
+        img_io = io.BytesIO()
+        img.save(img_io, format='JPEG')
+        img_io.seek(0)
+
+        response = client.post('/detect-count', data={'image': (img_io, 'test.jpg'), 'tiled': '1'})
+        assert response.status_code == 200
+        assert mock_yolo.inference_tiled.called
+        assert not mock_yolo.inference.called
+
+    @patch('app.application.tile_threshold', 50 * 50)
+    @patch('app.application.yolo')
+    def test_detect_route_tiled_above_threshold(self, mock_yolo, client):
+        """Prueba que las imágenes sobre el umbral se procesen por mosaicos"""
+        mock_yolo.inference_tiled.return_value = (None, [], {})
+
+        img = Image.new('RGB', (100, 100), color='red')
+        img_io = io.BytesIO()
+        img.save(img_io, format='JPEG')
+        img_io.seek(0)
+
+        response = client.post('/detect-count', data={'image': (img_io, 'test.jpg')})
+        assert response.status_code == 200
+        assert mock_yolo.inference_tiled.called
+
+    @patch('app.application.yolo')
+    def test_detect_route_rois(self, mock_yolo, client):
+        """Prueba que roi use la inferencia por regiones con coordenadas originales"""
+        mock_yolo.inference_rois.return_value = (None, [], {})
+
+        img_io = io.BytesIO()
+        Image.new('RGB', (100, 100), color='red').save(img_io, format='PNG')
+        img_io.seek(0)
+
+        response = client.post('/detect-count', data={'image': (img_io, 'test.png'), 'roi': '0,0,50,50;60,60,90,90'})
+        assert response.status_code == 200
+        args, kwargs = mock_yolo.inference_rois.call_args
+        assert args[1] == [(0.0, 0.0, 50.0, 50.0), (60.0, 60.0, 90.0, 90.0)]
+        assert not mock_yolo.inference.called
+
+    @pytest.mark.parametrize('roi', ['1,2,3', '[[1, 2]]', 'a,b,c,d', '[5]', 'nan,0,10,10', '0,0,inf,10',
+                                     '0,0,10,10;-inf,0,5,5'])
+    def test_detect_route_invalid_roi(self, client, roi):
+        """Una ROI mal formada devuelve 400"""
+        img_io = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(img_io, format='PNG')
+        img_io.seek(0)
+        response = client.post('/detect-count', data={'image': (img_io, 'test.png'), 'roi': roi})
+        assert response.status_code == 400
+
+    @pytest.mark.parametrize('route', ['/detect-count', '/detect-count/annotated'])
+    @patch('app.application.yolo')
+    def test_roi_outside_image(self, mock_yolo, client, route):
+        """Una ROI fuera de la imagen da 400 sin llegar al modelo"""
+        img_io = io.BytesIO()
+        Image.new('RGB', (100, 100)).save(img_io, format='PNG')
+        img_io.seek(0)
+        response = client.post(route, data={'image': (img_io, 'test.png'), 'roi': '200,200,300,300'})
+        assert response.status_code == 400
+        assert 'dentro de la imagen' in json.loads(response.data)['details']
+        assert not mock_yolo.inference_rois.called
+
+    @patch('app.application.yolo')
+    def test_detect_route_countings_only(self, mock_yolo, client):
+        """fields=countings no convierte cajas ni serializa detecciones"""
+        mock_yolo.inference.return_value = (None, [(0, 10, 10, 50, 50, 0, 0.9)], {'person': 1})
+        mock_yolo.class_names = ['person', 'bicycle', 'car']
+
+        img_io = io.BytesIO()
+        Image.new('RGB', (100, 100), color='red').save(img_io, format='PNG')
+        img_io.seek(0)
+        response = client.post('/detect-count', data={'image': (img_io, 'test.png'), 'fields': 'countings'})
+        assert response.status_code == 200
+        assert json.loads(response.data) == {'countings': {'person': 1}}
+        assert not mock_yolo.convertbox.called
+
+    @patch('app.application.yolo')
+    def test_detect_route_class_filters(self, mock_yolo, client):
+        """min_score por clase y class se aplican a conteos y detecciones"""
+        mock_yolo.inference.return_value = (None, [
+            (0, 10, 10, 50, 50, 0, 0.9),
+            (0, 20, 20, 40, 40, 0, 0.5),
+            (0, 60, 60, 100, 100, 2, 0.5),
+            (0, 30, 30, 70, 70, 1, 0.9),
+        ], {'person': 2, 'car': 1, 'bicycle': 1})
+        mock_yolo.convertbox.return_value = [10, 10, 50, 50]
+        mock_yolo.class_names = ['person', 'bicycle', 'car']
+
+        img_io = io.BytesIO()
+        Image.new('RGB', (100, 100), color='red').save(img_io, format='PNG')
+        img_io.seek(0)
+        response = client.post('/detect-count', data={'image': (img_io, 'test.png'),
+                                                      'min_score': '0.3,person:0.6', 'class': 'person,car'})
+        assert response.status_code == 200
+        json_data = json.loads(response.data)
+        assert json_data['countings'] == {'person': 1, 'car': 1}
+        assert [d[3] for d in json_data['detections']] == ['person', 'car']
+
+    @pytest.mark.parametrize('params', [{'fields': 'boxes'}, {'min_score': 'alto'},
+                                        {'class': 'unicornio'}, {'min_score': '{"unicornio": 0.5}'},
+                                        {'min_score': '{"car": null}'}, {'min_score': '{"car": [1]}'},
+                                        {'min_score': 'nan'}, {'min_score': 'car:inf'},
+                                        {'merge': 'WBF'}, {'merge': 'nsm'}])
+    @patch('app.application.yolo')
+    def test_detect_route_invalid_filters(self, mock_yolo, client, params):
+        """Campos, umbrales o clases desconocidas devuelven 400"""
+        mock_yolo.class_names = ['person', 'bicycle', 'car']
+        img_io = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(img_io, format='PNG')
+        img_io.seek(0)
+        response = client.post('/detect-count', data=dict(params, image=(img_io, 'test.png')))
+        assert response.status_code == 400
+        assert not mock_yolo.inference.called
+
+
+class TestClientResize:
+    """Pruebas de las subidas reducidas o letterboxeadas en el navegador"""
+
+    @patch('app.application.yolo')
+    def test_client_scale_maps_to_original(self, mock_yolo, client):
+        """client_scale se incorpora a la escala para devolver coordenadas originales"""
+        mock_yolo.inference.return_value = (None, [], {})
+        img_io = io.BytesIO()
+        Image.new('RGB', (640, 480)).save(img_io, format='WEBP')
+        img_io.seek(0)
+
+        response = client.post('/detect-count', data={'image': (img_io, 'foto.webp'), 'client_scale': '0.16'})
+        assert response.status_code == 200
+        assert mock_yolo.inference.call_args[1]['scale'] == pytest.approx(0.16)
+
+    @patch('app.application.yolo')
+    def test_exif_rotated_upload(self, mock_yolo, client):
+        """Una foto con orientación EXIF llega al modelo girada como la muestra el navegador"""
+        mock_yolo.inference.return_value = (None, [], {})
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        img_io = io.BytesIO()
+        Image.new('RGB', (320, 160)).save(img_io, format='JPEG', exif=exif)
+        img_io.seek(0)
+
+        response = client.post('/detect-count', data={'image': (img_io, 'foto.jpg'), 'client_scale': '0.5'})
+        assert response.status_code == 200
+        args, kwargs = mock_yolo.inference.call_args
+        assert args[0].size == (160, 320)
+        assert kwargs['scale'] == pytest.approx(0.5)
+
+    @patch('app.application.yolo')
+    def test_letterboxed_upload(self, mock_yolo, client):
+        """Una subida ya letterboxeada se normaliza sin volver a letterboxear"""
+        mock_yolo.inference_letterboxed.return_value = (None, [], {})
+        mock_yolo.input_shape = (64, 64)
+        mock_yolo.load_image.side_effect = np.asarray
+        img_io = io.BytesIO()
+        Image.new('RGB', (64, 64)).save(img_io, format='JPEG')
+        img_io.seek(0)
+
+        response = client.post('/detect-count', data={'image': (img_io, 'foto.jpg'), 'letterbox': '0.016,0,8'})
+        assert response.status_code == 200
+        args, _ = mock_yolo.inference_letterboxed.call_args
+        assert args[0].shape == (64, 64, 3) and args[1:] == (0.016, (0.0, 8.0))
+        assert not mock_yolo.inference.called
+
+    @pytest.mark.parametrize('params', [{'client_scale': '2'}, {'client_scale': 'x'},
+                                        {'letterbox': '0.1,0'}, {'letterbox': '0.1,0,0'},
+                                        {'letterbox': 'nan,0,0'}, {'client_scale': 'nan'}])
+    @patch('app.application.yolo')
+    def test_invalid_client_transform(self, mock_yolo, client, params):
+        """Escalas inválidas o una imagen letterboxeada de otro tamaño dan 400"""
+        mock_yolo.input_shape = (640, 640)
+        img_io = io.BytesIO()
+        Image.new('RGB', (64, 64)).save(img_io, format='PNG')
+        img_io.seek(0)
+        response = client.post('/detect-count', data=dict(params, image=(img_io, 'foto.png')))
+        assert response.status_code == 400
+        assert not mock_yolo.inference.called
+
+
+class TestRawRoute:
+    """Pruebas del endpoint de cuadros crudos"""
+
+    @patch('app.application.yolo')
+    def test_raw_bgr_frame(self, mock_yolo, client):
+        """Un cuadro BGR crudo va directo al modelo sin decodificar"""
+        mock_yolo.inference.return_value = (None, [(0, 10, 10, 50, 50, 0, 0.9)], {'person': 1})
+        mock_yolo.convertbox.return_value = [10, 10, 50, 50]
+        mock_yolo.class_names = ['person', 'bicycle', 'car']
+        frame = np.zeros((48, 64, 3), np.uint8)
+
+        response = client.post('/detect-count/raw', data=frame.tobytes(), content_type='application/octet-stream',
+                               headers={'X-Frame-Format': 'bgr', 'X-Frame-Shape': '48,64,3'})
+        assert response.status_code == 200
+        assert json.loads(response.data)['countings'] == {'person': 1}
+        args, kwargs = mock_yolo.inference.call_args
+        assert args[0].shape == (48, 64, 3) and kwargs['bgr'] is True
+
+    @patch('app.application.yolo')
+    def test_raw_letterboxed_frame(self, mock_yolo, client):
+        """Con X-Letterbox se omite el letterbox y se usan el ratio y el relleno del cliente"""
+        mock_yolo.inference_letterboxed.return_value = (None, [], {})
+        mock_yolo.input_shape = (64, 64)
+        frame = np.zeros((64, 64, 3), np.uint8)
+
+        response = client.post('/detect-count/raw?fields=countings', data=frame.tobytes(),
+                               headers={'X-Frame-Format': 'rgb', 'X-Frame-Shape': '64,64',
+                                        'X-Letterbox': '0.1,0,12'})
+        assert response.status_code == 200
+        args, kwargs = mock_yolo.inference_letterboxed.call_args
+        assert args[1:] == (0.1, (0.0, 12.0))
+        assert not mock_yolo.inference.called
+
+    @pytest.mark.parametrize('headers, size', [
+        ({'X-Frame-Format': 'rgb', 'X-Frame-Shape': '48,64'}, 100),
+        ({'X-Frame-Shape': '48,64'}, 48 * 64 * 3),
+        ({'X-Frame-Format': 'rgb', 'X-Frame-Shape': '48,64', 'X-Letterbox': '1,0,0'}, 48 * 64 * 3),
+    ])
+    @patch('app.application.yolo')
+    def test_raw_invalid_frame(self, mock_yolo, client, headers, size):
+        """Un largo que no coincide, un encabezado faltante o un letterbox de otro tamaño dan 400"""
+        mock_yolo.input_shape = (640, 640)
+        response = client.post('/detect-count/raw', data=b'\0' * size, headers=headers)
+        assert response.status_code == 400
+        assert not mock_yolo.inference.called
+
+
+class TestPriorityClasses:
+    """Pruebas de las clases de prioridad en la cola del modelo"""
+
+    def png(self):
+        img_io = io.BytesIO()
+        Image.new('RGB', (64, 64)).save(img_io, format='PNG')
+        img_io.seek(0)
+        return img_io
+
+    @patch('app.application.api_keys', {'k-nightly': 'bulk', 'k-ui': 'interactive'})
+    @patch('app.application.yolo')
+    def test_class_from_header_and_key(self, mock_yolo, client):
+        """La clase sale de la API key; sin clave el encabezado se ignora. La espera va en la respuesta"""
+        mock_yolo.inference.return_value = (None, [], {})
+        response = client.post('/detect-count', data={'image': (self.png(), 'a.png')},
+                               headers={'X-Priority-Class': 'interactive'})
+        assert response.status_code == 200
+        assert response.headers['X-Priority-Class'] == 'standard'
+        assert float(response.headers['X-Queue-Wait-Ms']) >= 0
+
+        response = client.post('/detect-count', data={'image': (self.png(), 'a.png')},
+                               headers={'X-Priority-Class': 'interactive', 'X-API-Key': 'k-ui'})
+        assert response.headers['X-Priority-Class'] == 'interactive'
+
+        response = client.post('/detect-count', data={'image': (self.png(), 'a.png')},
+                               headers={'X-Priority-Class': 'interactive', 'X-API-Key': 'k-nightly'})
+        assert response.headers['X-Priority-Class'] == 'bulk'
+
+        with patch('app.application.admin_token', 'secreto'):
+            stats = json.loads(client.get('/admin/qos', headers={'X-Admin-Token': 'secreto'}).data)
+        assert stats['classes']['interactive']['served'] >= 1
+        assert 'wait_p99_ms' in stats['classes']['bulk']
+
+    @patch('app.application.yolo')
+    def test_invalid_class(self, mock_yolo, client):
+        """Una clase desconocida da 400 sin llegar al modelo"""
+        response = client.post('/detect-count', data={'image': (self.png(), 'a.png')},
+                               headers={'X-Priority-Class': 'urgente'})
+        assert response.status_code == 400
+        assert not mock_yolo.inference.called
+
+    @patch('app.application.yolo')
+    def test_queue_timeout(self, mock_yolo, client):
+        """Si el modelo sigue ocupado al vencer la espera se responde 503 con Retry-After"""
+        from app.qos import QosScheduler
+        scheduler = QosScheduler(slots=1, timeout=0.05)
+        with patch('app.application.scheduler', scheduler), scheduler.slot('standard'):
+            response = client.post('/detect-count', data={'image': (self.png(), 'a.png')})
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        assert not mock_yolo.inference.called
+
+
+class TestMultiFrame:
+    """Pruebas de GIF animados y TIFF multipágina"""
+
+    @pytest.fixture
+    def model(self):
+        # YoloOnnx real con una sesión que detecta cada rectángulo claro como 'person'
+        import cv2
+        from app.yolocounterv1 import YoloOnnx
+
+        class Node:
+            def __init__(self, name, shape):
+                self.name, self.shape = name, shape
+
+        class BlobSession:
+            calls = 0
+
+            def get_inputs(self):
+                return [Node('images', ['batch', 3, 640, 640])]
+
+            def run(self, names, feed):
+                BlobSession.calls += 1
+                rows = []
+                for b, im in enumerate(feed['images']):
+                    mask = (im.min(axis=0) > 0.9).astype(np.uint8)
+                    n, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+                    rows += [[b, x, y, x + w, y + h, 0, 0.9] for x, y, w, h, _ in stats[1:n]]
+                return [np.array(rows, np.float32).reshape(-1, 7)]
+
+        yolo = YoloOnnx.__new__(YoloOnnx)
+        yolo.session = BlobSession()
+        yolo.class_names = ['person']
+        yolo.colors = {'person': [255, 0, 0]}
+        yolo.input_name, yolo.output_names = 'images', ['output']
+        yolo.dynamic_batch = True
+        yolo.input_shape, yolo.batch_size = (640, 640), 4
+        with patch('app.application.yolo', yolo):
+            yield yolo
+
+    def animation(self, counts, format_name='GIF'):
+        # Cuadro i con counts[i] rectángulos blancos
+        frames = []
+        for n in counts:
+            frame = np.full((120, 160, 3), 40, np.uint8)
+            for k in range(n):
+                frame[10:40, 10 + 35 * k:35 + 35 * k] = 255
+            frames.append(Image.fromarray(frame))
+        img_io = io.BytesIO()
+        frames[0].save(img_io, format=format_name, save_all=True, append_images=frames[1:])
+        img_io.seek(0)
+        return img_io
+
+    def test_every_frame_counted(self, model, client):
+        """Cada cuadro tiene sus conteos y el agregado por defecto es el máximo por clase"""
+        response = client.post('/detect-count', data={'image': (self.animation([1, 3, 0, 2]), 'a.gif')})
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert [row.get('countings') for row in data['frames']] == [{'person': 1}, {'person': 3}, {}, {'person': 2}]
+        assert data['countings'] == {'person': 3}
+        assert data['frame_count'] == 4 and data['frames_processed'] == 4
+        np.testing.assert_allclose(data['frames'][1]['detections'][2][0], [80, 10, 105, 40], atol=1)
+        # Cuatro cuadros en lotes de 4: menos session.run que cuadros
+        assert model.session.calls < 4
+
+    def test_step_and_mean(self, model, client):
+        """frame_step salta cuadros y aggregate=mean promedia los procesados"""
+        response = client.post('/detect-count', data={'image': (self.animation([1, 3, 0, 2, 2], 'TIFF'), 'a.tiff'),
+                                                      'frame_step': '2', 'aggregate': 'mean',
+                                                      'fields': 'countings'})
+        data = json.loads(response.data)
+        assert [row['frame'] for row in data['frames']] == [0, 2, 4]
+        assert data['countings'] == {'person': 1.0}
+        assert 'detections' not in data['frames'][0]
+
+    @patch('app.imageprobe.max_frames', 3)
+    def test_frame_budget(self, model, client):
+        """Una animación con más cuadros que el presupuesto se rechaza antes de inferir"""
+        response = client.post('/detect-count', data={'image': (self.animation([1, 2] * 3), 'a.gif')})
+        assert response.status_code == 413
+        assert json.loads(response.data)['max_frames'] == 3
+        assert model.session.calls == 0
+        response = client.post('/detect-count', data={'image': (self.animation([1, 2] * 3), 'a.gif'),
+                                                      'frame_step': '2'})
+        assert response.status_code == 200
+
+
+class TestUploadLimits:
+    """Pruebas del manejo de subidas con memoria acotada"""
+
+    @patch('app.uploads.max_upload_bytes', 1024)
+    @patch('app.application.yolo')
+    def test_upload_over_limit_is_rejected(self, mock_yolo, client):
+        """Una subida mayor al límite se aborta con 413 sin llegar al modelo"""
+        data = {'image': (io.BytesIO(b'\xff\xd8' + b'0' * 4096), 'big.jpg')}
+        response = client.post('/detect-count', data=data)
+        assert response.status_code == 413
+        assert not mock_yolo.inference.called
+
+    def test_spooled_file_rolls_to_disk(self):
+        """El archivo temporal pasa a disco al superar el umbral de memoria"""
+        from app.uploads import CappedSpooledFile
+        spooled = CappedSpooledFile(max_bytes=10_000, max_size=100)
+        spooled.write(b'x' * 500)
+        assert spooled._rolled
+
+    @patch('app.application.yolo')
+    def test_large_upload_decoded_from_disk(self, mock_yolo, client):
+        """Una imagen que se escribe a disco se procesa correctamente"""
+        mock_yolo.inference.return_value = (None, [], {})
+        img = Image.effect_noise((800, 800), 64).convert('RGB')
+        img_io = io.BytesIO()
+        img.save(img_io, format='PNG')
+        img_io.seek(0)
+
+        response = client.post('/detect-count', data={'image': (img_io, 'noise.png')})
+        assert response.status_code == 200
+        passed = mock_yolo.inference.call_args[0][0]
+        assert passed.size == (800, 800)
+
+
+class TestPixelBudget:
+    """Pruebas de la admisión por dimensiones antes de decodificar"""
+
+    @patch('app.imageprobe.max_pixels', 100 * 100)
+    @patch('app.application.yolo')
+    def test_image_over_pixel_budget(self, mock_yolo, client):
+        """Una imagen con más píxeles que el presupuesto se rechaza con 413"""
+        img = Image.new('RGB', (200, 200), color='red')
+        img_io = io.BytesIO()
+        img.save(img_io, format='PNG')
+        img_io.seek(0)
+
+        response = client.post('/detect-count', data={'image': (img_io, 'test.png')})
+        assert response.status_code == 413
+        assert not mock_yolo.inference.called
+
+    @patch('app.application.yolo')
+    def test_large_jpeg_reduced_decode(self, mock_yolo, client):
+        """Un JPEG grande se decodifica reducido y se informa la escala al modelo"""
+        mock_yolo.inference.return_value = (None, [], {})
+        img = Image.new('RGB', (2560, 1920), color='red')
+        img_io = io.BytesIO()
+        img.save(img_io, format='JPEG')
+        img_io.seek(0)
+
+        response = client.post('/detect-count', data={'image': (img_io, 'test.jpg')})
+        assert response.status_code == 200
+        args, kwargs = mock_yolo.inference.call_args
+        assert args[0].size == (640, 480)
+        assert kwargs['scale'] == pytest.approx(0.25)
+
+
+class TestAnnotatedRoute:
+    """Pruebas del endpoint de imagen anotada"""
+
+    def make_mock(self, mock_yolo, img):
+        mock_yolo.inference.return_value = (np.asarray(img), [(0, 10, 10, 50, 50, 0, 0.9)], {'person': 1})
+        mock_yolo.ratio = 1.0
+        mock_yolo.dwdh = (0.0, 0.0)
+        mock_yolo.class_names = ['person', 'bicycle', 'car']
+        mock_yolo.colors = {name: [255, 0, 0] for name in mock_yolo.class_names}
+
+    @patch('app.application.yolo')
+    def test_annotated_jpeg(self, mock_yolo, client):
+        """Devuelve un JPEG anotado con los conteos en el encabezado"""
+        img = Image.new('RGB', (200, 100), color='red')
+        self.make_mock(mock_yolo, img)
+        img_io = io.BytesIO()
+        img.save(img_io, format='PNG')
+        img_io.seek(0)
+
+        response = client.post('/detect-count/annotated', data={'image': (img_io, 'test.png')})
+        assert response.status_code == 200
+        assert response.content_type == 'image/jpeg'
+        assert json.loads(response.headers['X-Countings']) == {'person': 1}
+        assert Image.open(io.BytesIO(response.data)).size == (200, 100)
+
+    @patch('app.application.yolo')
+    def test_annotated_webp_preview(self, mock_yolo, client):
+        """Con max_dim y format=webp se entrega una vista previa reducida"""
+        img = Image.new('RGB', (400, 200), color='red')
+        self.make_mock(mock_yolo, img)
+        img_io = io.BytesIO()
+        img.save(img_io, format='PNG')
+        img_io.seek(0)
+
+        data = {'image': (img_io, 'test.png'), 'format': 'webp', 'max_dim': '100', 'quality': '70'}
+        response = client.post('/detect-count/annotated', data=data)
+        assert response.status_code == 200
+        assert response.content_type == 'image/webp'
+        assert Image.open(io.BytesIO(response.data)).size == (100, 50)
+
+    def test_annotated_invalid_format(self, client):
+        """Un formato de salida desconocido se rechaza"""
+        img_io = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(img_io, format='PNG')
+        img_io.seek(0)
+        response = client.post('/detect-count/annotated', data={'image': (img_io, 'test.png'), 'format': 'tga'})
+        assert response.status_code == 400
+
+    @pytest.mark.parametrize('max_dim', ['0', '-5', 'x'])
+    @patch('app.application.yolo')
+    def test_annotated_invalid_max_dim(self, mock_yolo, client, max_dim):
+        """max_dim debe ser un entero positivo"""
+        img_io = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(img_io, format='PNG')
+        img_io.seek(0)
+        response = client.post('/detect-count/annotated', data={'image': (img_io, 'test.png'), 'max_dim': max_dim})
+        assert response.status_code == 400
+        assert not mock_yolo.inference.called
+
+
+class TestJobRoutes:
+    """Pruebas de la API de trabajos asíncronos"""
+
+    def test_create_job_without_image(self, client):
+        """Crear un trabajo sin imagen falla"""
+        response = client.post('/jobs', data={})
+        assert response.status_code == 400
+
+    def test_create_job_invalid_extension(self, client):
+        """Las extensiones no permitidas se rechazan al encolar"""
+        response = client.post('/jobs', data={'image': (io.BytesIO(b'x'), 'test.txt')})
+        assert response.status_code == 400
+
+    @patch('app.application.job_queue')
+    def test_create_job_returns_id(self, mock_queue, client):
+        """Al encolar se responde 202 con el id y la ubicación del trabajo"""
+        job = {'id': 'abc', 'status': 'queued', 'priority': 0, 'created': 0.0,
+               'started': None, 'finished': None, 'expires': None}
+        mock_queue.submit.return_value = (job, True)
+        img_io = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(img_io, format='PNG')
+        img_io.seek(0)
+
+        response = client.post('/jobs', data={'image': (img_io, 'test.png')}, headers={'Idempotency-Key': 'k'})
+        assert response.status_code == 202
+        assert response.headers['Location'].endswith('/jobs/abc')
+        assert mock_queue.submit.call_args[0][3] == 'k'
+
+    @patch('app.application.job_queue')
+    def test_get_unknown_job(self, mock_queue, client):
+        """Un trabajo inexistente o expirado devuelve 404"""
+        mock_queue.wait.return_value = None
+        response = client.get('/jobs/desconocido?wait=1')
+        assert response.status_code == 404
+
+    @pytest.mark.parametrize('wait', ['nan', 'inf', '-1', 'x'])
+    @patch('app.application.job_queue')
+    def test_invalid_wait(self, mock_queue, client, wait):
+        """Un wait no finito o negativo da 400 sin esperar"""
+        response = client.get(f'/jobs/abc?wait={wait}')
+        assert response.status_code == 400
+        assert not mock_queue.wait.called
+
+
+class TestCountsRoute:
+    """Pruebas de la consulta de conteos"""
+
+    def test_flush_counts_at_exit(self, tmp_path):
+        """flush_counts (atexit y worker_exit de gunicorn) vuelca el búfer pendiente"""
+        from app.counts import CountStore
+        from app import application
+        store = CountStore(path=str(tmp_path / 'counts.sqlite3'), flush_interval=60)
+        with patch('app.application.count_store', store):
+            store.record('cam1', {'person': 3}, ts=1704067200.0)
+            application.flush_counts()
+        rows = store.query(1704067200.0, 1704067260.0)['rows']
+        assert [row['count'] for row in rows] == [3]
+
+    @patch('app.application.count_store')
+    @patch('app.application.yolo')
+    def test_detect_count_records_source(self, mock_yolo, mock_store, client):
+        """Los conteos de /detect-count se registran con la fuente indicada"""
+        mock_yolo.inference.return_value = (None, [], {'person': 2})
+        img_io = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(img_io, format='PNG')
+        img_io.seek(0)
+
+        response = client.post('/detect-count', data={'image': (img_io, 'test.png'), 'source': 'cam1'})
+        assert response.status_code == 200
+        mock_store.record.assert_called_once_with('cam1', {'person': 2}, None)
+
+    @pytest.mark.parametrize('timestamp', ['inf', 'nan', '-inf', 'ayer'])
+    @patch('app.application.count_store')
+    @patch('app.application.yolo')
+    def test_invalid_timestamp(self, mock_yolo, mock_store, client, timestamp):
+        """Una marca de tiempo no finita o ilegible se rechaza antes de la inferencia"""
+        img_io = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(img_io, format='PNG')
+        img_io.seek(0)
+
+        response = client.post('/detect-count', data={'image': (img_io, 'test.png'), 'timestamp': timestamp})
+        assert response.status_code == 400
+        assert not mock_yolo.inference.called and not mock_store.record.called
+
+    @patch('app.application.count_store')
+    def test_counts_query(self, mock_store, client):
+        """La consulta pasa rango, agrupación y filtros al almacén"""
+        mock_store.query.return_value = {'resolution': 'hour', 'start': 0, 'end': 7200, 'rows': []}
+        mock_store.images.return_value = {}
+        response = client.get('/counts?start=1970-01-01T00:00:00Z&end=7200&group_by=source,bucket&source=cam1')
+        assert response.status_code == 200
+        assert mock_store.query.call_args[0] == (0.0, 7200.0, None, ['source', 'bucket'], ['cam1'], None)
+
+    @pytest.mark.parametrize('query', ['start=abc', 'start=10&end=5', 'resolution=week', 'group_by=pixel',
+                                       'start=nan', 'end=inf'])
+    def test_counts_invalid_params(self, client, query):
+        """Parámetros inválidos devuelven 400"""
+        response = client.get(f'/counts?{query}')
+        assert response.status_code == 400
+
+
+class TestSourceRoutes:
+    """Pruebas de la API de fuentes en vivo"""
+
+    admin = {'X-Admin-Token': 'secreto'}
+
+    @patch('app.application.admin_token', 'secreto')
+    def test_add_source_requires_url(self, client):
+        """Agregar una fuente sin url falla"""
+        response = client.post('/sources', json={'id': 'cam1'}, headers=self.admin)
+        assert response.status_code == 400
+
+    @patch('app.application.admin_token', 'secreto')
+    @patch('app.application.source_manager')
+    def test_add_source(self, mock_manager, client):
+        """Agregar una fuente responde 201 con su ubicación"""
+        mock_manager.add.return_value.id = 'cam1'
+        mock_manager.add.return_value.stats.return_value = {'id': 'cam1'}
+        response = client.post('/sources', json={'id': 'cam1', 'url': 'rtsp://camara', 'weight': 2},
+                               headers=self.admin)
+        assert response.status_code == 201
+        assert response.headers['Location'].endswith('/sources/cam1')
+        mock_manager.add.assert_called_once_with('cam1', 'rtsp://camara', 2.0, rois=None)
+
+    @patch('app.application.SourceManager')
+    def test_sources_open_after_fork(self, mock_manager, tmp_path, monkeypatch):
+        """Con el arranque diferido (preload) las fuentes configuradas se abren en el worker"""
+        from app import application
+        config = tmp_path / 'sources.json'
+        config.write_text(json.dumps([{'id': 'cam1', 'url': 'rtsp://camara'}]))
+        monkeypatch.setenv('YOLO_SOURCES', str(config))
+        monkeypatch.setattr(application, 'defer_start', True)
+        monkeypatch.setattr(application, 'source_manager', application.source_manager)
+        application.restart_after_fork()
+        assert application.source_manager is mock_manager.return_value
+        mock_manager.return_value.add.assert_called_once_with('cam1', 'rtsp://camara', 1.0, rois=None,
+                                                              motion_threshold=None, motion_max_interval=None)
+
+    @patch('app.application.admin_token', 'secreto')
+    @patch('app.application.source_manager')
+    def test_add_and_remove_require_admin(self, mock_manager, client):
+        """Sin el token de administración no se agregan ni se quitan fuentes"""
+        response = client.post('/sources', json={'id': 'cam1', 'url': 'rtsp://camara'})
+        assert response.status_code == 403
+        assert client.delete('/sources/cam1').status_code == 403
+        assert not mock_manager.add.called and not mock_manager.remove.called
+
+    @pytest.mark.parametrize('url', ['/etc/passwd', 'file:///etc/passwd', '0', 'concat:a.mp4|b.mp4', 'rtsp://'])
+    @patch('app.application.admin_token', 'secreto')
+    @patch('app.application.source_manager')
+    def test_add_source_scheme_allowlist(self, mock_manager, client, url):
+        """Rutas locales, índices de cámara y esquemas fuera de la lista se rechazan"""
+        response = client.post('/sources', json={'id': 'cam1', 'url': url}, headers=self.admin)
+        assert response.status_code == 400
+        assert not mock_manager.add.called
+
+    @pytest.mark.parametrize('fields', [{'weight': 'nan'}, {'weight': 'inf'}, {'weight': None}, {'weight': [1]},
+                                        {'motion_threshold': 'nan'}, {'motion_max_interval': 'inf'}])
+    @patch('app.application.admin_token', 'secreto')
+    def test_invalid_source_parameters(self, client, fields):
+        """Pesos y parámetros de movimiento no finitos o de otro tipo dan 400"""
+        from app import application
+        response = client.post('/sources', json=dict(fields, id='cam1', url='rtsp://camara'), headers=self.admin)
+        assert response.status_code == 400
+        assert 'cam1' not in application.source_manager.sources
+
+    @patch('app.application.admin_token', 'secreto')
+    def test_unknown_source(self, client):
+        """Una fuente inexistente devuelve 404"""
+        assert client.get('/sources/desconocida').status_code == 404
+        assert client.get('/sources/desconocida/stream').status_code == 404
+        assert client.delete('/sources/desconocida', headers=self.admin).status_code == 404
+
+    def test_stream(self, client):
+        """El stream es multipart/x-mixed-replace con el último cuadro de la fuente"""
+        from app.livestream import FrameBroadcast
+        source = MagicMock()
+        source.live = FrameBroadcast()
+        source.live.publish(lambda: b'jpeg')
+        threaded = {'wsgi.multithread': True}
+        with patch.dict('app.application.source_manager.sources', {'cam1': source}):
+            response = client.get('/sources/cam1/stream?max_fps=5', environ_overrides=threaded)
+            assert response.mimetype == 'multipart/x-mixed-replace'
+            part = next(response.response)
+            assert part == b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: 4\r\n\r\njpeg\r\n'
+            response.close()
+            assert client.get('/sources/cam1/stream?max_fps=0', environ_overrides=threaded).status_code == 400
+
+    def test_stream_rejected_without_threads(self, client):
+        """Un worker sin hilos (gunicorn sync) no atiende streams: respondería uno solo hasta el timeout"""
+        source = MagicMock()
+        with patch.dict('app.application.source_manager.sources', {'cam1': source}):
+            response = client.get('/sources/cam1/stream', environ_overrides={'wsgi.multithread': False})
+            assert response.status_code == 503
+            with patch('app.application.stream_any_worker', True):
+                response = client.get('/sources/cam1/stream', environ_overrides={'wsgi.multithread': False},
+                                      buffered=False)
+                assert response.status_code == 200
+                response.close()
+
+
 class TestImageFormats:
     """Pruebas con diferentes formatos de imagen"""
     
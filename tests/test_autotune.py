@@ -0,0 +1,72 @@
+import json
+import time
+
+import numpy as np
+
+from app.autotune import build_grid, choose, load_profile, measure, tune, write_profile
+
+
+class FakeModel:
+    """Modelo cuyo costo por imagen depende de la resolución; 320 no está soportada"""
+
+    def __init__(self, config):
+        if config['input_size'] == 320:
+            raise ValueError('Got invalid dimensions for input')
+        self.size = config['input_size']
+
+    def preprocess(self, img):
+        return np.zeros((1, 3, 8, 8), np.float32), 1.0, (0, 0)
+
+    def run_batch(self, blobs):
+        time.sleep(len(blobs) * self.size / 640 * 0.002)
+        return np.zeros((0, 7), np.float32)
+
+
+class TestAutotune:
+    """Pruebas del ajuste automático de la configuración"""
+
+    def test_grid_respects_cpus(self):
+        """Sin oversubscribe no se piden más hilos que CPUs"""
+        grid = build_grid([1, 2, 4], [1, 2, 4], [1, 4], [640], cpus=4)
+        assert all(c['workers'] * c['intra_op_threads'] <= 4 for c in grid)
+        assert len(grid) == 6 * 2
+        assert len(build_grid([1, 2, 4], [1, 2, 4], [1], [640], cpus=4, oversubscribe=True)) == 9
+
+    def test_choose_best_throughput_within_p99(self):
+        """Se elige el mayor throughput que cumple el p99; si ninguna cumple, el menor p99"""
+        results = [
+            {'workers': 1, 'intra_op_threads': 1, 'throughput': 10, 'p99_ms': 50},
+            {'workers': 2, 'intra_op_threads': 1, 'throughput': 30, 'p99_ms': 90},
+            {'workers': 4, 'intra_op_threads': 1, 'throughput': 40, 'p99_ms': 300},
+            {'workers': 4, 'intra_op_threads': 2, 'error': 'falló'},
+        ]
+        best, meets = choose(results, 100)
+        assert meets and best['throughput'] == 30
+        best, meets = choose(results, 10)
+        assert not meets and best['p99_ms'] == 50
+
+    def test_measure_and_profile(self, tmp_path):
+        """Los workers se miden en paralelo y el perfil guarda la configuración elegida"""
+        images = [np.zeros((16, 16, 3), np.uint8)]
+        row = measure({'workers': 2, 'intra_op_threads': 1, 'batch_size': 2, 'input_size': 640},
+                      FakeModel, images, duration=0.3)
+        assert 'error' not in row
+        assert row['p99_ms'] >= row['p50_ms'] >= 3
+        # Dos workers con lotes de 2 imágenes de ~4 ms
+        assert 100 < row['throughput'] < 2000
+
+        grid = build_grid([1], [1], [1, 2], [640, 320], cpus=1)
+        best, meets, results = tune(grid, FakeModel, images, 0.2, target_p99_ms=1000, log=lambda msg: None)
+        assert meets and best['input_size'] == 640
+        assert [r['error'] for r in results if r['input_size'] == 320][1] == 'Resolución no soportada por el modelo'
+
+        path = str(tmp_path / 'perfil.json')
+        write_profile(path, best, meets, results, 1000, '/modelos/yolo.onnx')
+        profile = load_profile(path)
+        assert profile['input_size'] == 640 and profile['batch_size'] == best['batch_size']
+        assert profile['model'] == 'yolo.onnx'
+        assert len(json.load(open(path))['results']) == 4
+
+    def test_missing_profile(self, tmp_path):
+        """Sin perfil se usan los valores por defecto"""
+        assert load_profile(str(tmp_path / 'no_existe.json')) == {}
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from app.boxes import nms, unletterbox, tile_windows, clip_rois, select, count_classes
+
+
+class TestTileWindows:
+    """Pruebas del corte en mosaicos"""
+
+    def test_small_image_single_window(self):
+        """Una imagen menor que el mosaico produce una sola ventana"""
+        assert tile_windows(300, 200) == [(0, 0, 300, 200)]
+
+    def test_windows_cover_image_with_full_tiles(self):
+        """Todas las ventanas miden 640 y cubren la imagen completa"""
+        windows = tile_windows(4000, 3000, tile=640, overlap=0.2)
+        assert all(x1 - x0 == 640 and y1 - y0 == 640 for x0, y0, x1, y1 in windows)
+        assert max(x1 for _, _, x1, _ in windows) == 4000
+        assert max(y1 for _, _, _, y1 in windows) == 3000
+
+
+class TestMerging:
+    """Pruebas de NMS/WBF vectorizados"""
+
+    def test_nms_suppresses_duplicates_per_class(self):
+        """Las cajas duplicadas se eliminan solo dentro de la misma clase"""
+        dets = np.array([
+            [0, 0, 0, 10, 10, 0, 0.9],
+            [0, 1, 1, 11, 11, 0, 0.8],
+            [0, 1, 1, 11, 11, 1, 0.7],
+        ])
+        merged = nms(dets, iou_thres=0.5)
+        assert len(merged) == 2
+        assert sorted(merged[:, 5].tolist()) == [0, 1]
+        assert merged[merged[:, 5] == 0][0, 6] == pytest.approx(0.9)
+
+    def test_wbf_averages_coordinates(self):
+        """WBF promedia las coordenadas ponderando por score"""
+        dets = np.array([
+            [0, 0, 0, 10, 10, 0, 0.5],
+            [0, 2, 2, 12, 12, 0, 0.5],
+        ])
+        merged = nms(dets, iou_thres=0.3, merge='wbf')
+        assert len(merged) == 1
+        assert merged[0, 1:5].tolist() == pytest.approx([1, 1, 11, 11])
+
+    def test_empty(self):
+        """Sin detecciones el resultado es vacío"""
+        assert nms(np.zeros((0, 7))).shape == (0, 7)
+
+    def test_unletterbox_with_offset(self):
+        """Las cajas de un recorte vuelven a coordenadas globales"""
+        dets = np.array([[0, 20, 30, 120, 130, 0, 0.9]])
+        out = unletterbox(dets, ratio=0.5, dwdh=(10, 10), offset=(100, 200))
+        assert out[0, 1:5].tolist() == pytest.approx([120, 240, 320, 440])
+
+
+class TestClipRois:
+    """Pruebas de las regiones de interés"""
+
+    def test_rois_scaled_and_clipped(self):
+        """Las ROIs se escalan a la imagen decodificada y se recortan a sus bordes"""
+        windows = clip_rois([(100, 50, 300.5, 250), (900, 700, 1200, 900)], 500, 400, scale=0.5)
+        assert windows == [(50, 25, 151, 125), (450, 350, 500, 400)]
+
+    def test_roi_outside_image_rejected(self):
+        """Si ninguna ROI cae dentro de la imagen se rechaza"""
+        with pytest.raises(ValueError):
+            clip_rois([(600, 600, 700, 700)], 500, 400)
+
+
+class TestClassFilters:
+    """Pruebas de los filtros y el conteo vectorizados"""
+
+    names = ['person', 'bicycle', 'car']
+    dets = np.array([
+        [0, 0, 0, 10, 10, 2, 0.4],
+        [0, 0, 0, 10, 10, 0, 0.9],
+        [0, 0, 0, 10, 10, 0, 0.5],
+        [0, 0, 0, 10, 10, 1, 0.3],
+        [0, 0, 0, 10, 10, 2, 0.8],
+    ], dtype=np.float32)
+
+    def test_per_class_min_score_and_allowlist(self):
+        """Umbral por clase con valor por defecto y lista de clases permitidas"""
+        out = select(self.dets, self.names, {'*': 0.35, 'person': 0.6})
+        assert out[:, 6].tolist() == pytest.approx([0.4, 0.9, 0.8])
+        out = select(self.dets, self.names, 0.5, classes=['car'])
+        assert out[:, 6].tolist() == pytest.approx([0.8])
+
+    def test_unknown_class_rejected(self):
+        """Un nombre de clase desconocido es un error"""
+        with pytest.raises(ValueError):
+            select(self.dets, self.names, classes=['unicornio'])
+
+    def test_count_order_matches_first_appearance_on_ties(self):
+        """Conteos de mayor a menor y, a igual conteo, por primera aparición"""
+        assert list(count_classes(self.dets, self.names).items()) == [('car', 2), ('person', 2), ('bicycle', 1)]
+        assert count_classes([], self.names) == {}
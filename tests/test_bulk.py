@@ -0,0 +1,77 @@
+import csv
+import json
+import os
+
+import pytest
+from PIL import Image
+
+from app.bulk import walk_images, write_shard, Progress, signature, run
+
+
+def make_images(root, n):
+    for i in range(n):
+        sub = os.path.join(root, 'a' if i % 2 else 'b')
+        os.makedirs(sub, exist_ok=True)
+        Image.new('RGB', (64, 48), color='red').save(os.path.join(sub, f'img{i:03d}.jpg'))
+
+
+class TestBulkHelpers:
+    """Pruebas de entrada, salida y checkpoint del procesamiento masivo"""
+
+    def test_walk_images_sorted_and_filtered(self, temp_dir):
+        """El recorrido es determinista y solo incluye imágenes"""
+        make_images(temp_dir, 4)
+        open(os.path.join(temp_dir, 'notas.txt'), 'w').close()
+        paths = walk_images(temp_dir)
+        assert len(paths) == 4
+        assert paths == walk_images(temp_dir)
+        assert all(p.endswith('.jpg') for p in paths)
+
+    @pytest.mark.parametrize('fmt', ['csv', 'jsonl'])
+    def test_write_shard(self, temp_dir, fmt):
+        """Cada shard se escribe completo con conteos y detecciones"""
+        rows = [{'path': 'a.jpg', 'status': 'ok', 'error': None, 'width': 10, 'height': 10,
+                 'n_detections': 1, 'countings': {'person': 1},
+                 'detections': [[[1, 2, 3, 4], 0, '0.9', 'person']]}]
+        path = os.path.join(temp_dir, f'part-00000.{fmt}')
+        write_shard(rows, path, fmt)
+        assert not os.path.exists(path + '.tmp')
+        with open(path) as f:
+            if fmt == 'csv':
+                row = next(csv.DictReader(f))
+                assert json.loads(row['countings']) == {'person': 1}
+            else:
+                assert json.loads(f.readline())['countings'] == {'person': 1}
+
+    def test_progress_resume(self, temp_dir):
+        """El progreso guardado se recupera con la misma entrada"""
+        sig = signature(['a.jpg', 'b.jpg'], 1)
+        Progress(temp_dir, sig).mark(0, 1, 0.5)
+        assert Progress(temp_dir, sig).completed == {0}
+        assert Progress(temp_dir, sig, restart=True).completed == set()
+
+    def test_progress_other_input(self, temp_dir):
+        """Un progreso de otra entrada no se reutiliza"""
+        Progress(temp_dir, signature(['a.jpg'], 1)).mark(0, 1, 0.5)
+        with pytest.raises(SystemExit):
+            Progress(temp_dir, signature(['otra.jpg'], 1))
+
+
+@pytest.mark.slow
+class TestBulkRun:
+    """Prueba de punta a punta con el modelo real"""
+
+    def test_run_and_resume(self, temp_dir):
+        """Procesa todas las imágenes y al relanzar no repite shards"""
+        from app.yolomodel import yolopath, class_names
+        source = os.path.join(temp_dir, 'imagenes')
+        output = os.path.join(temp_dir, 'salida')
+        make_images(source, 5)
+        paths = walk_images(source)
+        state = run(paths, output, fmt='jsonl', shard_size=2, batch_size=2, workers=2,
+                    model_path=yolopath, class_names=class_names)
+        assert sorted(state['completed']) == [0, 1, 2]
+        assert state['images'] == 5
+        again = run(paths, output, fmt='jsonl', shard_size=2, workers=2,
+                    model_path=yolopath, class_names=class_names)
+        assert again['images'] == 5
@@ -0,0 +1,126 @@
+import os
+import time
+
+import pytest
+
+from app.counts import CountStore, auto_resolution
+
+# 2024-01-01 00:00:00 UTC
+t0 = 1704067200.0
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = CountStore(path=str(tmp_path / 'counts.sqlite3'), flush_interval=60)
+    yield s
+    s.stop()
+
+
+class TestCountStore:
+    """Pruebas de la serie temporal de conteos"""
+
+    def test_record_is_buffered_until_flush(self, store):
+        """Registrar no escribe en la base hasta el volcado por lotes"""
+        store.record('cam1', {'person': 2}, ts=t0)
+        assert store.query(t0, t0 + 60)['rows'] == []
+        assert store.flush() == 1
+        assert store.query(t0, t0 + 60)['rows'] == [{'bucket': t0, 'class': 'person', 'count': 2, 'max': 2}]
+
+    def test_rollups_by_resolution(self, store):
+        """Los acumulados por minuto, hora y día suman lo mismo"""
+        for i in range(120):
+            store.record('cam1', {'person': 1, 'car': i % 3}, ts=t0 + i * 30)
+        store.flush()
+        minute = store.query(t0, t0 + 3600, 'minute', group_by=['class'])['rows']
+        hour = store.query(t0, t0 + 3600, 'hour', group_by=['class'])['rows']
+        day = store.query(t0, t0 + 86400, 'day', group_by=['class'])['rows']
+        assert minute == hour == day
+        assert {r['class']: r['count'] for r in day} == {'car': 120, 'person': 120}
+        buckets = store.query(t0, t0 + 3600, 'minute', group_by=['bucket'])['rows']
+        assert len(buckets) == 60
+        assert sum(r['count'] for r in buckets) == 240
+
+    def test_incremental_across_flushes(self, store):
+        """Varios volcados sobre el mismo bucket se acumulan"""
+        store.record('cam1', {'person': 3}, ts=t0 + 1)
+        store.flush()
+        store.record('cam1', {'person': 4}, ts=t0 + 2)
+        store.flush()
+        rows = store.query(t0, t0 + 60, 'minute', group_by=['class'])['rows']
+        assert rows == [{'class': 'person', 'count': 7, 'max': 4}]
+        assert store.images(t0, t0 + 60, 'minute') == {'cam1': 2}
+
+    def test_filters_and_group_by_source(self, store):
+        """Se puede filtrar por fuente y clase y agrupar por fuente"""
+        store.record('cam1', {'person': 1}, ts=t0)
+        store.record('cam2', {'person': 5, 'car': 1}, ts=t0)
+        store.flush()
+        rows = store.query(t0, t0 + 60, group_by=['source'])['rows']
+        assert [(r['source'], r['count']) for r in rows] == [('cam1', 1), ('cam2', 6)]
+        rows = store.query(t0, t0 + 60, group_by=['source'], sources=['cam2'], classes=['car'])['rows']
+        assert [(r['source'], r['count']) for r in rows] == [('cam2', 1)]
+
+    def test_writer_thread_flushes(self, tmp_path):
+        """El hilo escritor vuelca el búfer sin intervención de la petición"""
+        s = CountStore(path=str(tmp_path / 'counts.sqlite3'), flush_interval=0.05)
+        try:
+            s.record('cam1', {'person': 1}, ts=t0)
+            for _ in range(100):
+                if s.query(t0, t0 + 60)['rows']:
+                    break
+                time.sleep(0.02)
+            assert s.query(t0, t0 + 60)['rows']
+        finally:
+            s.stop()
+
+    def test_after_fork(self, store):
+        """El hijo de un fork arranca su propio escritor y no vuelca los pendientes del padre"""
+        store.record('padre', {'person': 1}, ts=t0)
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                store.after_fork()
+                store.record('hijo', {'person': 1}, ts=t0)
+                code = 0 if store._thread.is_alive() else 1
+                store.stop()
+            finally:
+                os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+        store.flush()
+        rows = store.query(t0, t0 + 60, group_by=('source',))['rows']
+        assert rows == [{'source': 'hijo', 'count': 1, 'max': 1}, {'source': 'padre', 'count': 1, 'max': 1}]
+
+    def test_writer_survives_bad_batch(self, tmp_path):
+        """Un lote que falla por datos inesperados no detiene al hilo escritor"""
+        s = CountStore(path=str(tmp_path / 'counts.sqlite3'), flush_interval=0.05)
+        try:
+            with pytest.raises(ValueError):
+                s.record('cam1', {'person': 1}, ts=float('inf'))
+            s._pending.append(('cam1', t0, {'person': 'muchos'}))
+            s.start()
+            time.sleep(0.2)
+            s.record('cam1', {'person': 1}, ts=t0)
+            for _ in range(100):
+                if s.query(t0, t0 + 60)['rows']:
+                    break
+                time.sleep(0.02)
+            assert s._thread.is_alive()
+            assert s.query(t0, t0 + 60)['rows'] == [{'bucket': t0, 'class': 'person', 'count': 1, 'max': 1}]
+        finally:
+            s.stop()
+
+    def test_pending_is_bounded(self, tmp_path):
+        """Con el búfer lleno los registros se descartan y se cuentan"""
+        s = CountStore(path=str(tmp_path / 'counts.sqlite3'), flush_interval=60, max_pending=2)
+        for _ in range(5):
+            s.record('cam1', {'person': 1}, ts=t0)
+        assert s.dropped == 3
+        s.stop()
+
+    def test_auto_resolution(self):
+        """La resolución automática depende del largo del rango"""
+        assert auto_resolution(3600) == 'minute'
+        assert auto_resolution(3 * 86400) == 'hour'
+        assert auto_resolution(90 * 86400) == 'day'
@@ -0,0 +1,94 @@
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.evaluate import load_coco, evaluate, average_precision, parse_mode, run_mode
+
+class_names = ['person', 'bicycle', 'car']
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    # Tres imágenes con una persona y un auto cada una, más una región iscrowd en la primera
+    images, annotations = [], []
+    for i in range(3):
+        name = f'img{i}.png'
+        Image.new('RGB', (200, 100)).save(tmp_path / name)
+        images.append({'id': i + 1, 'file_name': name, 'width': 200, 'height': 100})
+        annotations.append({'image_id': i + 1, 'category_id': 1, 'bbox': [10, 10, 40, 60], 'iscrowd': 0})
+        annotations.append({'image_id': i + 1, 'category_id': 3, 'bbox': [100, 20, 80, 50], 'iscrowd': 0})
+    annotations.append({'image_id': 1, 'category_id': 1, 'bbox': [150, 0, 50, 20], 'iscrowd': 1})
+    categories = [{'id': 1, 'name': 'person'}, {'id': 3, 'name': 'car'}, {'id': 90, 'name': 'dragon'}]
+    path = tmp_path / 'anotaciones.json'
+    path.write_text(json.dumps({'images': images, 'annotations': annotations, 'categories': categories}))
+    return str(path), str(tmp_path)
+
+
+def perfect(gt):
+    return np.array([[0, x0, y0, x1, y1, cls, 0.9] for cls, x0, y0, x1, y1 in gt], dtype=np.float32)
+
+
+class TestMetrics:
+    """Pruebas de mAP y error de conteo"""
+
+    def test_perfect_predictions(self, dataset):
+        """Predicciones iguales a las anotaciones: mAP 1 y error de conteo 0"""
+        images, gts, crowds = load_coco(dataset[0], class_names)
+        assert [im['file_name'] for im in images] == ['img0.png', 'img1.png', 'img2.png']
+        assert gts[1][:, 0].tolist() == [0, 2] and len(crowds[1]) == 1
+        result = evaluate({k: perfect(g) for k, g in gts.items()}, gts, crowds, len(class_names))
+        assert result['map'] == pytest.approx(1.0)
+        assert result['count_mae'] == 0
+        assert set(result['classes']) == {0, 2}
+
+    def test_errors_lower_map_and_count(self, dataset):
+        """Cajas desplazadas bajan el mAP estricto; un falso positivo sube el error de conteo"""
+        images, gts, crowds = load_coco(dataset[0], class_names)
+        predictions = {k: perfect(g) for k, g in gts.items()}
+        predictions[2][:, [1, 3]] += 8  # IoU ~0.67 para la persona de la imagen 2
+        predictions[3] = np.vstack([predictions[3], [[0, 0, 0, 5, 5, 2, 0.95]]]).astype(np.float32)
+        # Una detección dentro de la región iscrowd no cuenta para el mAP
+        predictions[1] = np.vstack([predictions[1], [[0, 160, 2, 190, 18, 0, 0.99]]]).astype(np.float32)
+        result = evaluate(predictions, gts, crowds, len(class_names))
+        assert result['ap50'] < 1.0  # el falso positivo de mayor score
+        assert 0.5 < result['map'] < 0.95
+        assert result['classes'][0]['ap50'] == pytest.approx(1.0)
+        assert result['count_mae'] == pytest.approx(2 / 3)
+        assert result['classes'][2]['count_mae'] == pytest.approx(1 / 3)
+
+    def test_average_precision_interpolation(self):
+        """Con la mitad de los objetos encontrados sin falsos positivos, AP ~ 0.5"""
+        tp = np.ones((5, 10), dtype=bool)
+        ap = average_precision(np.linspace(0.9, 0.5, 5), tp, np.zeros_like(tp), n_gt=10)
+        assert ap == pytest.approx(np.full(10, 51 / 101))
+        assert np.isnan(average_precision(np.zeros(0), tp[:0], tp[:0], 0)).all()
+
+
+class TestModes:
+    """Pruebas de los modos de evaluación"""
+
+    def test_parse_mode(self):
+        """Las opciones se convierten al tipo esperado y las desconocidas se rechazan"""
+        assert parse_mode('r512=input_size=512,decode=full') == ('r512', {'input_size': 512, 'decode': 'full'})
+        assert parse_mode('base=') == ('base', {})
+        with pytest.raises(ValueError):
+            parse_mode('x=fp16=1')
+
+    def test_skip_reuses_previous_result(self, dataset):
+        """Con skip=2 solo se infiere una de cada dos imágenes"""
+        class FakeModel:
+            calls = 0
+            ratio, dwdh = 1.0, (0.0, 0.0)
+
+            def inference(self, img, scale=1.0):
+                FakeModel.calls += 1
+                return img, np.array([[0, 10, 10, 50, 70, 0, 0.9]], np.float32), {'person': 1}
+
+        images, _, _ = load_coco(dataset[0], class_names)
+        predictions, speed = run_mode(FakeModel(), images, dataset[1], {'skip': 2})
+        # Una llamada de calentamiento más las imágenes 0 y 2
+        assert FakeModel.calls == 3
+        assert predictions[2] is predictions[1]
+        assert speed['throughput'] > 0 and speed['p99_ms'] >= speed['p50_ms']
@@ -0,0 +1,108 @@
+import io
+
+import pytest
+from PIL import Image
+
+from app.imageprobe import probe, plan_decode, decode_image, frame_indices, read_frame, ImageInfo, ImageTooLarge, \
+    TooManyFrames
+
+
+def rotated_jpeg(size, orientation=6):
+    """JPEG con la mitad izquierda roja y la derecha azul tal como se almacena, con orientación EXIF"""
+    img = Image.new('RGB', size, color='blue')
+    img.paste('red', (0, 0, size[0] // 2, size[1]))
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    img_io = io.BytesIO()
+    img.save(img_io, format='JPEG', exif=exif)
+    img_io.seek(0)
+    return img_io
+
+
+def encode(size, format_name, **kwargs):
+    img_io = io.BytesIO()
+    Image.new('RGB', size, color='red').save(img_io, format=format_name, **kwargs)
+    img_io.seek(0)
+    return img_io
+
+
+class TestProbe:
+    """Pruebas de la lectura de encabezados"""
+
+    def test_probe_reads_header(self):
+        """Se obtienen formato, dimensiones y modo sin decodificar"""
+        info = probe(encode((320, 200), 'PNG'))
+        assert info == ImageInfo('PNG', 320, 200, 'RGB', 1)
+
+    def test_probe_counts_frames(self):
+        """Se cuenta el número de cuadros de un GIF animado"""
+        frames = [Image.new('RGB', (20, 20), color=c) for c in ('red', 'green', 'blue')]
+        img_io = io.BytesIO()
+        frames[0].save(img_io, format='GIF', save_all=True, append_images=frames[1:])
+        img_io.seek(0)
+        assert probe(img_io).frames == 3
+
+    def test_frames_read_in_order(self):
+        """Cada cuadro se lee por separado; el presupuesto cuenta solo los seleccionados"""
+        colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (0, 255, 255)]
+        frames = [Image.new('RGB', (20, 20), color=c) for c in colors]
+        img_io = io.BytesIO()
+        frames[0].save(img_io, format='GIF', save_all=True, append_images=frames[1:])
+        img_io.seek(0)
+        info = probe(img_io)
+        assert list(frame_indices(info, 2, budget=3)) == [0, 2, 4]
+        with pytest.raises(TooManyFrames):
+            frame_indices(info, 1, budget=3)
+        img_io.seek(0)
+        image = Image.open(img_io)
+        read = [read_frame(image, i) for i in frame_indices(info, 2)]
+        assert [frame.getpixel((5, 5)) for frame in read] == [colors[0], colors[2], colors[4]]
+
+
+    def test_exif_orientation(self):
+        """Las dimensiones se informan ya orientadas"""
+        info = probe(rotated_jpeg((400, 200)))
+        assert (info.width, info.height, info.orientation) == (200, 400, 6)
+
+
+class TestPlanDecode:
+    """Pruebas de la admisión por presupuesto de píxeles"""
+
+    def test_over_budget_rejected(self):
+        """Una imagen sobre el presupuesto se rechaza"""
+        with pytest.raises(ImageTooLarge):
+            plan_decode(ImageInfo('PNG', 20000, 20000, 'RGB', 1), budget=100_000_000)
+
+    def test_tiled_above_threshold(self):
+        """Sobre el umbral de mosaicos se elige la estrategia por mosaicos"""
+        plan = plan_decode(ImageInfo('PNG', 5000, 5000, 'RGB', 1), tile_threshold=16_000_000)
+        assert plan.strategy == 'tiled'
+
+    def test_reduced_jpeg_keeps_target(self):
+        """Un JPEG grande se decodifica reducido sin bajar del tamaño del modelo"""
+        plan = plan_decode(ImageInfo('JPEG', 4000, 3000, 'RGB', 1), target=640)
+        assert plan.strategy == 'reduced'
+        assert plan.draft_size == (1000, 750)
+
+    def test_png_full_decode(self):
+        """Los formatos sin decodificación reducida se decodifican completos"""
+        assert plan_decode(ImageInfo('PNG', 4000, 3000, 'RGB', 1)).strategy == 'full'
+
+    def test_roi_keeps_region_resolution(self):
+        """Con una ROI chica la decodificación reducida conserva su resolución"""
+        image, info, plan = decode_image(encode((4000, 3000), 'JPEG'), rois=[(0, 0, 1000, 500)])
+        assert plan.strategy == 'full'
+        assert image.size == (4000, 3000)
+        image, info, plan = decode_image(encode((4000, 3000), 'JPEG'), rois=[(0, 0, 2000, 1000)])
+        assert image.size == (2000, 1500)
+
+    @pytest.mark.parametrize('size', [(400, 200), (4000, 2000)])
+    def test_exif_rotated_decoded_upright(self, size):
+        """Un JPEG con orientación EXIF 6 se decodifica girado, también con decodificación reducida"""
+        image, info, plan = decode_image(rotated_jpeg(size))
+        width, height = image.size
+        assert height > width
+        assert image.size[0] / info.width == image.size[1] / info.height
+        red, blue = image.getpixel((width // 2, height // 8)), image.getpixel((width // 2, height * 7 // 8))
+        assert red[0] > 200 and red[2] < 50
+        assert blue[2] > 200 and blue[0] < 50
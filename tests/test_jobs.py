@@ -0,0 +1,156 @@
+import time
+import threading
+
+import pytest
+
+from app.jobs import JobQueue, JobStore
+
+
+class FakeUpload:
+    """Objeto con save() como FileStorage"""
+
+    def __init__(self, data=b'data'):
+        self.data = data
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.data)
+
+
+def fake_process(yolo, job):
+    return {'results': [{'filename': item['filename'], 'countings': {'person': 1}} for item in job['files']]}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = JobQueue(path=str(tmp_path / 'jobs.sqlite3'), spool_dir=str(tmp_path / 'files'),
+                 model_factory=lambda: None, workers=1, process=fake_process)
+    yield q
+    q.stop()
+
+
+class TestJobStore:
+    """Pruebas de la cola persistente"""
+
+    def test_claim_by_priority(self, tmp_path):
+        """Se reserva primero el trabajo de mayor prioridad"""
+        store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+        low, _ = store.add([], {}, priority=0)
+        high, _ = store.add([], {}, priority=10)
+        assert store.claim()['id'] == high['id']
+        assert store.claim()['id'] == low['id']
+        assert store.claim() is None
+
+    def test_requeue_after_restart(self, tmp_path):
+        """Solo los trabajos con el lease vencido vuelven a la cola al reabrir la base"""
+        path = str(tmp_path / 'jobs.sqlite3')
+        alive, _ = JobStore(path).add([], {}, priority=1)
+        dead, _ = JobStore(path).add([], {})
+        JobStore(path).claim('vivo', lease=60)
+        JobStore(path).claim('muerto', lease=-1)
+        store = JobStore(path)
+        assert store.requeue_expired() == 1
+        assert store.get(dead['id'])['status'] == 'queued'
+        assert store.get(alive['id'])['status'] == 'running'
+
+    def test_expired_lease_reclaimed(self, tmp_path):
+        """Otro proceso retoma un trabajo abandonado y el dueño anterior no pisa su resultado"""
+        store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+        job, _ = store.add([], {})
+        store.claim('a', lease=-1)
+        assert store.renew('a', lease=-1) == 1
+        retaken = store.claim('b')
+        assert retaken['id'] == job['id']
+        assert not store.finish(job['id'], result={'de': 'a'}, owner='a')
+        assert store.finish(job['id'], result={'de': 'b'}, owner='b')
+        assert store.get(job['id'])['result'] == {'de': 'b'}
+
+    def test_max_attempts(self, tmp_path):
+        """Un trabajo que mata a cada proceso que lo toma se marca fallido al agotar los intentos"""
+        store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+        job, _ = store.add([], {})
+        for owner in ('a', 'b'):
+            assert store.claim(owner, lease=-1, attempts=2)['id'] == job['id']
+        assert store.claim('c', attempts=2) is None
+        failed = store.get(job['id'])
+        assert failed['status'] == 'failed'
+        assert '2 intentos' in failed['error']
+
+    def test_result_expires(self, tmp_path):
+        """Un resultado con TTL vencido deja de estar disponible"""
+        store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+        job, _ = store.add([], {})
+        store.finish(job['id'], result={'ok': True}, ttl=-1)
+        assert store.get(job['id']) is None
+        assert [job_id for job_id, _ in store.expire()] == [job['id']]
+
+
+class TestJobQueue:
+    """Pruebas del procesamiento asíncrono"""
+
+    def test_submit_and_wait(self, queue):
+        """Un trabajo encolado se procesa y el long polling devuelve el resultado"""
+        queue.start()
+        job, created = queue.submit([('a.jpg', FakeUpload()), ('b.jpg', FakeUpload())], {})
+        assert created
+        done = queue.wait(job['id'], timeout=10)
+        assert done['status'] == 'done'
+        assert [r['filename'] for r in done['result']['results']] == ['a.jpg', 'b.jpg']
+
+    def test_idempotency_key(self, queue):
+        """La misma clave devuelve el mismo trabajo sin reprocesar"""
+        calls = []
+        queue.process = lambda yolo, job: calls.append(job['id']) or {}
+        queue.start()
+        first, created = queue.submit([('a.jpg', FakeUpload())], {}, idempotency_key='abc')
+        queue.wait(first['id'], timeout=10)
+        second, created_again = queue.submit([('a.jpg', FakeUpload())], {}, idempotency_key='abc')
+        assert created and not created_again
+        assert second['id'] == first['id']
+        assert calls == [first['id']]
+
+    def test_restart_keeps_running_jobs(self, tmp_path):
+        """Arrancar otra cola sobre la misma base no reencola un trabajo que sigue en curso"""
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow(yolo, job):
+            calls.append(job['id'])
+            started.set()
+            release.wait(10)
+            return {}
+
+        kwargs = dict(path=str(tmp_path / 'jobs.sqlite3'), spool_dir=str(tmp_path / 'files'),
+                      model_factory=lambda: None, workers=1, process=slow, lease=0.3)
+        first, second = JobQueue(**kwargs), JobQueue(**kwargs)
+        try:
+            first.start()
+            job, _ = first.submit([('a.jpg', FakeUpload())], {})
+            assert started.wait(10)
+            second.start()
+            time.sleep(1.0)  # varios períodos de lease: el dueño lo renueva
+            release.set()
+            assert first.wait(job['id'], timeout=10)['status'] == 'done'
+            assert calls == [job['id']]
+        finally:
+            release.set()
+            first.stop()
+            second.stop()
+
+    def test_wait_not_finite(self, queue):
+        """wait con nan vuelve enseguida en lugar de esperar para siempre"""
+        job, _ = queue.submit([('a.jpg', FakeUpload())], {})
+        start = time.time()
+        assert queue.wait(job['id'], timeout=float('nan'))['status'] == 'queued'
+        assert time.time() - start < 1
+
+    def test_failed_job(self, queue):
+        """Un error en el procesamiento marca el trabajo como fallido"""
+        def failing(yolo, job):
+            raise ValueError('imagen corrupta')
+        queue.process = failing
+        queue.start()
+        job, _ = queue.submit([('a.jpg', FakeUpload())], {})
+        done = queue.wait(job['id'], timeout=10)
+        assert done['status'] == 'failed'
+        assert 'corrupta' in done['error']
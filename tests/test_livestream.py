@@ -0,0 +1,70 @@
+import threading
+
+from app.livestream import FrameBroadcast
+
+
+def renderer(calls, name):
+    def render():
+        calls.append(name)
+        return name.encode()
+    return render
+
+
+class TestFrameBroadcast:
+    """Pruebas de la difusión del último cuadro anotado"""
+
+    def test_encoded_once_for_all_viewers(self):
+        """Con varios espectadores cada cuadro se dibuja y codifica una sola vez"""
+        broadcast, calls = FrameBroadcast(), []
+        viewers = [broadcast.frames() for _ in range(8)]
+        results = [None] * len(viewers)
+
+        def watch(i):
+            results[i] = next(viewers[i])
+
+        threads = [threading.Thread(target=watch, args=(i,)) for i in range(len(viewers))]
+        for t in threads:
+            t.start()
+        broadcast.publish(renderer(calls, 'cuadro-1'))
+        for t in threads:
+            t.join(5)
+        assert calls == ['cuadro-1']
+        assert all(r.endswith(b'cuadro-1\r\n') for r in results)
+        assert broadcast.stats() == {'viewers': 8, 'published': 1, 'encoded': 1}
+        for viewer in viewers:
+            viewer.close()
+        assert broadcast.viewers == 0
+
+    def test_slow_viewer_gets_newest(self):
+        """Un espectador lento salta los cuadros intermedios, que nunca se codifican"""
+        broadcast, calls = FrameBroadcast(), []
+        broadcast.publish(renderer(calls, 'c1'))
+        assert broadcast.latest(0) == (1, b'c1')
+        for name in ('c2', 'c3', 'c4'):
+            broadcast.publish(renderer(calls, name))
+        assert broadcast.latest(1) == (4, b'c4')
+        assert calls == ['c1', 'c4']
+
+    def test_no_frames_without_viewers_and_close(self):
+        """Sin espectadores no se codifica; al cerrar los espectadores terminan"""
+        broadcast, calls = FrameBroadcast(), []
+        broadcast.publish(renderer(calls, 'c1'))
+        assert calls == []
+        assert broadcast.latest(1, timeout=0.01) is None
+        viewer = broadcast.frames()
+        closer = threading.Timer(0.05, broadcast.close)
+        closer.start()
+        assert next(viewer).endswith(b'c1\r\n')
+        assert list(viewer) == []
+
+    def test_keepalive_resends_last_frame(self):
+        """Sin cuadros nuevos se reenvía el último cada keepalive; antes del primero, un CRLF"""
+        broadcast, calls = FrameBroadcast(), []
+        viewer = broadcast.frames(keepalive=0.01)
+        assert next(viewer) == b'\r\n'
+        broadcast.publish(renderer(calls, 'c1'))
+        first, again = next(viewer), next(viewer)
+        assert first == again and first.endswith(b'c1\r\n')
+        assert calls == ['c1']
+        viewer.close()
+        assert broadcast.viewers == 0
@@ -0,0 +1,45 @@
+import pytest
+
+from app.loadtest import parse_weighted, parse_server, build_image_mix, ImageMix, Recorder, summarize, default_command
+
+
+class TestLoadtestHelpers:
+    """Pruebas de las utilidades del generador de carga"""
+
+    def test_parse_weighted(self):
+        """Prueba el formato valor:peso"""
+        assert parse_weighted('foto.jpg:3') == ('foto.jpg', 3.0)
+        assert parse_weighted('foto.jpg') == ('foto.jpg', 1.0)
+        assert parse_weighted('C:/imagenes/foto.jpg') == ('C:/imagenes/foto.jpg', 1.0)
+
+    def test_parse_server_env_and_default_command(self):
+        """Prueba que las variables de entorno se separen del comando"""
+        name, env, command = parse_server('hilos=YOLO_ORT_THREADS=2')
+        assert name == 'hilos'
+        assert env == {'YOLO_ORT_THREADS': '2'}
+        assert command == default_command
+
+    def test_parse_server_custom_command(self):
+        """Prueba un comando personalizado"""
+        name, env, command = parse_server('gunicorn=gunicorn -b 127.0.0.1:{port} application:application')
+        assert env == {}
+        assert command.startswith('gunicorn')
+
+    def test_image_mix_weights(self):
+        """Prueba que la mezcla respete los pesos"""
+        mix = ImageMix(build_image_mix(None, ['64x48:9', '32x32:1']))
+        sampler = mix.sampler(0)
+        names = [next(sampler)[0] for _ in range(1000)]
+        assert names.count('synthetic_64x48.jpg') > 800
+
+    def test_summarize(self):
+        """Prueba el resumen de latencias y errores"""
+        recorder = Recorder()
+        for i in range(99):
+            recorder.add(0.01 * (i + 1), True)
+        recorder.add(5.0, False)
+        summary = summarize(recorder, elapsed=10.0)
+        assert summary['requests'] == 100
+        assert summary['throughput'] == pytest.approx(9.9)
+        assert summary['error_rate'] == pytest.approx(0.01)
+        assert summary['p50_ms'] == pytest.approx(500, rel=0.01)
@@ -0,0 +1,155 @@
+import io
+import tracemalloc
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.memprof import MemoryTracker, rss
+from app.yolocounterv1 import YoloOnnx
+
+# Entrada del modelo: 1x3x640x640 float32
+blob_bytes = 3 * 640 * 640 * 4
+canvas_bytes = 640 * 640 * 3
+
+
+class Node:
+    def __init__(self, name, shape):
+        self.name, self.shape = name, shape
+
+
+class FakeSession:
+    """Sesión ONNX sintética: 20 detecciones fijas por imagen"""
+
+    def get_inputs(self):
+        return [Node('images', ['batch', 3, 640, 640])]
+
+    def get_outputs(self):
+        return [Node('output', ['n', 7])]
+
+    def run(self, names, feed):
+        rows = np.array([[0, 100, 100, 200, 200, 0, 0.9]], np.float32)
+        return [np.repeat(rows, 20 * feed['images'].shape[0], axis=0)]
+
+
+def synthetic_model():
+    yolo = YoloOnnx.__new__(YoloOnnx)
+    yolo.session = FakeSession()
+    yolo.class_names = ['person']
+    yolo.colors = {'person': [255, 0, 0]}
+    yolo.input_name, yolo.output_names = 'images', ['output']
+    yolo.dynamic_batch = True
+    return yolo
+
+
+@pytest.fixture
+def tracing():
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(1)
+    yield
+    if started:
+        tracemalloc.stop()
+
+
+class TestMemoryTracker:
+    """Pruebas de la medición por sección"""
+
+    def test_nested_sections_propagate_peak(self, tracing):
+        """El pico de una sección anidada se refleja en la que la contiene"""
+        tracker = MemoryTracker()
+        with tracker.measure('outer') as outer:
+            with tracker.measure('inner') as inner:
+                data = np.ones(8 * 1024 * 1024, np.uint8)
+                del data
+        assert inner['py_peak'] >= 8 * 1024 * 1024
+        assert outer['py_peak'] >= inner['py_peak']
+        assert abs(outer['py_net']) < 1024 * 1024
+        assert set(tracker.summary()['sections']) == {'outer', 'inner'}
+
+    def test_top_allocations_show_growth(self, tracing):
+        """Los sitios que retienen memoria aparecen en el diff desde el arranque"""
+        tracker = MemoryTracker()
+        retained = [bytearray(1024) for _ in range(2000)]
+        sites = tracker.top_allocations(limit=5)
+        assert any('test_memprof.py' in s['site'] and s['size_diff'] >= 2000 * 1024 for s in sites)
+        del retained
+
+    def test_without_tracemalloc(self):
+        """Sin tracemalloc solo se mide RSS"""
+        if tracemalloc.is_tracing():
+            pytest.skip('tracemalloc activo en esta sesión')
+        tracker = MemoryTracker(frames=0)
+        with tracker.measure('x') as record:
+            pass
+        assert 'py_peak' not in record and record['peak_rss'] > 0
+        assert tracker.top_allocations() is None
+
+
+class TestMemoryBudget:
+    """Miles de inferencias sintéticas: RSS estable y asignaciones acotadas"""
+
+    def test_inference_rss_plateaus(self):
+        """Tras el calentamiento la RSS deja de crecer"""
+        yolo = synthetic_model()
+        img = np.random.default_rng(0).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+        samples = []
+        for i in range(3000):
+            _, outputs, _ = yolo.inference(img)
+            yolo.to_detections(outputs)
+            if i % 500 == 499:
+                samples.append(rss())
+        # Entre la segunda muestra y la última no debe haber crecimiento sostenido
+        assert samples[-1] - samples[1] < 4 * 1024 * 1024
+
+    def test_inference_allocation_budget(self, tracing):
+        """Cada inferencia asigna a lo sumo la entrada del modelo y un lienzo extra"""
+        yolo = synthetic_model()
+        img = np.random.default_rng(0).integers(0, 256, (1080, 1920, 3), dtype=np.uint8)
+        tracker = MemoryTracker()
+        for _ in range(50):
+            yolo.inference(img)
+        records = []
+        for _ in range(500):
+            with tracker.measure('inference') as record:
+                _, outputs, _ = yolo.inference(img)
+                yolo.to_detections(outputs)
+            records.append(record)
+        assert np.median([r['py_peak'] for r in records]) < blob_bytes + 1.3 * canvas_bytes
+        assert np.mean([r['py_net'] for r in records]) < 4096
+
+    def test_predict_requests_plateau(self, client):
+        """predict() completo (subida, decodificación, respuesta) no acumula memoria"""
+        img_io = io.BytesIO()
+        Image.new('RGB', (640, 480), color='red').save(img_io, format='JPEG')
+        data = img_io.getvalue()
+        samples = []
+        with patch('app.application.yolo', synthetic_model()), patch('app.application.count_store', None):
+            for i in range(1500):
+                response = client.post('/detect-count', data={'image': (io.BytesIO(data), 'test.jpg')})
+                assert response.status_code == 200
+                if i % 300 == 299:
+                    samples.append(rss())
+        assert samples[-1] - samples[1] < 4 * 1024 * 1024
+
+
+class TestAdminMemoryRoute:
+    """Pruebas del endpoint de memoria"""
+
+    @patch('app.application.admin_token', None)
+    def test_admin_disabled_without_token(self, client):
+        """Sin YOLO_ADMIN_TOKEN el endpoint queda cerrado, también para peticiones locales o de un proxy"""
+        assert client.get('/admin/memory').status_code == 403
+        assert client.get('/admin/memory', environ_base={'REMOTE_ADDR': '127.0.0.1'},
+                          headers={'X-Forwarded-For': '203.0.113.7'}).status_code == 403
+
+    @patch('app.application.admin_token', 'secreto')
+    def test_admin_memory_requires_token(self, client):
+        """Con YOLO_ADMIN_TOKEN se exige el encabezado"""
+        assert client.get('/admin/memory').status_code == 403
+        assert client.get('/admin/memory', headers={'X-Admin-Token': 'otro'}).status_code == 403
+        response = client.get('/admin/memory?limit=5', headers={'X-Admin-Token': 'secreto'})
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['rss'] > 0 and 'sections' in data
@@ -0,0 +1,147 @@
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from app.boxes import assign_regions, mosaic_cells, mosaic_grid
+from app.yolocounterv1 import YoloOnnx
+
+
+class Node:
+    def __init__(self, name, shape):
+        self.name, self.shape = name, shape
+
+
+class BlobSession:
+    """Sesión ONNX sintética: detecta cada rectángulo claro de la entrada como 'person'"""
+
+    def __init__(self, batch='batch'):
+        self.batch = batch
+        self.calls = 0
+
+    def get_inputs(self):
+        return [Node('images', [self.batch, 3, 640, 640])]
+
+    def get_outputs(self):
+        return [Node('output', ['n', 7])]
+
+    def run(self, names, feed):
+        self.calls += 1
+        rows = []
+        for b, im in enumerate(feed['images']):
+            mask = (im.min(axis=0) > 0.9).astype(np.uint8)
+            n, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+            for x, y, w, h, _ in stats[1:n]:
+                rows.append([b, x, y, x + w, y + h, 0, 0.9])
+        return [np.array(rows, np.float32).reshape(-1, 7)]
+
+
+def synthetic_model(batch='batch'):
+    yolo = YoloOnnx.__new__(YoloOnnx)
+    yolo.session = BlobSession(batch)
+    yolo.class_names = ['person']
+    yolo.colors = {'person': [255, 0, 0]}
+    yolo.input_name, yolo.output_names = 'images', ['output']
+    yolo.dynamic_batch = not isinstance(batch, int)
+    return yolo
+
+
+def thumbnail(width, height, box):
+    img = np.full((height, width, 3), 40, np.uint8)
+    x0, y0, x1, y1 = box
+    img[y0:y1, x0:x1] = 255
+    return img
+
+
+thumbnails = [
+    (thumbnail(200, 150, (20, 30, 80, 100)), (20, 30, 80, 100)),
+    (thumbnail(120, 180, (50, 10, 110, 60)), (50, 10, 110, 60)),
+    (thumbnail(192, 192, (100, 100, 180, 170)), (100, 100, 180, 170)),
+    (thumbnail(64, 48, (8, 8, 40, 40)), (8, 8, 40, 40)),
+]
+
+
+class TestMosaic:
+    """Pruebas del empaquetado de miniaturas en un mismo lienzo de entrada"""
+
+    def test_cells_and_grid(self):
+        """Las celdas no se solapan y quedan separadas por el relleno"""
+        cells = mosaic_cells(2, (640, 640), 16)
+        assert cells == [(0, 0, 312, 312), (328, 0, 640, 312), (0, 328, 312, 640), (328, 328, 640, 640)]
+        assert [mosaic_grid(n, 3) for n in (1, 2, 4, 5, 9, 12)] == [1, 2, 2, 3, 3, 3]
+        dets = np.array([[0, 10, 10, 50, 50, 0, 1], [0, 300, 300, 340, 340, 0, 1], [0, 600, 10, 630, 40, 0, 1]])
+        assert assign_regions(dets, cells).tolist() == [0, -1, 1]
+
+    def test_boxes_map_back_to_each_image(self):
+        """Las cajas del lienzo vuelven a las coordenadas de cada miniatura"""
+        yolo = synthetic_model()
+        yolo.input_shape = (640, 640)
+        blob, metas = yolo.pack([img for img, _ in thumbnails], 2)
+        assert blob.shape == (1, 3, 640, 640)
+        dets = yolo.split_mosaic(yolo.run(blob), metas)
+        for (_, box), out in zip(thumbnails, dets):
+            assert len(out) == 1
+            np.testing.assert_allclose(out[0, 1:5], box, atol=2)
+
+    @pytest.mark.parametrize('batch', ['batch', 1])
+    def test_pipeline_single_run(self, batch):
+        """Con mosaic=2 cuatro miniaturas van en un solo session.run, aun con lote fijo"""
+        yolo = synthetic_model(batch)
+        yolo.input_shape, yolo.batch_size = (640, 640), 4
+        pipeline = yolo.make_pipeline(mosaic=2)
+        results = list(pipeline.map([img for img, _ in thumbnails]))
+        assert yolo.session.calls == 1
+        for (_, box), out in zip(thumbnails, results):
+            assert out['countings'] == {'person': 1}
+            np.testing.assert_allclose(out['outputs'][0, 1:5], box, atol=2)
+
+    def test_large_images_not_packed(self):
+        """Las imágenes que no caben en una celda siguen el camino normal"""
+        yolo = synthetic_model()
+        yolo.input_shape, yolo.batch_size = (640, 640), 4
+        big = thumbnail(800, 600, (100, 100, 400, 300))
+        results = list(yolo.make_pipeline(mosaic=3).map([big, thumbnails[0][0]]))
+        np.testing.assert_allclose(results[0]['outputs'][0, 1:5], (100, 100, 400, 300), atol=2)
+        np.testing.assert_allclose(results[1]['outputs'][0, 1:5], thumbnails[0][1], atol=2)
+
+
+class TestTiledInput:
+    """Pruebas de la inferencia por mosaicos sobre una imagen PIL sin copiarla entera"""
+
+    def test_pil_matches_array(self):
+        """Recortar la imagen PIL por mosaico da las mismas cajas que el arreglo completo"""
+        from PIL import Image
+        yolo = synthetic_model()
+        img = np.full((1500, 2000, 3), 40, np.uint8)
+        img[300:380, 1500:1560] = 255
+        img[1000:1100, 200:300] = 255
+        _, expected, counts = yolo.inference_tiled(img)
+        returned, outputs, pil_counts = yolo.inference_tiled(Image.fromarray(img).convert('L'))
+        assert isinstance(returned, Image.Image)
+        assert pil_counts == counts == {'person': 2}
+        order = np.argsort(expected[:, 1])
+        np.testing.assert_allclose(outputs[np.argsort(outputs[:, 1])][:, 1:5], expected[order][:, 1:5], atol=2)
+
+
+class TestConcurrentInference:
+    """Pruebas de la instancia compartida entre hilos"""
+
+    def test_letterbox_per_thread(self):
+        """Cada hilo convierte sus cajas con su propio letterbox aunque otro infiera en el medio"""
+        yolo = synthetic_model()
+        barrier = threading.Barrier(2)
+        results = {}
+
+        def run(name, img, box):
+            _, outputs, _ = yolo.inference(img)
+            barrier.wait(5)  # las dos inferencias terminan antes de convertir
+            results[name] = (yolo.convertbox(list(outputs[0][1:5])), box)
+
+        threads = [threading.Thread(target=run, args=(i, img, box)) for i, (img, box) in enumerate(thumbnails[:2])]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for converted, box in results.values():
+            assert np.abs(np.array(converted) - box).max() <= 2
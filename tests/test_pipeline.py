@@ -0,0 +1,55 @@
+import time
+
+from app.pipeline import Pipeline, Stage, Failed
+
+
+def make_pipeline(delay=0.0, batch_size=1):
+    def slow_square(items):
+        time.sleep(delay)
+        return [x * x for x in items]
+
+    return Pipeline([
+        Stage('decode', lambda x: x + 1, workers=3),
+        Stage('infer', slow_square, batch_size=batch_size),
+        Stage('post', str),
+    ], maxsize=2)
+
+
+class TestPipeline:
+    """Pruebas del motor de etapas con colas acotadas"""
+
+    def test_results_keep_input_order(self):
+        """Los resultados salen en el orden de entrada aunque haya varios hilos por etapa"""
+        pipeline = make_pipeline(batch_size=4)
+        assert list(pipeline.map(range(50))) == [str((x + 1) ** 2) for x in range(50)]
+
+    def test_error_only_fails_its_item(self):
+        """Un error en una etapa se entrega como Failed y el resto continúa"""
+        def decode(x):
+            if x == 3:
+                raise ValueError('corrupta')
+            return x
+
+        pipeline = Pipeline([Stage('decode', decode), Stage('post', lambda x: x * 10)])
+        results = list(pipeline.map(range(5)))
+        assert isinstance(results[3], Failed)
+        assert str(results[3].error) == 'corrupta'
+        assert [r for i, r in enumerate(results) if i != 3] == [0, 10, 20, 40]
+
+    def test_batch_stage_groups_items(self):
+        """La etapa por lotes agrupa elementos cuando la entrada se adelanta"""
+        pipeline = make_pipeline(delay=0.01, batch_size=4)
+        list(pipeline.map(range(40)))
+        stats = pipeline.stats()
+        assert stats['stages']['infer']['items'] == 40
+        assert stats['stages']['infer']['avg_batch'] > 1
+        assert stats['bottleneck'] == 'infer'
+
+    def test_early_close_stops_workers(self):
+        """Abandonar el generador cancela la alimentación sin bloquear hilos"""
+        pipeline = make_pipeline(delay=0.001, batch_size=2)
+        results = pipeline.map(iter(range(10_000)))
+        assert next(results) == '1'
+        results.close()
+        # La instancia se puede reutilizar después de cancelar
+        assert list(pipeline.map([1, 2])) == ['4', '9']
@@ -0,0 +1,84 @@
+import threading
+
+import numpy as np
+import pytest
+
+from app.yolocounterv1 import YoloOnnx
+
+
+@pytest.fixture
+def yolo():
+    # preprocess y letterbox no usan la sesión ONNX
+    return YoloOnnx.__new__(YoloOnnx)
+
+
+def reference(yolo, img):
+    # Camino original: letterbox con copyMakeBorder, transpose, astype y /255
+    image, ratio, dwdh = yolo.letterbox(img, auto=False)
+    im = np.ascontiguousarray(np.expand_dims(image.transpose((2, 0, 1)), 0)).astype(np.float32)
+    im /= 255
+    return im, ratio, dwdh
+
+
+class TestFusedPreprocess:
+    """Pruebas del preprocesamiento fusionado"""
+
+    @pytest.mark.parametrize('shape', [(480, 640), (640, 640), (639, 640), (333, 777), (3000, 4000), (50, 20)])
+    def test_matches_letterbox_path(self, yolo, shape):
+        """El resultado es idéntico al de letterbox + transpose + normalización"""
+        img = np.random.default_rng(0).integers(0, 256, shape + (3,), dtype=np.uint8)
+        im, ratio, dwdh = yolo.preprocess(img)
+        expected, expected_ratio, expected_dwdh = reference(yolo, img)
+        assert im.dtype == np.float32 and im.flags['C_CONTIGUOUS']
+        assert np.array_equal(im, expected)
+        assert (ratio, dwdh) == (expected_ratio, expected_dwdh)
+
+    def test_canvas_reused_across_geometries(self, yolo):
+        """Alternar tamaños no deja restos de la imagen anterior en el relleno"""
+        white = np.full((640, 640, 3), 255, np.uint8)
+        wide = np.zeros((320, 640, 3), np.uint8)
+        yolo.preprocess(white)
+        im, _, _ = yolo.preprocess(wide)
+        assert np.array_equal(im, reference(yolo, wide)[0])
+
+    def test_results_do_not_share_memory(self, yolo):
+        """Cada llamada devuelve un arreglo nuevo aunque el lienzo se reutilice"""
+        a, _, _ = yolo.preprocess(np.zeros((100, 100, 3), np.uint8))
+        b, _, _ = yolo.preprocess(np.full((100, 100, 3), 255, np.uint8))
+        assert a.max() == 0 and b.min() > 0
+
+    def test_thread_safe(self, yolo):
+        """Hilos concurrentes usan lienzos distintos"""
+        imgs = [np.full((200 + 40 * i, 300, 3), 25 * i, np.uint8) for i in range(6)]
+        expected = [reference(yolo, img)[0] for img in imgs]
+        errors = []
+
+        def work(i):
+            for _ in range(20):
+                if not np.array_equal(yolo.preprocess(imgs[i])[0], expected[i]):
+                    errors.append(i)
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not errors
+
+
+class TestRawInput:
+    """Pruebas de la entrada BGR y ya letterboxeada"""
+
+    def test_bgr_reverses_planes(self, yolo):
+        """Un cuadro BGR da la misma entrada que su versión RGB"""
+        img = np.random.default_rng(1).integers(0, 256, (300, 500, 3), dtype=np.uint8)
+        rgb, _, _ = yolo.preprocess(img)
+        bgr, _, _ = yolo.preprocess(np.ascontiguousarray(img[..., ::-1]), bgr=True)
+        assert np.array_equal(rgb, bgr)
+
+    def test_letterboxed_float_input(self, yolo):
+        """Una entrada ya letterboxeada en float32 solo cambia de disposición"""
+        img = np.random.default_rng(2).integers(0, 256, (640, 640, 3), dtype=np.uint8)
+        expected, _, _ = yolo.preprocess(img)
+        assert np.array_equal(yolo.to_blob(img), expected)
+        assert np.allclose(yolo.to_blob(img.astype(np.float32) / 255), expected)
@@ -0,0 +1,116 @@
+import time
+import threading
+
+import pytest
+
+from app.qos import QosScheduler, QueueTimeout, parse_limits, resolve_class
+
+
+def hold(scheduler, qos_class, started, release, order):
+    with scheduler.slot(qos_class):
+        order.append(qos_class)
+        started.set()
+        release.wait(5)
+
+
+def queue_behind(scheduler, classes):
+    # Ocupa el único slot, encola las clases en orden y libera: devuelve el orden de servicio
+    started, release = threading.Event(), threading.Event()
+    order = []
+    threads = [threading.Thread(target=hold, args=(scheduler, 'standard', started, release, order))]
+    threads[0].start()
+    started.wait(5)
+    for qos_class in classes:
+        t = threading.Thread(target=hold, args=(scheduler, qos_class, threading.Event(), release, order))
+        t.start()
+        threads.append(t)
+        while len(scheduler.waiting) < len(threads) - 1:
+            time.sleep(0.001)
+    release.set()
+    for t in threads:
+        t.join(5)
+    return order[1:]
+
+
+class TestQosScheduler:
+    """Pruebas de la cola con prioridades para el modelo compartido"""
+
+    def test_strict_priority(self):
+        """Con el slot ocupado, interactive pasa antes que standard y bulk aunque llegue último"""
+        scheduler = QosScheduler(slots=1, limits={}, aging=0, timeout=5)
+        assert queue_behind(scheduler, ['bulk', 'standard', 'interactive']) == ['interactive', 'standard', 'bulk']
+
+    def test_aging_promotes_old_requests(self):
+        """Una petición bulk que esperó lo suficiente pasa delante de una interactive nueva"""
+        scheduler = QosScheduler(slots=1, limits={}, aging=0.05, timeout=5)
+        started, release = threading.Event(), threading.Event()
+        order = []
+        blocker = threading.Thread(target=hold, args=(scheduler, 'standard', started, release, order))
+        blocker.start()
+        started.wait(5)
+        old = threading.Thread(target=hold, args=(scheduler, 'bulk', threading.Event(), release, order))
+        old.start()
+        time.sleep(0.2)
+        new = threading.Thread(target=hold, args=(scheduler, 'interactive', threading.Event(), release, order))
+        new.start()
+        while len(scheduler.waiting) < 2:
+            time.sleep(0.001)
+        release.set()
+        for t in (blocker, old, new):
+            t.join(5)
+        assert order == ['standard', 'bulk', 'interactive']
+
+    def test_limits_and_reserved_share(self):
+        """bulk respeta su límite y nadie más que interactive usa los slots reservados"""
+        scheduler = QosScheduler(slots=4, limits={'bulk': 1}, reserved=0.25, aging=0, timeout=0.05)
+        with scheduler.slot('bulk'):
+            with pytest.raises(QueueTimeout):
+                with scheduler.slot('bulk'):
+                    pass
+            with scheduler.slot('standard'), scheduler.slot('standard'):
+                # 3 de 4 slots ocupados por no interactivos: el que queda es reservado
+                with pytest.raises(QueueTimeout):
+                    with scheduler.slot('standard'):
+                        pass
+                with scheduler.slot('interactive') as ticket:
+                    assert ticket['class'] == 'interactive'
+        stats = scheduler.stats()
+        assert stats['reserved_interactive'] == 1
+        assert stats['classes']['bulk']['timeouts'] == 1
+        assert stats['classes']['standard']['served'] == 2
+        assert stats['classes']['interactive']['wait_p99_ms'] >= 0
+        assert all(row['running'] == 0 and row['waiting'] == 0 for row in stats['classes'].values())
+
+    def test_single_slot_never_fully_reserved(self):
+        """Con un solo slot no hay reserva: las demás clases no quedan bloqueadas"""
+        scheduler = QosScheduler(slots=1, reserved=0.5, timeout=0.05)
+        with scheduler.slot('bulk'):
+            pass
+        assert scheduler.reserved == 0
+
+    def test_reserved_slot_with_two_slots(self):
+        """Con dos slots uno queda reservado: standard no ocupa el segundo"""
+        scheduler = QosScheduler(slots=2, reserved=0.25, aging=0, timeout=0.05)
+        assert scheduler.reserved == 1
+        with scheduler.slot('standard'):
+            with pytest.raises(QueueTimeout):
+                with scheduler.slot('standard'):
+                    pass
+            with scheduler.slot('interactive') as ticket:
+                assert ticket['class'] == 'interactive'
+
+    def test_resolve_class(self):
+        """La API key fija un techo de prioridad; el encabezado solo puede bajarla y sin clave se ignora"""
+        keys = {'k-nightly': 'bulk', 'k-ui': 'interactive'}
+        assert resolve_class('interactive', 'k-nightly', keys) == 'bulk'
+        assert resolve_class('bulk', 'k-ui', keys) == 'bulk'
+        assert resolve_class(None, 'k-ui', keys) == 'interactive'
+        assert resolve_class(None, 'desconocida', keys) == 'bulk'
+        assert resolve_class('Interactive', 'k-ui', keys) == 'interactive'
+        assert resolve_class('interactive', None, keys) == 'standard'
+        assert resolve_class('interactive', 'desconocida', keys) == 'bulk'
+        with pytest.raises(ValueError):
+            resolve_class('urgente')
+        assert parse_limits('bulk:1, standard:2') == {'bulk': 1, 'standard': 2}
+        with pytest.raises(ValueError):
+            parse_limits('vip:3')
@@ -0,0 +1,67 @@
+import cv2
+import numpy as np
+import pytest
+
+from app.imageprobe import ImageTooLarge
+from app.rawframes import parse_frame_spec, decode_frame, frame_bytes
+
+
+def spec(**headers):
+    return parse_frame_spec({f'X-{k.replace("_", "-")}': v for k, v in headers.items()}, {})
+
+
+class TestRawFrames:
+    """Pruebas de los cuadros crudos"""
+
+    def test_parse_headers_and_query(self):
+        """La forma, el tipo y el letterbox se leen de encabezados o de la query"""
+        s = spec(Frame_Format='BGR', Frame_Shape='480,640,3')
+        assert (s.format, s.height, s.width, s.dtype, s.letterbox) == ('bgr', 480, 640, 'uint8', None)
+        s = parse_frame_spec({}, {'frame_format': 'rgb', 'frame_shape': '640x640', 'frame_dtype': 'float32',
+                                  'letterbox': '0.5,0,80'})
+        assert s.letterbox == (0.5, (0.0, 80.0)) and frame_bytes(s) == 640 * 640 * 3 * 4
+
+    @pytest.mark.parametrize('headers', [
+        {'Frame_Format': 'yuv420', 'Frame_Shape': '4,4'},
+        {'Frame_Format': 'rgb', 'Frame_Shape': '4,4,4'},
+        {'Frame_Format': 'rgb'},
+        {'Frame_Format': 'nv12', 'Frame_Shape': '5,4'},
+        {'Frame_Format': 'rgb', 'Frame_Shape': '4,4', 'Frame_Dtype': 'float32'},
+        {'Frame_Format': 'rgb', 'Frame_Shape': '4,4', 'Letterbox': '0.5,1'},
+        {'Frame_Format': 'rgb', 'Frame_Shape': '4,4', 'Letterbox': 'nan,0,0'},
+        {'Frame_Format': 'rgb', 'Frame_Shape': '4,4', 'Letterbox': 'inf,0,0'},
+        {'Frame_Format': 'rgb', 'Frame_Shape': '4,4', 'Letterbox': '0.5,nan,0'},
+    ])
+    def test_invalid_spec(self, headers):
+        """Formatos, formas o tipos inválidos se rechazan"""
+        with pytest.raises(ValueError):
+            spec(**headers)
+
+    def test_rgb_without_copy_and_length_check(self):
+        """RGB/BGR se interpretan sin copiar; un largo incorrecto es un error"""
+        data = np.arange(4 * 6 * 3, dtype=np.uint8).tobytes()
+        frame, bgr = decode_frame(data, spec(Frame_Format='bgr', Frame_Shape='4,6'))
+        assert frame.shape == (4, 6, 3) and bgr
+        assert not frame.flags.owndata
+        with pytest.raises(ValueError):
+            decode_frame(data[:-1], spec(Frame_Format='rgb', Frame_Shape='4,6'))
+
+    def test_nv12_to_rgb(self):
+        """NV12 se convierte a RGB igual que OpenCV"""
+        # Bloques de 2x2 de un color: el submuestreo de croma no pierde información
+        blocks = np.random.default_rng(0).integers(16, 240, (4, 6, 3), dtype=np.uint8)
+        rgb = blocks.repeat(2, axis=0).repeat(2, axis=1)
+        i420 = cv2.cvtColor(rgb, cv2.COLOR_RGB2YUV_I420)
+        y, u, v = i420[:8], i420[8:10].reshape(-1), i420[10:].reshape(-1)
+        nv12 = np.concatenate([y.reshape(-1), np.stack([u, v], 1).reshape(-1)]).tobytes()
+        frame, bgr = decode_frame(nv12, spec(Frame_Format='nv12', Frame_Shape='8,12'))
+        assert not bgr
+        expected = cv2.cvtColor(np.frombuffer(nv12, np.uint8).reshape(12, 12), cv2.COLOR_YUV2RGB_NV12)
+        assert np.array_equal(frame, expected)
+        assert np.abs(frame.astype(int) - rgb).mean() < 4
+
+    def test_pixel_budget(self, monkeypatch):
+        """Un cuadro sobre el presupuesto de píxeles se rechaza antes de leerlo"""
+        monkeypatch.setattr('app.rawframes.max_pixels', 10)
+        with pytest.raises(ImageTooLarge):
+            decode_frame(b'', spec(Frame_Format='rgb', Frame_Shape='4,4'))
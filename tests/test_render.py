@@ -0,0 +1,69 @@
+import io
+import threading
+
+import cv2
+
+import numpy as np
+from PIL import Image
+
+from app.render import LabelSprites, annotate, encode, font
+
+
+class TestRender:
+    """Pruebas del dibujo de detecciones"""
+
+    class_names = ['person', 'car']
+    colors = {'person': [255, 0, 0], 'car': [0, 255, 0]}
+
+    def test_sprites_cached(self):
+        """Cada clase se rasteriza una sola vez y el puntaje no agrega entradas por valor"""
+        sprites = LabelSprites()
+        first = sprites.get('person', [255, 0, 0])
+        assert sprites.get('person', [255, 0, 0]) is first
+        for score in np.linspace(0, 1, 101):
+            label = sprites.get('person', [255, 0, 0], score=score)
+        # 'person' y la tira de glifos de su color
+        assert len(sprites) == 2
+        full = cv2.getTextSize('person 1.00', font, sprites.font_scale, sprites.thickness)[0][0] + 2
+        assert label.shape[0] == first.shape[0] and abs(label.shape[1] - full) <= 0.1 * full
+
+    def test_sprites_thread_safe(self):
+        """Hilos que comparten una caché chica no fallan al desalojar entradas"""
+        sprites = LabelSprites(maxsize=4)
+        errors = []
+
+        def draw(i):
+            try:
+                for n in range(300):
+                    sprites.get(f'clase{(i + n) % 7}', [n % 255, 0, 0], score=n / 300)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=draw, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not errors and len(sprites) <= 4
+
+    def test_annotate_preview_size(self):
+        """Con max_dim la imagen anotada se entrega reducida"""
+        img = np.zeros((1000, 2000, 3), np.uint8)
+        outputs = np.array([[0, 100, 100, 300, 300, 0, 0.9]], np.float32)
+        canvas = annotate(img, outputs, 1.0, (0.0, 0.0), self.class_names, self.colors, max_dim=500)
+        assert canvas.shape == (250, 500, 3)
+        # El borde de la caja se dibuja en coordenadas reducidas
+        assert canvas[25, 30:70].any()
+
+    def test_annotate_does_not_modify_input(self):
+        """La imagen original no se modifica"""
+        img = np.zeros((200, 200, 3), np.uint8)
+        outputs = np.array([[0, 10, 10, 50, 50, 1, 0.8]], np.float32)
+        annotate(img, outputs, 1.0, (0.0, 0.0), self.class_names, self.colors)
+        assert not img.any()
+
+    def test_encode_webp(self):
+        """La imagen se codifica en el formato pedido"""
+        data, mimetype = encode(np.zeros((64, 64, 3), np.uint8), 'webp', 80)
+        assert mimetype == 'image/webp'
+        assert Image.open(io.BytesIO(data)).format == 'WEBP'
@@ -0,0 +1,195 @@
+import io
+import os
+import json
+import time
+import signal
+import multiprocessing as mp
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.loadtest import free_port
+from app.router import HashRing, Router, create_app
+
+
+def serve(name, port):
+    # Worker mínimo: responde su nombre; ?sleep=S demora la respuesta, ?size=N responde
+    # N bytes y /drop corta la conexión después de leer la petición
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.reply()
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self.reply()
+
+        def reply(self):
+            if self.path.startswith('/drop'):
+                self.close_connection = True
+                return
+            if 'sleep=' in self.path:
+                time.sleep(float(self.path.split('sleep=')[1]))
+            if 'size=' in self.path:
+                body = name.encode() * int(self.path.split('size=')[1])
+            else:
+                body = json.dumps({'name': name, 'path': self.path}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer(('127.0.0.1', port), Handler).serve_forever()
+
+
+@pytest.fixture
+def workers():
+    ctx = mp.get_context('fork')
+    ports = [free_port() for _ in range(3)]
+    procs = [ctx.Process(target=serve, args=(f'w{i}', port), daemon=True) for i, port in enumerate(ports)]
+    for proc in procs:
+        proc.start()
+    router = Router([f'http://127.0.0.1:{port}' for port in ports], capacity=2, interval=0, threshold=2)
+    deadline = time.time() + 10
+    while not all(router.check(b) for b in router.backends.values()) and time.time() < deadline:
+        time.sleep(0.05)
+    yield router, procs
+    for proc in procs:
+        if proc.is_alive():
+            os.kill(proc.pid, signal.SIGKILL)
+        proc.join()
+
+
+def upload(client, data, **kwargs):
+    # buffered: el cliente de pruebas cierra la respuesta como lo haría el servidor WSGI
+    return client.post('/detect-count', data={'image': (io.BytesIO(data), 'a.jpg')}, buffered=True, **kwargs)
+
+
+class TestHashRing:
+    """Pruebas del anillo de hashing consistente"""
+
+    def test_balance_and_minimal_movement(self):
+        """Las claves se reparten entre los workers y al quitar uno solo se mueven las suyas"""
+        ring = HashRing(['w0', 'w1', 'w2', 'w3'])
+        keys = [f'imagen-{i}' for i in range(4000)]
+        before = {key: ring.preference(key)[0] for key in keys}
+        assert min(Counter(before.values()).values()) > 500
+        ring.remove('w2')
+        after = {key: ring.preference(key)[0] for key in keys}
+        moved = [key for key in keys if before[key] != after[key]]
+        assert all(before[key] == 'w2' for key in moved)
+        # El reemplazo es el siguiente del anillo original
+        ring.add('w2')
+        assert {key: ring.preference(key)[0] for key in keys} == before
+        assert sorted(ring.preference('x')) == ['w0', 'w1', 'w2', 'w3']
+
+
+class TestRouter:
+    """Pruebas del router con procesos worker locales"""
+
+    def test_affinity_by_content_and_source(self, workers):
+        """La misma imagen y la misma fuente van siempre al mismo worker"""
+        router, _ = workers
+        client = create_app(router).test_client()
+        names = {upload(client, b'imagen-1').headers['X-Routed-To'] for _ in range(5)}
+        assert len(names) == 1
+        # Otra subida del mismo contenido con otro nombre de archivo
+        response = client.post('/detect-count', data={'image': (io.BytesIO(b'imagen-1'), 'otra.png')},
+                               buffered=True)
+        assert response.headers['X-Routed-To'] in names
+        spread = {upload(client, f'imagen-{i}'.encode()).headers['X-Routed-To'] for i in range(30)}
+        assert len(spread) == 3
+
+        source = {upload(client, f'cuadro-{i}'.encode(), headers={'X-Source': 'cam1'}).headers['X-Routed-To']
+                  for i in range(10)}
+        assert len(source) == 1
+        assert client.get('/sources/cam1', buffered=True).headers['X-Routed-To'] in source
+        response = client.get('/counts?source=cam1&resolution=hour', buffered=True)
+        assert json.loads(response.data)['path'] == '/counts?source=cam1&resolution=hour'
+
+    def test_source_created_on_its_worker(self, workers):
+        """El alta de una fuente (id en el JSON) va al worker que después atiende /sources/<id>"""
+        router, _ = workers
+        client = create_app(router).test_client()
+        for source_id in ('cam1', 'cam2', 'cam3', 'cam4'):
+            created = client.post('/sources', json={'id': source_id, 'url': 'rtsp://camara'}, buffered=True)
+            fetched = client.get(f'/sources/{source_id}', buffered=True)
+            assert created.headers['X-Routed-To'] == fetched.headers['X-Routed-To']
+
+    def test_response_streamed(self, workers):
+        """La respuesta del worker se pasa por partes y el worker cuenta como ocupado hasta cerrarla"""
+        router, _ = workers
+        client = create_app(router).test_client()
+        response = client.get('/grande?size=200000', buffered=False)
+        backend = router.backends[response.headers['X-Routed-To']]
+        assert response.is_streamed
+        assert backend.inflight == 1
+        assert len(response.get_data()) == 400000
+        response.close()
+        assert backend.inflight == 0
+
+    def test_no_replay_after_send(self, workers):
+        """Si el worker corta la conexión después de recibir el POST, no se reenvía a otro"""
+        router, _ = workers
+        client = create_app(router).test_client()
+        response = client.post('/drop', data={'image': (io.BytesIO(b'imagen'), 'a.jpg')})
+        assert response.status_code == 502
+        stats = router.stats()
+        assert stats['routing']['retries'] == 0
+        assert sum(b['inflight'] for b in stats['backends'].values()) == 0
+        assert sum(b['failures'] for b in stats['backends'].values()) == 1
+
+    def test_spill_when_saturated(self, workers):
+        """Con el preferido saturado la petición va a otro worker"""
+        router, _ = workers
+        key = 'image:abc'
+        preferred = router.choose(key)
+        router.choose(key)
+        assert router.backends[preferred.name].inflight == 2
+        other = router.choose(key)
+        assert other is not preferred
+        assert router.stats()['routing']['spill'] == 1
+        for backend in (preferred, preferred, other):
+            router.release(backend)
+
+    def test_failover_and_recovery(self, workers):
+        """Un worker caído sale del anillo sin que fallen peticiones y vuelve al responder"""
+        router, procs = workers
+        client = create_app(router).test_client()
+        victim = upload(client, b'imagen-fija').headers['X-Routed-To']
+        os.kill(procs[int(victim[1:])].pid, signal.SIGKILL)
+        procs[int(victim[1:])].join()
+
+        response = upload(client, b'imagen-fija')
+        assert response.status_code == 200
+        assert response.headers['X-Routed-To'] != victim
+        stats = router.stats()
+        assert not stats['backends'][victim]['healthy'] and stats['routing']['retries'] == 1
+
+        router.check_all()
+        assert not router.backends[victim].healthy
+        assert all(upload(client, f'x{i}'.encode()).status_code == 200 for i in range(10))
+
+        # Un nuevo proceso en el mismo puerto vuelve a recibir sus claves
+        port = int(router.backends[victim].url.rsplit(':', 1)[1])
+        procs[int(victim[1:])] = mp.get_context('fork').Process(target=serve, args=(victim, port), daemon=True)
+        procs[int(victim[1:])].start()
+        deadline = time.time() + 10
+        while not router.check(router.backends[victim]) and time.time() < deadline:
+            time.sleep(0.05)
+        assert upload(client, b'imagen-fija').headers['X-Routed-To'] == victim
+
+    def test_no_workers(self, workers):
+        """Sin workers sanos el router responde 503"""
+        router, procs = workers
+        for proc in procs:
+            os.kill(proc.pid, signal.SIGKILL)
+            proc.join()
+        router.check_all()
+        router.check_all()
+        response = upload(create_app(router).test_client(), b'imagen')
+        assert response.status_code == 503
@@ -0,0 +1,31 @@
+import numpy as np
+
+from app.sharedmodel import measure, worker_memory
+
+
+class FakeModel:
+    """Modelo con 64 MB de pesos de solo lectura"""
+
+    def __init__(self):
+        self.weights = np.ones(16 * 1024 * 1024, np.float32)
+
+    def run(self, blob):
+        return float(self.weights[:10].sum())
+
+
+class TestSharedModel:
+    """Pruebas de la medición de memoria por worker"""
+
+    def test_worker_memory_fields(self):
+        """Se reportan USS, PSS y RSS en MB"""
+        mem = worker_memory()
+        assert set(mem) == {'uss_mb', 'pss_mb', 'rss_mb'}
+        assert mem['rss_mb'] >= mem['uss_mb'] > 0
+
+    def test_preload_shares_weights(self):
+        """Con el modelo precargado los workers no duplican los pesos"""
+        private = measure('private', 2, FakeModel, runs=1, size=32)
+        preload = measure('preload', 2, FakeModel, runs=1, size=32)
+        assert len(private) == len(preload) == 2
+        assert all(r['uss_mb'] > 60 for r in private)
+        assert all(r['uss_mb'] < 30 for r in preload)